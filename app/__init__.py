@@ -1,4 +1,8 @@
 from .db import DatabaseConnection, DatabaseOperations
 from .authentication import AuthenticationManager
+from .balance import BalanceCalculator
+from .maintenance import StaffPurger
+from .importer import PunchImporter
+from .scheduler import Scheduler
 
-__all__ = ['DatabaseConnection', 'DatabaseOperations', 'AuthenticationManager']
\ No newline at end of file
+__all__ = ['DatabaseConnection', 'DatabaseOperations', 'AuthenticationManager', 'BalanceCalculator', 'StaffPurger', 'PunchImporter', 'Scheduler']
\ No newline at end of file
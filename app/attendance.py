@@ -0,0 +1,283 @@
+import os
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from dotenv import load_dotenv
+from .db import DatabaseOperations
+
+load_dotenv()
+
+# Minutes after the configured start time before a time in counts as late
+LATE_GRACE_MINUTES = int(os.getenv("LATE_GRACE_MINUTES", "5"))
+# Month calendars kept per worker; entries are keyed by the data versions they
+# were computed from, so a write makes them unreachable rather than stale
+CALENDAR_CACHE_SIZE = int(os.getenv("CALENDAR_CACHE_SIZE", "256"))
+
+# First WorkingHours row per day type, as everywhere else
+WORKING_CALENDAR = """
+    SELECT w.day_type, w.start_time
+    FROM WorkingHours w
+    WHERE w.id = (SELECT MIN(w2.id) FROM WorkingHours w2 WHERE w2.day_type = w.day_type)
+"""
+
+# One row per user and day of the range. %(rows)s is the per-user-day
+# aggregate of Timesheet (and TimesheetArchive), %(users)s the user filter.
+MONTH_CALENDAR_QUERY = """
+    WITH RECURSIVE days (day) AS (
+        SELECT CAST(%%s AS DATE)
+        UNION ALL
+        SELECT day + INTERVAL 1 DAY FROM days WHERE day < %%s
+    )
+    SELECT u.user_id, u.username, d.day, t.time_in, t.time_out, t.worked_minutes,
+        CASE
+            WHEN d.day < u.employment_date THEN 'not_employed'
+            WHEN t.holiday THEN 'holiday'
+            WHEN t.leave_entry THEN 'leave'
+            WHEN DAYOFWEEK(d.day) = 1 THEN 'sunday'
+            WHEN EXISTS (
+                SELECT 1 FROM LeaveRecord l
+                WHERE l.user_id = u.user_id AND l.status = 'Approved'
+                AND d.day BETWEEN l.start_date AND l.end_date
+            ) THEN 'leave'
+            WHEN t.time_in IS NOT NULL AND w.start_time IS NOT NULL
+                AND t.time_in > TIMESTAMP(d.day, w.start_time) + INTERVAL %%s MINUTE THEN 'late'
+            WHEN t.time_in IS NOT NULL THEN 'present'
+            WHEN d.day > %%s THEN 'upcoming'
+            WHEN d.day = %%s THEN 'not_in_yet'
+            ELSE 'absent'
+        END AS status
+    FROM User u
+    CROSS JOIN days d
+    LEFT JOIN (
+        SELECT user_id, date, MIN(time_in) AS time_in, MAX(time_out) AS time_out,
+            SUM(CASE WHEN entry_type = 'Work' THEN worked_minutes END) AS worked_minutes,
+            MAX(entry_type = 'Holiday') AS holiday, MAX(entry_type = 'Leave') AS leave_entry
+        FROM (%(rows)s) rows_in_range
+        GROUP BY user_id, date
+    ) t ON t.user_id = u.user_id AND t.date = d.day
+    LEFT JOIN (%(calendar)s) w
+        ON w.day_type = CASE WHEN DAYOFWEEK(d.day) = 7 THEN 'Saturday' ELSE 'Weekday' END
+    WHERE u.deleted_at IS NULL AND %(users)s
+    ORDER BY u.username, u.user_id, d.day
+"""
+
+# Staff with an exception on one day, from one pass over that day's rows.
+# absent is an anti-join: no Work time in, no leave or holiday entry and no
+# approved leave covering the day. The %%s thresholds come from the cached
+# working hours: late after, whether the shift has started (plus grace) and
+# whether it has ended, so today only counts people once it matters.
+DAY_EXCEPTIONS_QUERY = """
+    SELECT u.user_id, u.username, t.time_in, COALESCE(t.open_entries, 0) AS open_entries,
+        (t.time_in IS NULL AND COALESCE(t.day_off, 0) = 0 AND %%s AND NOT EXISTS (
+            SELECT 1 FROM LeaveRecord l
+            WHERE l.user_id = u.user_id AND l.status = 'Approved'
+            AND %%s BETWEEN l.start_date AND l.end_date
+        )) AS absent,
+        COALESCE(t.time_in > %%s, 0) AS late,
+        (COALESCE(t.open_entries, 0) > 0 AND %%s) AS missing_time_out
+    FROM User u
+    LEFT JOIN (
+        SELECT user_id, MIN(CASE WHEN entry_type = 'Work' THEN time_in END) AS time_in,
+            SUM(entry_type = 'Work' AND time_in IS NOT NULL AND time_out IS NULL) AS open_entries,
+            MAX(entry_type IN ('Holiday', 'Leave')) AS day_off
+        FROM (%(rows)s) rows_on_day
+        GROUP BY user_id
+    ) t ON t.user_id = u.user_id
+    WHERE u.role = 'Staff' AND u.deleted_at IS NULL AND u.employment_date <= %%s
+    HAVING absent OR late OR missing_time_out
+    ORDER BY u.username, u.user_id
+"""
+
+TIMESHEET_ROWS = "SELECT user_id, date, time_in, time_out, worked_minutes, entry_type FROM {table} WHERE date BETWEEN %s AND %s"
+
+
+def month_bounds(month):
+    """First and last day of the month containing month (a date)"""
+    first = month.replace(day=1)
+    last = (first + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    return first, last
+
+
+class VersionedCache:
+    """Small thread-safe LRU whose keys include the data versions of their value"""
+
+    def __init__(self, size=CALENDAR_CACHE_SIZE):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+
+class AttendanceCalendar:
+    """Per-day attendance status for a month, for one user or a team
+
+    Each day is one of present, late, absent, leave, holiday, sunday,
+    not_in_yet (today, no time in yet), upcoming or not_employed. The whole
+    grid comes from one set-based query: the month's days crossed with the
+    users, joined to their aggregated timesheet rows and to the working
+    calendar for the late check. exceptions() gives the absent, late and
+    missing time-out lists for a single day the same way.
+    """
+
+    def __init__(self, db=None, cache=None):
+        self.db = db or DatabaseOperations()
+        self.cache = cache if cache is not None else VersionedCache()
+
+    def month(self, month, user_id=None, user_ids=None, versions=None):
+        """Calendar for the month containing month
+
+        Args:
+            month: datetime.date in the month
+            user_id: one user; otherwise user_ids, or every active staff member
+            versions: get_data_versions() for the same user, if already read
+
+        Returns:
+            list of {'user_id', 'username', 'days': [...], 'summary': {status: count}},
+            None on a database error
+        """
+        first, last = month_bounds(month)
+        today = datetime.now().date()
+        if user_id is not None:
+            user_ids = [int(user_id)]
+        elif user_ids is not None:
+            user_ids = sorted({int(uid) for uid in user_ids})
+
+        single = user_ids is not None and len(user_ids) == 1
+        if versions is None:
+            versions = self.db.get_data_versions(user_ids[0] if single else None)
+        key = None
+        if versions is not None:
+            # A single user's calendar only changes with their data or the settings
+            scope = (versions['user'], versions['settings']) if single else (versions['global'],)
+            key = (first, today, tuple(user_ids) if user_ids else None, scope)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        # Cached under the versions, which are read on the primary
+        calendar = self._load(first, last, today, user_ids, read_only=key is None)
+        if calendar is not None and key is not None:
+            self.cache.put(key, calendar)
+        return calendar
+
+    def _load(self, first, last, today, user_ids, read_only=True):
+        if user_ids:
+            placeholders = ', '.join(['%s'] * len(user_ids))
+            users_sql, user_params = f"u.user_id IN ({placeholders})", tuple(user_ids)
+            row_filter = f" AND user_id IN ({placeholders})"
+        else:
+            users_sql, user_params = "u.role = 'Staff'", ()
+            row_filter = ""
+
+        tables = ['Timesheet']
+        if self.db._spans_archive(first):
+            tables.append('TimesheetArchive')
+        rows_sql = " UNION ALL ".join(TIMESHEET_ROWS.format(table=table) + row_filter for table in tables)
+        rows_params = (first, last) + user_params
+
+        query = MONTH_CALENDAR_QUERY % {'rows': rows_sql, 'calendar': WORKING_CALENDAR, 'users': users_sql}
+        params = (first, last, LATE_GRACE_MINUTES, today, today) + rows_params * len(tables) + user_params
+        success, result = self.db.execute_query(query, params, read_only=read_only)
+        if not success:
+            return None
+
+        calendar = []
+        for row in result or []:
+            if not calendar or calendar[-1]['user_id'] != row['user_id']:
+                calendar.append({'user_id': row['user_id'], 'username': row['username'], 'days': [], 'summary': {}})
+            entry = calendar[-1]
+            entry['days'].append({
+                'date': row['day'].strftime('%Y-%m-%d') if isinstance(row['day'], date) else str(row['day']),
+                'status': row['status'],
+                'time_in': row['time_in'].strftime('%I:%M %p') if row['time_in'] else None,
+                'time_out': row['time_out'].strftime('%I:%M %p') if row['time_out'] else None,
+                'hours': round(int(row['worked_minutes']) / 60, 2) if row['worked_minutes'] is not None else None
+            })
+            entry['summary'][row['status']] = entry['summary'].get(row['status'], 0) + 1
+        return calendar
+
+    def day_phase(self, day):
+        """(shift started plus grace, shift ended) for day, None when it has no shift
+
+        Past days are (True, True); today depends on the clock, so callers
+        caching today's exceptions include this in their key.
+        """
+        if day.weekday() == 6:
+            return None
+        hours = self.db.get_working_hours_for_date(day)
+        if not hours:
+            return None
+        now = datetime.now()
+        start = datetime.combine(day, datetime.min.time()) + hours['start_time']
+        end = datetime.combine(day, datetime.min.time()) + hours['end_time']
+        return now >= start + timedelta(minutes=LATE_GRACE_MINUTES), now >= end
+
+    def exceptions(self, day, versions=None):
+        """Absent, late and missing time-out staff for one day
+
+        Args:
+            day: datetime.date, today or earlier
+            versions: get_data_versions() result, if already read
+
+        Returns:
+            dict: {'absent', 'late', 'missing_time_out'}, each a list of
+            {'user_id', 'username', 'time_in'}; None on a database error
+        """
+        result = {'absent': [], 'late': [], 'missing_time_out': []}
+        phase = self.day_phase(day)
+        if phase is None or day > datetime.now().date():
+            return result
+
+        if versions is None:
+            versions = self.db.get_data_versions()
+        key = None
+        if versions is not None:
+            key = ('exceptions', day, phase, versions['global'])
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        hours = self.db.get_working_hours_for_date(day)
+        late_after = datetime.combine(day, datetime.min.time()) + hours['start_time'] + timedelta(minutes=LATE_GRACE_MINUTES)
+        started, ended = phase
+
+        tables = ['Timesheet']
+        if self.db._spans_archive(day):
+            tables.append('TimesheetArchive')
+        rows_sql = " UNION ALL ".join(
+            f"SELECT user_id, time_in, time_out, entry_type FROM {table} WHERE date = %s" for table in tables
+        )
+        query = DAY_EXCEPTIONS_QUERY % {'rows': rows_sql}
+        params = (started, day, late_after, ended) + (day,) * len(tables) + (day,)
+        # Cached under the versions, which are read on the primary
+        success, rows = self.db.execute_query(query, params, read_only=key is None)
+        if not success:
+            return None
+
+        for row in rows or []:
+            entry = {
+                'user_id': row['user_id'],
+                'username': row['username'],
+                'time_in': row['time_in'].strftime('%I:%M %p') if row['time_in'] else None
+            }
+            for kind in result:
+                if row[kind]:
+                    result[kind].append(entry)
+        if key is not None:
+            self.cache.put(key, result)
+        return result
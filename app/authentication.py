@@ -2,6 +2,7 @@ import bcrypt
 import jwt
 from datetime import datetime, timedelta
 from .db import DatabaseOperations
+from .events import broker
 import os
 from dotenv import load_dotenv
 
@@ -79,6 +80,8 @@ class AuthenticationManager:
         if not success:
             return False, "Failed to register user"
 
+        self.db.bump_data_version()
+        broker.publish('staff_added', {'email': email})
         return True, None
 
     def require_auth(self, token):
@@ -0,0 +1,534 @@
+import numpy as np
+from datetime import datetime, timedelta
+from .db import DatabaseOperations, QueryBuilder, PAID_ENTRY_TYPES, SETTINGS_VERSION
+
+# date.fromordinal(1) is a Monday, so (ordinal - 1) % 7 gives 0=Monday ... 6=Sunday
+SATURDAY = 5
+SUNDAY = 6
+
+
+def weekday_of(ordinals):
+    """Weekday (0=Monday ... 6=Sunday) for an array of proleptic Gregorian ordinals"""
+    return (ordinals - 1) % 7
+
+
+def working_minutes_by_day_type(working_hours):
+    """Map each configured day type to its expected working minutes
+
+    Mirrors DatabaseOperations.get_expected_working_minutes: only the hour and
+    minute of the configured times are used and the first row per day type wins.
+
+    Args:
+        working_hours: rows with day_type, start_time and end_time (timedelta)
+
+    Returns:
+        dict: {'Weekday': int, 'Saturday': int}, day types without a row are omitted
+    """
+    minutes = {}
+    for row in working_hours:
+        if row['day_type'] in minutes:
+            continue
+        start_seconds = int(row['start_time'].total_seconds())
+        end_seconds = int(row['end_time'].total_seconds())
+        start_minutes = (start_seconds // 3600) * 60 + (start_seconds % 3600) // 60
+        end_minutes = (end_seconds // 3600) * 60 + (end_seconds % 3600) // 60
+        minutes[row['day_type']] = end_minutes - start_minutes
+    return minutes
+
+
+def expected_calendar(first_ordinal, last_ordinal, day_minutes):
+    """Build the expected-minutes and has-configuration arrays for a day range
+
+    Sundays expect 0 minutes. A day type without a WorkingHours row expects 0
+    minutes and credits no worked time, as in the day-by-day implementation.
+
+    Returns:
+        tuple: (expected minutes as int64 array, has-configuration bool array)
+    """
+    ordinals = np.arange(first_ordinal, last_ordinal + 1, dtype=np.int64)
+    weekdays = weekday_of(ordinals)
+    saturday = weekdays == SATURDAY
+    weekday = weekdays < SATURDAY
+
+    expected = np.zeros(len(ordinals), dtype=np.int64)
+    configured = np.zeros(len(ordinals), dtype=bool)
+    if 'Weekday' in day_minutes:
+        expected[weekday] = day_minutes['Weekday']
+        configured |= weekday
+    if 'Saturday' in day_minutes:
+        expected[saturday] = day_minutes['Saturday']
+        configured |= saturday
+    return expected, configured
+
+
+def compute_balances(starts, ends, day_minutes,
+                     leave_users, leave_starts, leave_ends,
+                     ts_users, ts_days, ts_minutes, ts_paid,
+                     segments=None):
+    """Compute minutes owed for many users at once with array operations
+
+    Every day argument is a proleptic Gregorian ordinal (date.toordinal()).
+
+    Args:
+        starts, ends: per-user inclusive balance range
+        day_minutes: output of working_minutes_by_day_type
+        leave_users, leave_starts, leave_ends: approved leaves, one entry per leave
+        ts_users, ts_days, ts_minutes, ts_paid: closed timesheet rows in
+            timesheet_id order with worked minutes and whether the row is a paid
+            leave or holiday day; only the first row per user and day is used
+        segments: optional (users, starts, ends) arrays of sub-ranges, clipped to
+            the users' ranges; when given, one total per segment is returned
+
+    Returns:
+        np.ndarray: int64 minutes owed per user or per segment (positive = owes time)
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    if segments is None:
+        segment_users = np.arange(len(starts), dtype=np.int64)
+        segment_starts, segment_ends = starts, ends
+    else:
+        segment_users, segment_starts, segment_ends = (np.asarray(column, dtype=np.int64) for column in segments)
+        segment_starts = np.maximum(segment_starts, starts[segment_users])
+        segment_ends = np.minimum(segment_ends, ends[segment_users])
+    if len(starts) == 0 or len(segment_users) == 0:
+        return np.zeros(len(segment_users), dtype=np.int64)
+
+    origin = int(starts.min())
+    last = max(int(ends.max()), int(starts.max()))
+    width = last - origin + 1
+    expected, configured = expected_calendar(origin, last, day_minutes)
+
+    # Approved leave days: actual = expected
+    leave_users = np.asarray(leave_users, dtype=np.int64)
+    leave_lo = np.maximum(np.asarray(leave_starts, dtype=np.int64), starts[leave_users])
+    leave_hi = np.minimum(np.asarray(leave_ends, dtype=np.int64), ends[leave_users])
+    keep = leave_lo <= leave_hi
+    leave_users, leave_lo, leave_hi = leave_users[keep], leave_lo[keep], leave_hi[keep]
+    lengths = leave_hi - leave_lo + 1
+    total = int(lengths.sum())
+    if total:
+        run_offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+        leave_days = np.repeat(leave_lo, lengths) + (np.arange(total) - run_offsets)
+        leave_keys = np.unique(np.repeat(leave_users, lengths) * width + (leave_days - origin))
+    else:
+        leave_keys = np.zeros(0, dtype=np.int64)
+    leave_credit = expected[leave_keys % width]
+
+    # Timesheet days: first closed row per user and day, Sundays and leave days excluded
+    ts_users = np.asarray(ts_users, dtype=np.int64)
+    ts_days = np.asarray(ts_days, dtype=np.int64)
+    ts_minutes = np.asarray(ts_minutes, dtype=np.int64)
+    ts_paid = np.asarray(ts_paid, dtype=bool)
+    keep = (
+        (ts_days >= starts[ts_users])
+        & (ts_days <= ends[ts_users])
+        & (weekday_of(ts_days) != SUNDAY)
+    )
+    ts_users, ts_days, ts_minutes, ts_paid = ts_users[keep], ts_days[keep], ts_minutes[keep], ts_paid[keep]
+    ts_keys = ts_users * width + (ts_days - origin)
+    ts_keys, first = np.unique(ts_keys, return_index=True)
+    ts_minutes, ts_paid = ts_minutes[first], ts_paid[first]
+    not_leave = ~np.isin(ts_keys, leave_keys, assume_unique=True)
+    ts_keys, ts_minutes, ts_paid = ts_keys[not_leave], ts_minutes[not_leave], ts_paid[not_leave]
+    ts_credit = np.where(
+        ts_paid,
+        expected[ts_keys % width],
+        np.where(configured[ts_keys % width], ts_minutes, 0)
+    )
+
+    # Range sums: prefix sums over the calendar and over the sorted (user, day) credits
+    credit_keys = np.concatenate((leave_keys, ts_keys))
+    order = np.argsort(credit_keys, kind='stable')
+    credit_keys = credit_keys[order]
+    credit_cumulative = np.concatenate(([0], np.cumsum(np.concatenate((leave_credit, ts_credit))[order])))
+    expected_cumulative = np.concatenate(([0], np.cumsum(expected)))
+
+    valid = segment_starts <= segment_ends
+    lo = np.where(valid, segment_starts - origin, 0)
+    hi = np.where(valid, segment_ends - origin, 0)
+    expected_total = expected_cumulative[hi + 1] - expected_cumulative[lo]
+    credited_total = (
+        credit_cumulative[np.searchsorted(credit_keys, segment_users * width + hi, side='right')]
+        - credit_cumulative[np.searchsorted(credit_keys, segment_users * width + lo, side='left')]
+    )
+    return np.where(valid, expected_total - credited_total, 0).astype(np.int64)
+
+
+def month_end(day):
+    """Last day of the month containing `day`"""
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+
+
+def month_end_on_or_before(day):
+    """`day` itself if it is a month end, otherwise the last day of the previous month"""
+    return day if month_end(day) == day else day.replace(day=1) - timedelta(days=1)
+
+
+def month_ends_between(first_day, last_day):
+    """Month-end dates m with first_day <= m <= last_day"""
+    month_ends = []
+    current = month_end(first_day)
+    while current <= last_day:
+        month_ends.append(current)
+        current = month_end(current + timedelta(days=1))
+    return month_ends
+
+
+STAFF_BALANCE_RANGE_QUERY = QueryBuilder(
+    """
+    SELECT u.user_id, u.username, u.employment_date, MAX(t.date) as last_date
+    FROM User u
+    LEFT JOIN Timesheet t ON t.user_id = u.user_id
+    """,
+    required=["u.role = 'Staff'", "u.deleted_at IS NULL"],
+    filters={'user_id': "u.user_id = %s"},
+    suffix="GROUP BY u.user_id, u.username, u.employment_date ORDER BY u.user_id",
+    index='idx_timesheet_user_date'
+)
+
+
+class BalanceCalculator:
+    """Vectorized replacement for the day-by-day balance loops in DatabaseOperations
+
+    Loads timesheet minutes, approved leaves and the working-hours calendar in a
+    handful of queries and computes balances with compute_balances. Results are
+    identical to DatabaseOperations.calculate_time_owed and get_all_staff_time_owed.
+
+    Balances measured from the employment date are checkpointed per user at each
+    closed month end in BalanceCheckpoint, so only the days after the latest
+    checkpoint are scanned. DatabaseOperations deletes checkpoints at or after
+    any date touched by a backdated write, and a checkpoint is only saved if no
+    write bumped the user's data version while it was being computed.
+    """
+
+    CHECKPOINT_BATCH_SIZE = 1000
+
+    def __init__(self, db=None):
+        self.db = db or DatabaseOperations()
+
+    @staticmethod
+    def _user_filter(column, user_ids):
+        placeholders = ', '.join(['%s'] * len(user_ids))
+        return f"{column} IN ({placeholders})", tuple(user_ids)
+
+    def _load_day_minutes(self):
+        return working_minutes_by_day_type(self.db.get_working_hours())
+
+    def _load_leaves(self, user_index, start_date, end_date, user_ids=None, read_only=True):
+        """Approved leaves overlapping the range, for all staff or the given users"""
+        if user_ids is None:
+            query = """
+                SELECT l.user_id, l.start_date, l.end_date
+                FROM LeaveRecord l
+                JOIN User u ON l.user_id = u.user_id
+                WHERE l.status = 'Approved'
+                AND l.start_date <= %s AND l.end_date >= %s
+                AND u.role = 'Staff'
+                AND u.deleted_at IS NULL
+            """
+            params = (end_date, start_date)
+        else:
+            user_clause, user_params = self._user_filter('user_id', user_ids)
+            query = f"""
+                SELECT user_id, start_date, end_date
+                FROM LeaveRecord
+                WHERE {user_clause}
+                AND status = 'Approved'
+                AND start_date <= %s AND end_date >= %s
+            """
+            params = user_params + (end_date, start_date)
+        success, leaves = self.db.execute_query(query, params, read_only=read_only)
+        leaves = [leave for leave in (leaves if success and leaves else []) if leave['user_id'] in user_index]
+        return (
+            [user_index[leave['user_id']] for leave in leaves],
+            [leave['start_date'].toordinal() for leave in leaves],
+            [leave['end_date'].toordinal() for leave in leaves]
+        )
+
+    def _load_timesheets(self, user_index, start_date, end_date, user_ids=None, read_only=True):
+        """Closed timesheet rows in the range, for all staff or the given users
+
+        Archived rows are included when the range reaches the archive.
+        """
+        tables = ['Timesheet']
+        watermark = self.db.get_archive_watermark()
+        if watermark is not None and start_date <= watermark:
+            tables.append('TimesheetArchive')
+
+        parts = []
+        params = ()
+        for table in tables:
+            if user_ids is None:
+                parts.append(f"""
+                    SELECT t.timesheet_id, t.user_id, t.date, t.worked_minutes, t.entry_type
+                    FROM {table} t
+                    JOIN User u ON t.user_id = u.user_id
+                    WHERE t.date BETWEEN %s AND %s
+                    AND t.worked_minutes IS NOT NULL
+                    AND u.role = 'Staff'
+                    AND u.deleted_at IS NULL
+                """)
+                params += (start_date, end_date)
+            else:
+                user_clause, user_params = self._user_filter('user_id', user_ids)
+                parts.append(f"""
+                    SELECT timesheet_id, user_id, date, worked_minutes, entry_type
+                    FROM {table}
+                    WHERE {user_clause}
+                    AND date BETWEEN %s AND %s
+                    AND worked_minutes IS NOT NULL
+                """)
+                params += user_params + (start_date, end_date)
+        query = " UNION ALL ".join(parts) + " ORDER BY timesheet_id"
+        success, entries = self.db.execute_query(query, params, read_only=read_only)
+        entries = [entry for entry in (entries if success and entries else []) if entry['user_id'] in user_index]
+        return (
+            [user_index[entry['user_id']] for entry in entries],
+            [entry['date'].toordinal() for entry in entries],
+            [entry['worked_minutes'] for entry in entries],
+            [entry['entry_type'] in PAID_ENTRY_TYPES for entry in entries]
+        )
+
+    def _compute(self, users, segments=None, user_ids=None, read_only=True):
+        """Compute balances for rows carrying user_id, start_date and end_date
+
+        Args:
+            users: balance ranges, one per user
+            segments: optional list of (user_id, start_date, end_date) sub-ranges
+            user_ids: restrict loading to these users, None loads all staff
+            read_only: allow loading from the read replica
+
+        Returns:
+            list: minutes owed per user, or per segment when segments are given
+        """
+        if not users or segments == []:
+            return []
+        user_index = {user['user_id']: i for i, user in enumerate(users)}
+        if segments is None:
+            first = min(user['start_date'] for user in users)
+            last = max(user['end_date'] for user in users)
+            segment_arrays = None
+        else:
+            first = min(segment[1] for segment in segments)
+            last = max(segment[2] for segment in segments)
+            segment_arrays = (
+                [user_index[segment[0]] for segment in segments],
+                [segment[1].toordinal() for segment in segments],
+                [segment[2].toordinal() for segment in segments]
+            )
+        owed = compute_balances(
+            [user['start_date'].toordinal() for user in users],
+            [user['end_date'].toordinal() for user in users],
+            self._load_day_minutes(),
+            *self._load_leaves(user_index, first, last, user_ids, read_only),
+            *self._load_timesheets(user_index, first, last, user_ids, read_only),
+            segments=segment_arrays
+        )
+        return [int(minutes) for minutes in owed]
+
+    def _load_latest_checkpoints(self, user_id=None):
+        """Latest checkpoint per user as {user_id: (period_end, minutes_owed)}
+
+        Checkpoints are read from the primary: a lagging replica can still
+        return one that a backdated write has already invalidated.
+        """
+        if user_id is not None:
+            query = """
+                SELECT user_id, period_end, minutes_owed
+                FROM BalanceCheckpoint
+                WHERE user_id = %s
+                ORDER BY period_end DESC
+                LIMIT 1
+            """
+            success, result = self.db.execute_query(query, (user_id,))
+        else:
+            query = """
+                SELECT c.user_id, c.period_end, c.minutes_owed
+                FROM BalanceCheckpoint c
+                JOIN (
+                    SELECT user_id, MAX(period_end) as period_end
+                    FROM BalanceCheckpoint
+                    GROUP BY user_id
+                ) latest ON latest.user_id = c.user_id AND latest.period_end = c.period_end
+            """
+            success, result = self.db.execute_query(query)
+        if not success or not result:
+            return {}
+        return {row['user_id']: (row['period_end'], row['minutes_owed']) for row in result}
+
+    def _load_checkpoint_on_or_before(self, user_id, day):
+        """Latest checkpoint at or before day, from the primary like the others"""
+        query = """
+            SELECT period_end, minutes_owed
+            FROM BalanceCheckpoint
+            WHERE user_id = %s AND period_end <= %s
+            ORDER BY period_end DESC
+            LIMIT 1
+        """
+        success, result = self.db.execute_query(query, (user_id, day))
+        if not success or not result:
+            return None
+        return result[0]['period_end'], result[0]['minutes_owed']
+
+    def _save_checkpoints(self, checkpoints, versions):
+        """Save checkpoints whose inputs have not changed since they were read
+
+        versions is get_balance_versions() read before computing. Each batch
+        re-reads them with a share lock and drops the users whose counter (or
+        the settings counter) moved: a write bumps before it invalidates, so
+        a checkpoint is either skipped here or deleted by that invalidation.
+        """
+        query = """
+            INSERT INTO BalanceCheckpoint (user_id, period_end, minutes_owed)
+            VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE minutes_owed = VALUES(minutes_owed), computed_at = CURRENT_TIMESTAMP
+        """
+
+        def save(batch):
+            def work(cursor):
+                current = self.db.get_balance_versions({row[0] for row in batch}, cursor=cursor)
+                if current[SETTINGS_VERSION] != versions[SETTINGS_VERSION]:
+                    return
+                unchanged = [row for row in batch if current[row[0]] == versions[row[0]]]
+                if unchanged:
+                    cursor.executemany(query, unchanged)
+            return work
+
+        for i in range(0, len(checkpoints), self.CHECKPOINT_BATCH_SIZE):
+            self.db.run_transaction(save(checkpoints[i:i + self.CHECKPOINT_BATCH_SIZE]))
+
+    def _checkpointed_time_owed(self, users, user_ids=None):
+        """Balances from each user's employment date, using and extending checkpoints
+
+        Args:
+            users: rows with user_id, start_date (employment date) and end_date
+            user_ids: restrict loading to these users, None loads all staff
+
+        Returns:
+            list: minutes owed per user
+        """
+        if not users:
+            return []
+        closed_through = datetime.now().date().replace(day=1) - timedelta(days=1)
+        latest = self._load_latest_checkpoints(users[0]['user_id'] if len(users) == 1 else None)
+
+        # Pick the checkpoint each balance starts from
+        bases = {}
+        for user in users:
+            checkpoint = latest.get(user['user_id'])
+            if checkpoint and checkpoint[0] > user['end_date']:
+                checkpoint = self._load_checkpoint_on_or_before(user['user_id'], user['end_date'])
+            bases[user['user_id']] = checkpoint
+
+        # Materialize closed month ends that have no checkpoint yet
+        segments = []
+        for user in users:
+            checkpoint = bases[user['user_id']]
+            begin = checkpoint[0] + timedelta(days=1) if checkpoint else user['start_date']
+            target = min(closed_through, month_end_on_or_before(user['end_date']))
+            for month_end in month_ends_between(begin, target):
+                segments.append((user['user_id'], begin, month_end))
+                begin = month_end + timedelta(days=1)
+
+        if segments:
+            stale_ids = list(dict.fromkeys(segment[0] for segment in segments))
+            stale_users = [user for user in users if user['user_id'] in set(stale_ids)]
+            # Read before the rows they guard, so a write landing in between is detected
+            versions = self.db.get_balance_versions(stale_ids)
+            # Checkpoints outlive replica lag, so they are computed from the primary
+            owed = self._compute(stale_users, segments, user_ids=stale_ids, read_only=False)
+            checkpoints = []
+            for (user_id, _, month_end), minutes in zip(segments, owed):
+                previous = bases[user_id][1] if bases[user_id] else 0
+                bases[user_id] = (month_end, previous + minutes)
+                checkpoints.append((user_id, month_end, previous + minutes))
+            if versions is not None:
+                self._save_checkpoints(checkpoints, versions)
+
+        # Only the days after each checkpoint are scanned for the current balance
+        deltas = [(
+            user['user_id'],
+            bases[user['user_id']][0] + timedelta(days=1) if bases[user['user_id']] else user['start_date'],
+            user['end_date']
+        ) for user in users]
+        owed = self._compute(users, deltas, user_ids=user_ids)
+        return [
+            (bases[user['user_id']][1] if bases[user['user_id']] else 0) + minutes
+            for user, minutes in zip(users, owed)
+        ]
+
+    def calculate_time_owed(self, user_id, start_date=None, end_date=None):
+        """Calculate total time owed by a user, see DatabaseOperations.calculate_time_owed
+
+        Without a start date the balance runs from the employment date and is
+        served from checkpoints.
+
+        Returns:
+            int: Total minutes owed
+        """
+        if not end_date:
+            end_date = datetime.now().date()
+        if not start_date:
+            query = "SELECT employment_date FROM User WHERE user_id = %s"
+            success, result = self.db.execute_query(query, (user_id,))
+            if success and result:
+                users = [{'user_id': user_id, 'start_date': result[0]['employment_date'], 'end_date': end_date}]
+                return self._checkpointed_time_owed(users, user_ids=[user_id])[0]
+            days_to_subtract = 7 if end_date.isoweekday() == 7 else 6
+            start_date = end_date - timedelta(days=days_to_subtract)
+
+        users = [{'user_id': user_id, 'start_date': start_date, 'end_date': end_date}]
+        return self._compute(users, user_ids=[user_id])[0]
+
+    def calculate_staff_time_owed(self, start_date, end_date):
+        """Calculate time owed by every staff member over the same date range
+
+        Returns:
+            dict: {user_id: total minutes owed}
+        """
+        query = "SELECT user_id FROM User WHERE role = 'Staff' AND deleted_at IS NULL ORDER BY user_id"
+        success, staff_users = self.db.execute_query(query, read_only=True)
+        if not success or not staff_users:
+            return {}
+
+        users = [{
+            'user_id': user['user_id'],
+            'start_date': start_date,
+            'end_date': end_date
+        } for user in staff_users]
+        return dict(zip((user['user_id'] for user in users), self._compute(users)))
+
+    def get_all_staff_time_owed(self, user_id=None):
+        """Get time owed for all staff members, see DatabaseOperations.get_all_staff_time_owed
+
+        Args:
+            user_id: int, optionally restrict the result to a single staff member
+
+        Returns a list of dictionaries with:
+            - user_id: int
+            - username: str
+            - total_minutes_owed: int
+        """
+        query, params = STAFF_BALANCE_RANGE_QUERY.build(user_id=user_id)
+        success, staff_users = self.db.execute_query(query, params, read_only=True)
+        if not success:
+            return []
+
+        today = datetime.now().date()
+        users = [{
+            'user_id': user['user_id'],
+            'username': user['username'],
+            'start_date': user['employment_date'],
+            'end_date': user['last_date'] or today
+        } for user in staff_users]
+        owed = self._checkpointed_time_owed(users, user_ids=[user_id] if user_id is not None else None)
+
+        result = [{
+            'user_id': user['user_id'],
+            'username': user['username'],
+            'total_minutes_owed': minutes
+        } for user, minutes in zip(users, owed)]
+
+        # Sort by most time owed
+        return sorted(result, key=lambda x: x['total_minutes_owed'], reverse=True)
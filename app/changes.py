@@ -0,0 +1,174 @@
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from .events import EVENT_PRESENCE_SECONDS, broker
+
+load_dotenv()
+
+# Seconds between ChangeLog polls in each worker, how long rows are kept and
+# how often a worker prunes older ones
+CHANGE_POLL_INTERVAL = float(os.getenv("CHANGE_POLL_INTERVAL", "1"))
+CHANGE_LOG_RETENTION_SECONDS = int(os.getenv("CHANGE_LOG_RETENTION_SECONDS", "3600"))
+CHANGE_LOG_PRUNE_INTERVAL = float(os.getenv("CHANGE_LOG_PRUNE_INTERVAL", "300"))
+CHANGE_POLL_BATCH_SIZE = 500
+# change_ids are allocated at INSERT but visible at COMMIT, so a poll can see
+# a later id before an earlier one. Skipped ids are re-read for this many
+# seconds (an insert that has not committed by then was rolled back), and at
+# most CHANGE_MAX_GAPS of them are tracked at once.
+CHANGE_GAP_SECONDS = float(os.getenv("CHANGE_GAP_SECONDS", "30"))
+CHANGE_MAX_GAPS = 1000
+
+CHANGE_GAP_QUERY = """
+    SELECT change_id, origin, kind, payload FROM ChangeLog
+    WHERE change_id IN ({ids})
+    ORDER BY change_id
+"""
+
+CHANGE_POLL_QUERY = """
+    SELECT change_id, origin, kind, payload FROM ChangeLog
+    WHERE change_id > %s
+    ORDER BY change_id
+    LIMIT %s
+"""
+
+
+class ChangeBus:
+    """Relay broker events between worker processes through the ChangeLog table
+
+    Every event published in one process is appended to ChangeLog; every
+    process polls the table from its own cursor and delivers the rows written
+    by other processes to its local broker. Polls are a primary-key range scan
+    that returns nothing most of the time, so the cost is one cheap query per
+    worker per CHANGE_POLL_INTERVAL and no service beyond MySQL. Events reach
+    other workers within about one poll interval. Ids the cursor jumped over
+    are re-read until they show up or CHANGE_GAP_SECONDS pass, so an insert
+    that commits after a later one is still delivered (possibly out of
+    order).
+
+    While this process has open event streams it announces them every
+    EVENT_PRESENCE_SECONDS, which lets the others skip relaying live-feed
+    events nobody is watching.
+    """
+
+    def __init__(self, db, event_broker=broker, interval=CHANGE_POLL_INTERVAL):
+        self.db = db
+        self.broker = event_broker
+        self.interval = interval
+        self.origin = None
+        self.cursor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._next_prune = 0
+        self._next_announce = 0
+        self._gaps = {}
+
+    def start(self):
+        """Start polling in this process; safe to call again after a fork"""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            # A new origin per process, so forked workers do not skip each other's rows
+            self.origin = uuid.uuid4().hex[:16]
+            self.cursor = None
+            self._gaps = {}
+            self.broker.relay = self.send
+        threading.Thread(target=self._run, name='change-bus', daemon=True).start()
+
+    def send(self, kind, data):
+        """Append an event to ChangeLog for the other processes"""
+        query = "INSERT INTO ChangeLog (origin, kind, payload) VALUES (%s, %s, %s)"
+        if not self.db.execute_query(query, (self.origin, kind, json.dumps(data)), prepared=True)[0]:
+            print(f"Failed to relay {kind} event")
+
+    def poll(self):
+        """Deliver the events other processes wrote since the last poll
+
+        Returns:
+            int: events delivered, None on a database error
+        """
+        if self.cursor is None:
+            success, result = self.db.execute_query("SELECT COALESCE(MAX(change_id), 0) as change_id FROM ChangeLog")
+            if not success:
+                return None
+            self.cursor = result[0]['change_id']
+            return 0
+
+        delivered = self._poll_gaps()
+        if delivered is None:
+            return None
+        while True:
+            success, rows = self.db.execute_query(
+                CHANGE_POLL_QUERY, (self.cursor, CHANGE_POLL_BATCH_SIZE), prepared=True
+            )
+            if not success:
+                return None
+            for row in rows:
+                self._track_gaps(row['change_id'])
+                self.cursor = row['change_id']
+                delivered += self._deliver(row)
+            if len(rows) < CHANGE_POLL_BATCH_SIZE:
+                return delivered
+
+    def _track_gaps(self, change_id):
+        """Remember the ids between the cursor and change_id for re-reading"""
+        deadline = time.monotonic() + CHANGE_GAP_SECONDS
+        first = max(self.cursor + 1, change_id - CHANGE_MAX_GAPS)
+        for missing in range(first, change_id):
+            self._gaps[missing] = deadline
+        while len(self._gaps) > CHANGE_MAX_GAPS:
+            del self._gaps[min(self._gaps)]
+
+    def _poll_gaps(self):
+        """Deliver skipped rows that have committed since; None on a database error"""
+        now = time.monotonic()
+        self._gaps = {change_id: deadline for change_id, deadline in self._gaps.items() if deadline > now}
+        if not self._gaps:
+            return 0
+        ids = tuple(sorted(self._gaps))
+        query = CHANGE_GAP_QUERY.format(ids=', '.join(['%s'] * len(ids)))
+        success, rows = self.db.execute_query(query, ids)
+        if not success:
+            return None
+        delivered = 0
+        for row in rows or []:
+            self._gaps.pop(row['change_id'], None)
+            delivered += self._deliver(row)
+        return delivered
+
+    def _deliver(self, row):
+        if row['origin'] == self.origin:
+            return 0
+        self.broker.deliver(row['kind'], json.loads(row['payload']))
+        return 1
+
+    def prune(self):
+        """Delete ChangeLog rows past the retention, a batch at a time"""
+        cutoff = datetime.now() - timedelta(seconds=CHANGE_LOG_RETENTION_SECONDS)
+        self.db.execute_query("DELETE FROM ChangeLog WHERE created_at < %s LIMIT 1000", (cutoff,))
+
+    def _run(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            try:
+                self.poll()
+                if time.monotonic() >= self._next_announce:
+                    self._next_announce = time.monotonic() + EVENT_PRESENCE_SECONDS
+                    self.broker.announce()
+                if time.monotonic() >= self._next_prune:
+                    self._next_prune = time.monotonic() + CHANGE_LOG_PRUNE_INTERVAL
+                    self.prune()
+            except Exception as e:
+                print(f"Change bus error: {e}")
+            time.sleep(self.interval)
+
+
+def start_change_bus(db):
+    """Start the ChangeLog relay for the shared broker in this process"""
+    bus = ChangeBus(db)
+    bus.start()
+    return bus
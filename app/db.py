@@ -1,41 +1,798 @@
 import mysql.connector
+from mysql.connector import pooling
 from dotenv import load_dotenv
+from collections import OrderedDict
+import base64
+import functools
 import os
+import random
+import threading
+import time
 from datetime import datetime, timedelta
+from .events import broker
+from .refcache import SharedReferenceCache
 
 load_dotenv()
 
+# Timesheet.entry_type values that count as a full paid day
+PAID_ENTRY_TYPES = ('Leave', 'Holiday')
+
+# Page sizes for keyset-paginated history queries
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "50"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "500"))
+
+# Connections kept open per worker process, and server-side prepared statements
+# cached per connection (0 disables the statement cache). The pool defaults to
+# one connection per gunicorn request thread plus headroom for the scheduler and
+# event relay threads; borrowers past it get an unpooled connection without the
+# statement cache, counted in /health as pool_fallbacks. mysql-connector caps
+# pools at CNX_POOL_MAXSIZE connections.
+MYSQL_POOL_HEADROOM = int(os.getenv("MYSQL_POOL_HEADROOM", "2"))
+MYSQL_POOL_SIZE = min(
+    pooling.CNX_POOL_MAXSIZE,
+    int(os.getenv("MYSQL_POOL_SIZE", str(int(os.getenv("GUNICORN_THREADS", "8")) + MYSQL_POOL_HEADROOM)))
+)
+MYSQL_STATEMENT_CACHE_SIZE = int(os.getenv("MYSQL_STATEMENT_CACHE_SIZE", "32"))
+
+# Optional read replica for heavy read-only queries. Reads fall back to the
+# primary while the replica is unreachable or lags more than the threshold;
+# replica health is rechecked at most once per check interval.
+MYSQL_REPLICA_HOST = os.getenv("MYSQL_REPLICA_HOST")
+MYSQL_REPLICA_PORT = os.getenv("MYSQL_REPLICA_PORT")
+MYSQL_REPLICA_MAX_LAG = int(os.getenv("MYSQL_REPLICA_MAX_LAG", "5"))
+MYSQL_REPLICA_CHECK_INTERVAL = float(os.getenv("MYSQL_REPLICA_CHECK_INTERVAL", "5"))
+
+# Seconds to wait for a connection, and the server-side limit for one SELECT
+MYSQL_CONNECT_TIMEOUT = int(os.getenv("MYSQL_CONNECT_TIMEOUT", "5"))
+MYSQL_READ_TIMEOUT = int(os.getenv("MYSQL_READ_TIMEOUT", "30"))
+
+# Consecutive connection failures that open the circuit breaker, and seconds
+# it stays open before letting a probe through
+MYSQL_BREAKER_FAILURES = int(os.getenv("MYSQL_BREAKER_FAILURES", "5"))
+MYSQL_BREAKER_RESET_TIMEOUT = float(os.getenv("MYSQL_BREAKER_RESET_TIMEOUT", "30"))
+
+# Retries of a whole transaction after a deadlock or lock wait timeout: at most
+# MYSQL_RETRY_ATTEMPTS re-runs, and none that would start after
+# MYSQL_RETRY_BUDGET seconds
+MYSQL_RETRY_ATTEMPTS = int(os.getenv("MYSQL_RETRY_ATTEMPTS", "3"))
+MYSQL_RETRY_BASE_DELAY = float(os.getenv("MYSQL_RETRY_BASE_DELAY", "0.05"))
+MYSQL_RETRY_MAX_DELAY = float(os.getenv("MYSQL_RETRY_MAX_DELAY", "1"))
+MYSQL_RETRY_BUDGET = float(os.getenv("MYSQL_RETRY_BUDGET", "3"))
+
+# Typeahead staff search: default and largest page size
+USER_SEARCH_PAGE_SIZE = int(os.getenv("USER_SEARCH_PAGE_SIZE", "10"))
+USER_SEARCH_MAX_PAGE_SIZE = int(os.getenv("USER_SEARCH_MAX_PAGE_SIZE", "50"))
+
+# Offline punch sync: events per batch, how far back a client timestamp may be
+# and how far ahead of the server clock it may run
+PUNCH_SYNC_MAX_EVENTS = int(os.getenv("PUNCH_SYNC_MAX_EVENTS", "100"))
+PUNCH_SYNC_MAX_AGE_DAYS = int(os.getenv("PUNCH_SYNC_MAX_AGE_DAYS", "7"))
+PUNCH_SYNC_MAX_SKEW_SECONDS = int(os.getenv("PUNCH_SYNC_MAX_SKEW_SECONDS", "300"))
+
+# DataVersion rows that are not a user. The global version is the sum of
+# GLOBAL_VERSION_SLOTS rows from GLOBAL_VERSION_BASE downwards; each write bumps
+# one of them, so concurrent writes do not all queue on one hot row. The
+# settings row is bumped by writes to settings every user's pages depend on
+# (working hours).
+SETTINGS_VERSION = -1
+GLOBAL_VERSION_BASE = -100
+GLOBAL_VERSION_SLOTS = max(1, int(os.getenv("GLOBAL_VERSION_SLOTS", "16")))
+
+# ER_LOCK_DEADLOCK and ER_LOCK_WAIT_TIMEOUT; in both cases InnoDB has rolled
+# back the statement or transaction and running it again is safe
+RETRYABLE_ERRORS = (1213, 1205)
+
+def encode_cursor(*values):
+    """Encode the sort key of the last row on a page as an opaque cursor"""
+    raw = '|'.join(value.isoformat(sep=' ') if isinstance(value, datetime) else str(value) for value in values)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor, size):
+    """Decode a cursor produced by encode_cursor
+
+    Raises:
+        ValueError: if the cursor is malformed
+    """
+    try:
+        values = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|')
+    except (UnicodeError, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+    if len(values) != size:
+        raise ValueError("Invalid cursor")
+    return values
+
+def clamp_page_size(limit):
+    """Return a usable page size for a requested limit (None or invalid uses the default)"""
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+class QueryBuilder:
+    """Render statements that contain only the optional predicates actually supplied
+
+    Catch-all predicates such as "(%s IS NULL OR date <= %s)" keep MySQL from
+    choosing an index range plan. A QueryBuilder instead emits one statement per
+    combination of supplied filters (a "shape") and caches the rendered SQL, so
+    every call with the same shape reuses identical SQL text.
+
+    Args:
+        statement: statement up to, but excluding, the WHERE clause
+        required: conditions that are always present
+        filters: mapping of filter name to condition, in rendering order
+        suffix: ORDER BY / LIMIT text appended after the WHERE clause
+        index: name of the index each shape is expected to use, checked by
+            check_query_plans.py (None skips the check)
+    """
+
+    def __init__(self, statement, required=(), filters=None, suffix='', index=None):
+        self.statement = statement.strip()
+        self.required = tuple(required)
+        self.filters = dict(filters or {})
+        self.suffix = suffix.strip()
+        self.index = index
+        self._shapes = {}
+
+    def shape(self, **values):
+        """Names of the filters supplied with a non-None value, in rendering order"""
+        return tuple(name for name in self.filters if values.get(name) is not None)
+
+    def render(self, shape):
+        """Return the SQL text for a shape, rendering and caching it on first use"""
+        sql = self._shapes.get(shape)
+        if sql is None:
+            conditions = list(self.required) + [self.filters[name] for name in shape]
+            parts = [self.statement]
+            if conditions:
+                parts.append("WHERE " + "\n            AND ".join(conditions))
+            if self.suffix:
+                parts.append(self.suffix)
+            sql = "\n            ".join(parts)
+            self._shapes[shape] = sql
+        return sql
+
+    def build(self, required_params=(), suffix_params=(), **values):
+        """Build (sql, params) for the supplied filter values
+
+        Args:
+            required_params: parameters of the required conditions
+            suffix_params: parameters of the suffix (e.g. LIMIT)
+            **values: filter values; None omits the filter, a tuple supplies
+                several parameters to one condition
+
+        Returns:
+            tuple: (sql, params)
+        """
+        shape = self.shape(**values)
+        params = list(required_params)
+        for name in shape:
+            value = values[name]
+            params.extend(value if isinstance(value, tuple) else (value,))
+        params.extend(suffix_params)
+        return self.render(shape), tuple(params)
+
+class FederatedQuery:
+    """UNION ALL of the same query over the hot and archive timesheet tables
+
+    Both parts are rendered by their own QueryBuilder (so each keeps its index
+    plan and its own LIMIT), then the union is ordered and limited once more.
+    Rows are moved, never copied, so the parts never overlap.
+    """
+
+    def __init__(self, hot, archive, suffix=''):
+        self.hot = hot
+        self.archive = archive
+        self.suffix = suffix.strip()
+
+    def build(self, required_params=(), suffix_params=(), part_suffix_params=(), **values):
+        """Build (sql, params); part_suffix_params go to each part's own suffix"""
+        hot_sql, hot_params = self.hot.build(required_params, part_suffix_params, **values)
+        archive_sql, archive_params = self.archive.build(required_params, part_suffix_params, **values)
+        sql = f"({hot_sql})\n            UNION ALL\n            ({archive_sql})"
+        if self.suffix:
+            sql += "\n            " + self.suffix
+        return sql, hot_params + archive_params + tuple(suffix_params)
+
+# Prefix search over the unique username and email indexes; each part is a
+# range scan on its own index, paged by username
+USER_SEARCH_FILTERS = {
+    'role': "role = %s",
+    'after': "username > %s",
+}
+
+USER_SEARCH_BY_NAME_QUERY = QueryBuilder(
+    "SELECT user_id, username, email, role FROM User",
+    required=["username LIKE %s", "deleted_at IS NULL"],
+    filters=USER_SEARCH_FILTERS,
+    suffix="ORDER BY username LIMIT %s",
+    index='username'
+)
+
+USER_SEARCH_BY_EMAIL_QUERY = QueryBuilder(
+    "SELECT user_id, username, email, role FROM User",
+    required=["email LIKE %s", "deleted_at IS NULL"],
+    filters=USER_SEARCH_FILTERS,
+    suffix="ORDER BY username LIMIT %s",
+    index='email'
+)
+
+def like_prefix(text):
+    """LIKE pattern matching values that start with text"""
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+# Ranked full-text search over NoteSearch, the non-partitioned side table that
+# mirrors Timesheet.notes (keyed by user and day, source_id 0) and
+# LeaveRecord.reason (keyed by leave_id). Partitioned InnoDB tables cannot
+# carry a FULLTEXT index, and the side table also covers archived days.
+NOTE_SEARCH_QUERY = QueryBuilder(
+    """
+    SELECT n.note_id, n.source, n.source_id, n.user_id, u.username, n.date, n.body,
+           MATCH(n.body) AGAINST (%s IN NATURAL LANGUAGE MODE) AS score
+    FROM NoteSearch n
+    JOIN User u ON u.user_id = n.user_id
+    """,
+    required=["MATCH(n.body) AGAINST (%s IN NATURAL LANGUAGE MODE)", "u.deleted_at IS NULL"],
+    filters={
+        'user_id': "n.user_id = %s",
+        'source': "n.source = %s",
+        'start_date': "n.date >= %s",
+        'end_date': "n.date <= %s",
+    },
+    suffix="ORDER BY score DESC, n.note_id DESC LIMIT %s OFFSET %s",
+    index='ft_note_body'
+)
+
+def index_note(cursor, source, source_id, user_id, date, body):
+    """Mirror a note into NoteSearch within the caller's transaction; empty notes are removed"""
+    if body and body.strip():
+        cursor.execute(
+            """
+            INSERT INTO NoteSearch (source, source_id, user_id, date, body)
+            VALUES (%s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE body = VALUES(body)
+            """,
+            (source, source_id, user_id, date, body)
+        )
+    else:
+        cursor.execute(
+            "DELETE FROM NoteSearch WHERE source = %s AND source_id = %s AND user_id = %s AND date = %s",
+            (source, source_id, user_id, date)
+        )
+
+# New value of a unique User column on soft delete: 'deleted-<user_id>-' plus
+# the old value, cut to the column width
+DELETED_USER_RENAME = "LEFT(CONCAT('deleted-', user_id, '-', {column}), 255)"
+
+# Columns shared by Timesheet and TimesheetArchive, in the same order
+TIMESHEET_COLUMNS = "timesheet_id, user_id, time_in, time_out, total_time, worked_minutes, date, entry_type, notes"
+
+def refresh_monthly_summaries(cursor, user_ids, month_start):
+    """Recompute users' TimesheetMonthlySummary rows for one month from TimesheetArchive
+
+    Runs in the caller's transaction; a user with no archived rows left in the
+    month loses their summary row.
+    """
+    first = month_start.replace(day=1)
+    next_month = (first + timedelta(days=32)).replace(day=1)
+    user_ids = tuple(sorted(set(user_ids)))
+    user_list = ', '.join(['%s'] * len(user_ids))
+    paid_types = ', '.join(f"'{entry_type}'" for entry_type in PAID_ENTRY_TYPES)
+    cursor.execute(
+        f"DELETE FROM TimesheetMonthlySummary WHERE user_id IN ({user_list}) AND month_start = %s",
+        user_ids + (first,)
+    )
+    cursor.execute(f"""
+        INSERT INTO TimesheetMonthlySummary
+            (user_id, month_start, worked_minutes, work_entries, paid_entries, total_entries)
+        SELECT user_id, %s, COALESCE(SUM(worked_minutes), 0),
+               SUM(entry_type = 'Work'), SUM(entry_type IN ({paid_types})), COUNT(*)
+        FROM TimesheetArchive
+        WHERE user_id IN ({user_list}) AND date >= %s AND date < %s
+        GROUP BY user_id
+    """, (first,) + user_ids + (first, next_month))
+
+TIMESHEET_HISTORY_FILTERS = {
+    'start_date': "date >= %s",
+    # Default lower bound; a constant primary-key lookup, so still a range
+    'employment_date_of': "date >= (SELECT employment_date FROM User WHERE user_id = %s)",
+    'end_date': "date <= %s",
+}
+
+TIMESHEET_PAGE_FILTERS = dict(TIMESHEET_HISTORY_FILTERS, after="(date, timesheet_id) < (%s, %s)")
+
+TIMESHEET_HISTORY_QUERY = QueryBuilder(
+    f"SELECT {TIMESHEET_COLUMNS} FROM Timesheet",
+    required=["user_id = %s"],
+    filters=TIMESHEET_HISTORY_FILTERS,
+    suffix="ORDER BY date DESC, time_in DESC",
+    index='idx_timesheet_user_date'
+)
+
+TIMESHEET_PAGE_QUERY = QueryBuilder(
+    f"SELECT {TIMESHEET_COLUMNS} FROM Timesheet",
+    required=["user_id = %s"],
+    filters=TIMESHEET_PAGE_FILTERS,
+    suffix="ORDER BY date DESC, timesheet_id DESC LIMIT %s",
+    index='idx_timesheet_user_date'
+)
+
+ARCHIVE_HISTORY_QUERY = QueryBuilder(
+    f"SELECT {TIMESHEET_COLUMNS} FROM TimesheetArchive",
+    required=["user_id = %s"],
+    filters=TIMESHEET_HISTORY_FILTERS,
+    index='idx_archive_user_date'
+)
+
+ARCHIVE_PAGE_QUERY = QueryBuilder(
+    f"SELECT {TIMESHEET_COLUMNS} FROM TimesheetArchive",
+    required=["user_id = %s"],
+    filters=TIMESHEET_PAGE_FILTERS,
+    suffix="ORDER BY date DESC, timesheet_id DESC LIMIT %s",
+    index='idx_archive_user_date'
+)
+
+FEDERATED_HISTORY_QUERY = FederatedQuery(
+    TIMESHEET_HISTORY_QUERY, ARCHIVE_HISTORY_QUERY,
+    suffix="ORDER BY date DESC, time_in DESC"
+)
+
+FEDERATED_PAGE_QUERY = FederatedQuery(
+    TIMESHEET_PAGE_QUERY, ARCHIVE_PAGE_QUERY,
+    suffix="ORDER BY date DESC, timesheet_id DESC LIMIT %s"
+)
+
+LEAVE_HISTORY_QUERY = QueryBuilder(
+    "SELECT * FROM LeaveRecord",
+    required=["user_id = %s"],
+    filters={
+        'status': "status = %s",
+    },
+    suffix="ORDER BY created_at DESC, leave_id DESC",
+    index='idx_leave_user_created'
+)
+
+LEAVE_PAGE_QUERY = QueryBuilder(
+    "SELECT * FROM LeaveRecord",
+    required=["user_id = %s"],
+    filters={
+        'status': "status = %s",
+        'after': "(created_at, leave_id) < (%s, %s)",
+    },
+    suffix="ORDER BY created_at DESC, leave_id DESC LIMIT %s",
+    index='idx_leave_user_created'
+)
+
+CHECKPOINT_INVALIDATION_QUERY = QueryBuilder(
+    "DELETE FROM BalanceCheckpoint",
+    filters={
+        'user_id': "user_id = %s",
+        'from_date': "period_end >= %s",
+    }
+)
+
+class StatementCache:
+    """LRU cache of server-side prepared statements for one connection
+
+    Each entry is a prepared cursor that has already sent its statement to the
+    server, so executing it again only sends the parameters using the binary
+    protocol. Statements belong to a server session: the cache remembers the
+    connection id it was filled on and starts over after a reconnect.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.connection_id = None
+        self._statements = OrderedDict()
+
+    def cursor_for(self, conn, query):
+        """Return (sql, prepared cursor) for a query, evicting the least recently used"""
+        if conn.connection_id != self.connection_id:
+            # New server session, the old statement handles are gone
+            self._statements.clear()
+            self.connection_id = conn.connection_id
+
+        entry = self._statements.get(query)
+        if entry is not None:
+            self._statements.move_to_end(query)
+            return entry
+
+        if len(self._statements) >= self.size:
+            _, (_, evicted) = self._statements.popitem(last=False)
+            self._close(evicted)
+        # The connector only re-prepares when it is given a different string
+        # object, so the cached text is passed back on every execute
+        entry = (query, conn.cursor(prepared=True))
+        self._statements[query] = entry
+        return entry
+
+    def discard(self, query):
+        """Drop a statement after an error so it is prepared again next time"""
+        entry = self._statements.pop(query, None)
+        if entry is not None:
+            self._close(entry[1])
+
+    def _close(self, cursor):
+        try:
+            cursor.close()
+        except mysql.connector.Error:
+            pass
+
+class CircuitBreaker:
+    """Fail fast while the database is unreachable
+
+    Closed: calls go through and consecutive failures are counted. After
+    failure_threshold failures the breaker opens and calls are refused without
+    touching the network. Once reset_timeout has passed it half-opens and lets
+    a single probe through; success closes it, failure opens it again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=MYSQL_BREAKER_FAILURES, reset_timeout=MYSQL_BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.last_error = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Return True if a call may go to the database now"""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.HALF_OPEN:
+                if self._probing:
+                    return False
+                self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self, error=None):
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error) if error else None
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    print(f"Database circuit '{self.name}' opened after {self.failures} failures")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+    def snapshot(self):
+        """Breaker state for the health endpoint"""
+        with self._lock:
+            retry_in = None
+            if self.state == self.OPEN:
+                retry_in = max(0.0, round(self.reset_timeout - (time.monotonic() - self.opened_at), 1))
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'retry_in_seconds': retry_in,
+                'last_error': self.last_error
+            }
+
+class TransientRetry:
+    """Decorator that re-runs a function raising a retryable MySQL error
+
+    The wrapped function must run a complete transaction (and roll it back on
+    error) so a retry starts from scratch. Delays use exponential backoff
+    with full jitter. Counts retries, give-ups and successes after a retry
+    for the health endpoint.
+    """
+
+    def __init__(self, attempts=MYSQL_RETRY_ATTEMPTS, base_delay=MYSQL_RETRY_BASE_DELAY,
+                 max_delay=MYSQL_RETRY_MAX_DELAY, budget=MYSQL_RETRY_BUDGET, errors=RETRYABLE_ERRORS):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.errors = errors
+        self.counters = {'retries': 0, 'recovered': 0, 'give_ups': 0}
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            began = time.monotonic()
+            attempt = 0
+            while True:
+                try:
+                    result = func(*args, **kwargs)
+                    if attempt:
+                        self._count('recovered')
+                    return result
+                except mysql.connector.Error as err:
+                    if err.errno not in self.errors:
+                        raise
+                    delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                    if attempt >= self.attempts or time.monotonic() - began + delay > self.budget:
+                        self._count('give_ups')
+                        raise
+                    attempt += 1
+                    self._count('retries')
+                    print(f"Retrying {func.__name__} after error {err.errno} (attempt {attempt})")
+                    time.sleep(delay)
+        return wrapper
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counters)
+
+retry_transient = TransientRetry()
+
+def statement_cache(conn):
+    """Return the prepared statement cache of a (pooled) connection"""
+    raw = getattr(conn, '_cnx', None) or conn
+    cache = getattr(raw, 'statement_cache', None)
+    if cache is None:
+        cache = StatementCache(MYSQL_STATEMENT_CACHE_SIZE)
+        raw.statement_cache = cache
+    return cache
+
 class DatabaseConnection:
-    def __init__(self):
+    def __init__(self, host=None, port=None, pool_name='primary'):
         self.MYSQL_USERNAME = os.getenv("MYSQL_USERNAME")
         self.MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD", "")
-        self.MYSQL_HOST = os.getenv("MYSQL_HOST")
-        self.MYSQL_PORT = os.getenv("MYSQL_PORT")
+        self.MYSQL_HOST = host or os.getenv("MYSQL_HOST")
+        self.MYSQL_PORT = port or os.getenv("MYSQL_PORT")
         self.MYSQL_DATABASE = os.getenv("MYSQL_DATABASE")
+        self.pool_name = pool_name
+        self.breaker = CircuitBreaker(pool_name)
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+        self.pool_fallbacks = 0
+
+    def _connection_args(self):
+        args = {
+            'host': self.MYSQL_HOST,
+            'user': self.MYSQL_USERNAME,
+            'password': self.MYSQL_PASSWORD,
+            'database': self.MYSQL_DATABASE,
+            'connection_timeout': MYSQL_CONNECT_TIMEOUT,
+            'init_command': f"SET SESSION max_execution_time = {MYSQL_READ_TIMEOUT * 1000}"
+        }
+        if self.MYSQL_PORT:
+            args['port'] = int(self.MYSQL_PORT)
+        return args
 
     def connect(self):
         try:
-            connection = mysql.connector.connect(
-                host=self.MYSQL_HOST,
-                user=self.MYSQL_USERNAME,
-                password=self.MYSQL_PASSWORD,
-                database=self.MYSQL_DATABASE
-            )
+            connection = mysql.connector.connect(**self._connection_args())
             return connection
         except mysql.connector.Error as err:
             print(f"Error: {err}")
             return None
 
+    def get_pool(self):
+        """Return this process's connection pool, creating it on first use
+
+        Pools are not shared across fork, so a gunicorn worker builds its own.
+        Sessions are not reset when a connection goes back to the pool, since a
+        reset would deallocate the cached prepared statements. That is safe
+        because no borrower changes session state: the only session variable is
+        the init_command every connection shares, named locks use dedicated
+        connections (acquire_named_lock), and autocommit keeps a reused
+        connection from holding an old read snapshot. get_connection rolls back
+        a transaction a previous borrower left open.
+        """
+        pid = os.getpid()
+        if self._pool is None or self._pool_pid != pid:
+            with self._pool_lock:
+                if self._pool is None or self._pool_pid != pid:
+                    self._pool = pooling.MySQLConnectionPool(
+                        pool_name=f"{self.pool_name}-{pid}",
+                        pool_size=MYSQL_POOL_SIZE,
+                        pool_reset_session=False,
+                        autocommit=True,
+                        **self._connection_args()
+                    )
+                    self._pool_pid = pid
+        return self._pool
+
+    def get_connection(self):
+        """Borrow a pooled connection; close() returns it to the pool
+
+        Falls back to a dedicated connection, without the prepared statement
+        cache, when the pool is exhausted; each fallback is logged and counted.
+        Returns None without waiting while the circuit breaker is open.
+        """
+        if not self.breaker.allow():
+            return None
+        try:
+            conn = self.get_pool().get_connection()
+            if conn.in_transaction:
+                conn.rollback()
+        except pooling.PoolError:
+            with self._pool_lock:
+                self.pool_fallbacks += 1
+                fallbacks = self.pool_fallbacks
+            print(f"{self.pool_name} pool exhausted ({MYSQL_POOL_SIZE} connections), "
+                  f"using an unpooled connection ({fallbacks} so far)")
+            conn = self.connect()
+            if conn is None:
+                self.breaker.record_failure("connect failed")
+                return None
+        except mysql.connector.Error as err:
+            print(f"Error: {err}")
+            self.breaker.record_failure(err)
+            return None
+        self.breaker.record_success()
+        return conn
+
+class ReplicaMonitor:
+    """Tracks whether a read replica is reachable and caught up
+
+    Replication lag is read from SHOW REPLICA STATUS (the connection user needs
+    the REPLICATION CLIENT privilege). A replica that is down, not replicating
+    or lagging past max_lag seconds is skipped until the next check.
+    """
+
+    def __init__(self, connection, max_lag=MYSQL_REPLICA_MAX_LAG, interval=MYSQL_REPLICA_CHECK_INTERVAL):
+        self.connection = connection
+        self.max_lag = max_lag
+        self.interval = interval
+        self.healthy = False
+        self.lag = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def usable(self):
+        """Return True if reads may go to the replica, rechecking when due"""
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= self.interval:
+            with self._lock:
+                if self._checked_at is None or now - self._checked_at >= self.interval:
+                    self.healthy = self._check()
+                    self._checked_at = time.monotonic()
+        return self.healthy
+
+    def mark_down(self):
+        """Skip the replica until the next check after a failed connect"""
+        self.healthy = False
+        self._checked_at = time.monotonic()
+
+    def _check(self):
+        conn = self.connection.get_connection()
+        if conn is None:
+            return False
+        cursor = None
+        try:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute("SHOW REPLICA STATUS")
+            status = cursor.fetchone()
+            self.lag = status.get('Seconds_Behind_Source') if status else None
+        except mysql.connector.Error as err:
+            print(f"Replica status error: {err}")
+            self.lag = None
+        finally:
+            if cursor:
+                cursor.close()
+            conn.close()
+        # None means replication is stopped or this is not a replica
+        return self.lag is not None and self.lag <= self.max_lag
+
+# Working hours and the staff roster, shared by the workers on this host and
+# dropped whenever an event says they changed
+reference_cache = SharedReferenceCache()
+for _kind in ('working_hours', 'staff_added', 'staff_deleted'):
+    broker.on(_kind, lambda data: reference_cache.invalidate())
+
 class DatabaseOperations:
+    """Query layer over the primary (and optional replica) connection pools
+
+    Timesheet predicates compare date with a bound value (today's date is
+    passed in rather than CURDATE()) so MySQL can prune partitions when
+    Timesheet is range partitioned by date.
+    """
+
     def __init__(self):
         self.db = DatabaseConnection()
+        self.replica = None
+        if MYSQL_REPLICA_HOST:
+            self.replica = ReplicaMonitor(DatabaseConnection(
+                host=MYSQL_REPLICA_HOST, port=MYSQL_REPLICA_PORT, pool_name='replica'
+            ))
+        self._request = threading.local()
+
+    def health(self, include_errors=False):
+        """Circuit breaker and replica state for the health endpoint
+
+        Args:
+            include_errors: keep each breaker's last_error, which can name the
+                database host, user or SQL text; only for admins
+
+        Returns:
+            dict: with 'healthy' False while the primary breaker is open
+        """
+        status = {
+            'healthy': self.db.breaker.state != CircuitBreaker.OPEN,
+            'primary': dict(self.db.breaker.snapshot(), pool_size=MYSQL_POOL_SIZE,
+                            pool_fallbacks=self.db.pool_fallbacks),
+            'transaction_retries': retry_transient.snapshot()
+        }
+        if self.replica is not None:
+            status['replica'] = dict(
+                self.replica.connection.breaker.snapshot(),
+                pool_size=MYSQL_POOL_SIZE,
+                pool_fallbacks=self.replica.connection.pool_fallbacks,
+                usable=self.replica.healthy,
+                lag_seconds=self.replica.lag
+            )
+        if not include_errors:
+            for name in ('primary', 'replica'):
+                if name in status:
+                    status[name].pop('last_error', None)
+        return status
+
+    def begin_request(self):
+        """Reset read-your-writes stickiness at the start of a request"""
+        self._request.wrote = False
+        self._request.pinned = False
+
+    def pin_to_primary(self):
+        """Send the rest of this request's reads to the primary
+
+        For responses tagged with data versions: the counters are read on the
+        primary, so the body must be too, or a lagging replica would pair a new
+        version with old rows and clients would keep those rows until the next
+        write.
+        """
+        self._request.pinned = True
+
+    def _connection_for(self, read_only):
+        """Borrow a replica connection for read-only queries when allowed, else a primary one
+
+        Once the current request has written or been pinned, its reads stay on
+        the primary so they see that write or match its data versions.
+        """
+        request = self._request
+        if (read_only and self.replica is not None
+                and not getattr(request, 'wrote', False) and not getattr(request, 'pinned', False)):
+            if self.replica.usable():
+                conn = self.replica.connection.get_connection()
+                if conn is not None:
+                    return conn
+                self.replica.mark_down()
+        return self.db.get_connection()
+
+    def execute_query(self, query, params=None, prepared=False, read_only=False):
+        """Execute a database query with proper cursor and connection management
+
+        Args:
+            query: SQL text with %s placeholders
+            params: tuple of parameters
+            prepared: run as a cached server-side prepared statement; meant for
+                the hot fixed-text queries, not for builder-rendered SQL
+            read_only: the query may be served by the read replica
+        """
+        if prepared and MYSQL_STATEMENT_CACHE_SIZE > 0:
+            return self._execute_prepared(query, params, read_only)
 
-    def execute_query(self, query, params=None):
-        """Execute a database query with proper cursor and connection management"""
         conn = None
         cursor = None
         try:
-            conn = self.db.connect()
+            conn = self._connection_for(read_only)
             if conn is None:
                 return False, None
             
@@ -46,11 +803,14 @@ class DatabaseOperations:
             else:
                 cursor.execute(query)
             
-            if query.strip().upper().startswith("SELECT"):
+            # Decided by the result set, not the SQL text: UNIONs in
+            # parentheses, WITH and SHOW statements return rows too
+            if cursor.with_rows:
                 result = cursor.fetchall()
                 return True, result
             else:
                 conn.commit()
+                self._request.wrote = True
                 return True, None
                 
         except Exception as e:
@@ -65,76 +825,414 @@ class DatabaseOperations:
             if conn:
                 conn.close()
 
+    def _execute_prepared(self, query, params, read_only=False):
+        """Execute a query through the connection's prepared statement cache
+
+        Cached cursors stay open while the connection is back in the pool, so
+        only the connection is closed here.
+        """
+        conn = None
+        cache = None
+        try:
+            conn = self._connection_for(read_only)
+            if conn is None:
+                return False, None
+
+            cache = statement_cache(conn)
+            sql, cursor = cache.cursor_for(conn, query)
+            cursor.execute(sql, params or ())
+
+            if cursor.with_rows:
+                columns = cursor.column_names
+                result = [dict(zip(columns, row)) for row in cursor.fetchall()]
+                return True, result
+            else:
+                conn.commit()
+                self._request.wrote = True
+                return True, None
+
+        except Exception as e:
+            print(f"Database error: {e}")
+            if cache is not None:
+                cache.discard(query)
+            if conn and conn.in_transaction:
+                conn.rollback()
+            return False, None
+
+        finally:
+            if conn:
+                conn.close()
+
+    @retry_transient
+    def _run_transaction(self, work):
+        conn = self.db.get_connection()
+        if conn is None:
+            raise mysql.connector.errors.InterfaceError("No database connection")
+        cursor = None
+        try:
+            cursor = conn.cursor(dictionary=True)
+            conn.start_transaction()
+            result = work(cursor)
+            conn.commit()
+            self._request.wrote = True
+            return result
+        except Exception:
+            if conn.is_connected() and conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            if cursor:
+                cursor.close()
+            conn.close()
+
+    def run_transaction(self, work):
+        """Run work(cursor) in one transaction on the primary, retrying transient errors
+
+        The whole transaction is re-run after a deadlock or lock wait timeout,
+        so work must only touch the database through the cursor it is given.
+
+        Args:
+            work: callable taking a dictionary cursor, its return value is passed back
+
+        Returns:
+            tuple: (success, result of work)
+        """
+        try:
+            return True, self._run_transaction(work)
+        except Exception as e:
+            print(f"Database error: {e}")
+            return False, None
+
+    def execute_many(self, query, params_list):
+        """Execute a write query once per parameter tuple in a single transaction"""
+        return self.run_transaction(lambda cursor: cursor.executemany(query, params_list))[0]
+
+    def invalidate_balance_checkpoints(self, user_id=None, from_date=None):
+        """Delete balance checkpoints affected by a write
+
+        Call it after bump_data_version for the same write: checkpoints are
+        only saved while the versions read before computing them are
+        unchanged (see BalanceCalculator._save_checkpoints), so a checkpoint
+        computed from rows older than the write is either deleted here or
+        never saved.
+
+        Args:
+            user_id: int, None invalidates every user
+            from_date: datetime.date of the earliest day touched, None invalidates all
+
+        Returns:
+            bool: True if successful
+        """
+        query, params = CHECKPOINT_INVALIDATION_QUERY.build(user_id=user_id, from_date=from_date)
+        return self.execute_query(query, params)[0]
+
+    def bump_data_version(self, user_id=None, settings=False, user_ids=None):
+        """Advance the change counters after a write
+
+        The global version always moves; each user's counter moves when the
+        write concerns them, and the settings counter when it changes
+        configuration every user's pages depend on. All counters move in one
+        statement. Rows are locked in key order, so concurrent bumps cannot
+        deadlock.
+
+        Args:
+            user_id: the one user the write concerns
+            settings: True for settings changes
+            user_ids: every user a batch write concerns
+        """
+        users = set(int(uid) for uid in user_ids or ())
+        if user_id is not None:
+            users.add(int(user_id))
+        # Writes for one user always land on the same slot, others spread at random
+        slot = min(users) % GLOBAL_VERSION_SLOTS if users else random.randrange(GLOBAL_VERSION_SLOTS)
+        scopes = [GLOBAL_VERSION_BASE - slot] + sorted(users)
+        if settings:
+            scopes.append(SETTINGS_VERSION)
+        scopes.sort()
+        placeholders = ', '.join(['(%s, 1)'] * len(scopes))
+        query = f"""
+            INSERT INTO DataVersion (scope_id, version) VALUES {placeholders}
+            ON DUPLICATE KEY UPDATE version = version + 1
+        """
+        return self.execute_query(query, tuple(scopes))[0]
+
+    def get_balance_versions(self, user_ids, cursor=None):
+        """The counters a user's balance depends on: their own and the settings one
+
+        Args:
+            user_ids: users whose balances are being computed
+            cursor: a run_transaction cursor; the rows (present or not) are then
+                share-locked until that transaction ends, so a concurrent
+                bump_data_version waits for it
+
+        Returns:
+            dict: {user_id: version, SETTINGS_VERSION: version}, 0 when never
+            bumped; None on a database error
+        """
+        scopes = sorted(set(int(uid) for uid in user_ids) | {SETTINGS_VERSION})
+        placeholders = ', '.join(['%s'] * len(scopes))
+        query = f"SELECT scope_id, version FROM DataVersion WHERE scope_id IN ({placeholders})"
+        if cursor is not None:
+            cursor.execute(query + " FOR SHARE", tuple(scopes))
+            rows = cursor.fetchall()
+        else:
+            success, rows = self.execute_query(query, tuple(scopes))
+            if not success:
+                return None
+        versions = dict.fromkeys(scopes, 0)
+        versions.update((row['scope_id'], row['version']) for row in rows or [])
+        return versions
+
+    def get_data_versions(self, user_id=None):
+        """Current change counters, for ETags
+
+        Returns:
+            dict: {'global', 'settings', 'user'} (0 when never bumped), None on error
+        """
+        query = """
+            SELECT scope_id, version FROM DataVersion
+            WHERE scope_id IN (%s, %s) OR scope_id BETWEEN %s AND %s
+        """
+        scope = SETTINGS_VERSION if user_id is None else int(user_id)
+        params = (SETTINGS_VERSION, scope, GLOBAL_VERSION_BASE - GLOBAL_VERSION_SLOTS + 1, GLOBAL_VERSION_BASE)
+        success, result = self.execute_query(query, params, prepared=True)
+        if not success:
+            return None
+        versions = {row['scope_id']: row['version'] for row in result or []}
+        return {
+            'global': sum(version for scope_id, version in versions.items() if scope_id <= GLOBAL_VERSION_BASE),
+            'settings': versions.get(SETTINGS_VERSION, 0),
+            'user': versions.get(scope, 0) if user_id is not None else 0
+        }
+
     def get_user_by_id(self, user_id):
-        query = "SELECT * FROM User WHERE user_id = %s"
-        success, result = self.execute_query(query, (user_id,))
+        query = "SELECT * FROM User WHERE user_id = %s AND deleted_at IS NULL"
+        success, result = self.execute_query(query, (user_id,), prepared=True)
         return result[0] if success and result else None
 
     def get_user_by_email(self, email):
-        query = "SELECT * FROM User WHERE email = %s"
+        query = "SELECT * FROM User WHERE email = %s AND deleted_at IS NULL"
         success, result = self.execute_query(query, (email,))
         return result[0] if success and result else None    
     
+    def get_archive_watermark(self):
+        """Latest date moved to TimesheetArchive, None if nothing is archived"""
+        query = "SELECT MAX(date) as archived_through FROM TimesheetArchive"
+        success, result = self.execute_query(query, read_only=True)
+        return result[0]['archived_through'] if success and result else None
+
+    def _spans_archive(self, start_date):
+        """True if a history range starting at start_date (None = employment date) reaches archived rows"""
+        watermark = self.get_archive_watermark()
+        return watermark is not None and (start_date is None or start_date <= watermark)
+
     def get_user_timesheet(self, user_id, start_date=None, end_date=None):
-        query = """
-            SELECT t.* FROM Timesheet t
-            JOIN User u ON t.user_id = u.user_id
-            WHERE t.user_id = %s
-            AND t.date >= COALESCE(%s, u.employment_date)
-            AND (%s IS NULL OR t.date <= %s)
-            ORDER BY t.date DESC, t.time_in DESC
-        """
-        success, result = self.execute_query(query, (user_id, start_date, end_date, end_date))
+        """Get a user's timesheet, newest first, including archived rows when the range reaches them"""
+        builder = FEDERATED_HISTORY_QUERY if self._spans_archive(start_date) else TIMESHEET_HISTORY_QUERY
+        query, params = builder.build(
+            (user_id,),
+            start_date=start_date,
+            employment_date_of=user_id if start_date is None else None,
+            end_date=end_date
+        )
+        success, result = self.execute_query(query, params, read_only=True)
         return result if success else []
 
     def get_user_leaves(self, user_id, status=None):
-        query = """
-            SELECT * FROM LeaveRecord 
-            WHERE user_id = %s
-            AND (%s IS NULL OR status = %s)
-            ORDER BY created_at DESC
-        """
-        success, result = self.execute_query(query, (user_id, status, status))
+        query, params = LEAVE_HISTORY_QUERY.build((user_id,), status=status)
+        success, result = self.execute_query(query, params, read_only=True)
         return result if success else []
 
-    def insert_timesheet(self, user_id, time_in, time_out, date, notes=None):
+    def get_user_timesheet_page(self, user_id, start_date=None, end_date=None, limit=None, cursor=None):
+        """Get one page of a user's timesheet, newest first
+
+        Rows are ordered by (date, timesheet_id) descending; the cursor holds the
+        key of the last row of the previous page. Pages continue into
+        TimesheetArchive when the range reaches archived dates.
+
+        Args:
+            user_id: int
+            start_date: datetime.date, defaults to the employment date
+            end_date: datetime.date, optional
+            limit: int, page size (clamped to MAX_PAGE_SIZE)
+            cursor: str from a previous page, None for the first page
+
+        Returns:
+            tuple: (list of rows, next cursor or None when there are no more rows)
+
+        Raises:
+            ValueError: if the cursor is malformed
+        """
+        limit = clamp_page_size(limit)
+        after = tuple(decode_cursor(cursor, 2)) if cursor else None
+        filters = dict(
+            start_date=start_date,
+            employment_date_of=user_id if start_date is None else None,
+            end_date=end_date,
+            after=after
+        )
+        if self._spans_archive(start_date):
+            query, params = FEDERATED_PAGE_QUERY.build((user_id,), (limit + 1,), (limit + 1,), **filters)
+        else:
+            query, params = TIMESHEET_PAGE_QUERY.build((user_id,), (limit + 1,), **filters)
+        success, result = self.execute_query(query, params, read_only=True)
+        if not success:
+            return [], None
+
+        rows = result[:limit]
+        next_cursor = None
+        if len(result) > limit:
+            last = rows[-1]
+            next_cursor = encode_cursor(last['date'], last['timesheet_id'])
+        return rows, next_cursor
+
+    def get_user_leaves_page(self, user_id, status=None, limit=None, cursor=None):
+        """Get one page of a user's leave records, newest first
+
+        Rows are ordered by (created_at, leave_id) descending.
+
+        Returns:
+            tuple: (list of rows, next cursor or None when there are no more rows)
+
+        Raises:
+            ValueError: if the cursor is malformed
+        """
+        limit = clamp_page_size(limit)
+        after = tuple(decode_cursor(cursor, 2)) if cursor else None
+        query, params = LEAVE_PAGE_QUERY.build((user_id,), (limit + 1,), status=status, after=after)
+        success, result = self.execute_query(query, params, read_only=True)
+        if not success:
+            return [], None
+
+        rows = result[:limit]
+        next_cursor = None
+        if len(result) > limit:
+            last = rows[-1]
+            next_cursor = encode_cursor(last['created_at'], last['leave_id'])
+        return rows, next_cursor
+
+    def search_users(self, prefix, role=None, limit=None, cursor=None):
+        """Find active users whose username or email starts with prefix
+
+        Matching is case-insensitive and rows are ordered by username.
+
+        Returns:
+            tuple: (list of rows with user_id, username, email and role,
+            next cursor or None when there are no more rows)
+
+        Raises:
+            ValueError: if the cursor is malformed
+        """
+        try:
+            limit = max(1, min(int(limit), USER_SEARCH_MAX_PAGE_SIZE))
+        except (TypeError, ValueError):
+            limit = USER_SEARCH_PAGE_SIZE
+        after = decode_cursor(cursor, 1)[0] if cursor else None
+        pattern = like_prefix(prefix)
+        name_sql, name_params = USER_SEARCH_BY_NAME_QUERY.build((pattern,), (limit + 1,), role=role, after=after)
+        email_sql, email_params = USER_SEARCH_BY_EMAIL_QUERY.build((pattern,), (limit + 1,), role=role, after=after)
+        query = f"({name_sql})\n            UNION\n            ({email_sql})\n            ORDER BY username LIMIT %s"
+        success, result = self.execute_query(query, name_params + email_params + (limit + 1,), read_only=True)
+        if not success:
+            return [], None
+
+        rows = result[:limit]
+        next_cursor = None
+        if len(result) > limit:
+            next_cursor = encode_cursor(rows[-1]['username'])
+        return rows, next_cursor
+
+    def search_notes(self, text, user_id=None, source=None, start_date=None, end_date=None, limit=None, cursor=None):
+        """Full-text search over timesheet notes and leave reasons, best match first
+
+        Args:
+            text: words to look for (natural language mode; words shorter than
+                innodb_ft_min_token_size and stopwords are ignored)
+            user_id, source ('timesheet' or 'leave'), start_date, end_date:
+                optional filters
+
+        Returns:
+            tuple: (list of rows with note_id, source, source_id, user_id,
+            username, date, body and score, next cursor or None)
+
+        Raises:
+            ValueError: if the cursor is malformed
+        """
+        limit = clamp_page_size(limit)
+        offset = int(decode_cursor(cursor, 1)[0]) if cursor else 0
+        query, params = NOTE_SEARCH_QUERY.build(
+            (text, text), (limit + 1, offset),
+            user_id=user_id, source=source, start_date=start_date, end_date=end_date
+        )
+        success, result = self.execute_query(query, params, read_only=True)
+        if not success:
+            return [], None
+
+        rows = result[:limit]
+        next_cursor = encode_cursor(offset + limit) if len(result) > limit else None
+        return rows, next_cursor
+
+    def insert_timesheet(self, user_id, time_in, time_out, date, notes=None, entry_type='Work'):
         query = """
-            INSERT INTO Timesheet (user_id, time_in, time_out, date, notes)
-            VALUES (%s, %s, %s, %s, %s)
+            INSERT INTO Timesheet (user_id, time_in, time_out, date, notes, entry_type)
+            VALUES (%s, %s, %s, %s, %s, %s)
         """
-        return self.execute_query(query, (user_id, time_in, time_out, date, notes))[0]
+        def insert(cursor):
+            cursor.execute(query, (user_id, time_in, time_out, date, notes, entry_type))
+            index_note(cursor, 'timesheet', 0, user_id, date, notes)
+
+        success = self.run_transaction(insert)[0]
+        if success:
+            self.bump_data_version(user_id)
+            self.invalidate_balance_checkpoints(user_id, date)
+        return success
 
     def insert_leave(self, user_id, leave_type, start_date, end_date, reason, document_url=None):
         query = """
             INSERT INTO LeaveRecord (user_id, leave_type, start_date, end_date, reason, document_url)
             VALUES (%s, %s, %s, %s, %s, %s)
         """
-        return self.execute_query(query, (user_id, leave_type, start_date, end_date, reason, document_url))[0]
+        def insert(cursor):
+            cursor.execute(query, (user_id, leave_type, start_date, end_date, reason, document_url))
+            index_note(cursor, 'leave', cursor.lastrowid, user_id, start_date, reason)
+
+        success = self.run_transaction(insert)[0]
+        if success:
+            self.bump_data_version(user_id)
+        return success
 
     def update_leave_status(self, leave_id, status):
+        """Set a leave request's status; process_approved_leave bumps the versions"""
         query = "UPDATE LeaveRecord SET status = %s WHERE leave_id = %s"
         return self.execute_query(query, (status, leave_id))[0]
 
     def update_user_profile(self, user_id, profile_picture_url=None):
         query = "UPDATE User SET profile_picture_url = %s WHERE user_id = %s"
-        return self.execute_query(query, (profile_picture_url, user_id))[0]
+        success = self.execute_query(query, (profile_picture_url, user_id))[0]
+        if success:
+            self.bump_data_version(user_id)
+        return success
 
     def get_today_timesheet(self, user_id):
         """Get today's timesheet entry for the user"""
         query = """
             SELECT * FROM Timesheet 
-            WHERE user_id = %s AND date = CURDATE()
+            WHERE user_id = %s AND date = %s
         """
-        success, result = self.execute_query(query, (user_id,))
+        success, result = self.execute_query(query, (user_id, datetime.now().date()), prepared=True)
         return result[0] if success and result else None
 
     def record_time_in(self, user_id):
         """Record time in for today"""
         query = """
             INSERT INTO Timesheet (user_id, time_in, date)
-            VALUES (%s, NOW(), CURDATE())
+            VALUES (%s, NOW(), %s)
         """
-        return self.execute_query(query, (user_id,))[0]
+        success = self.execute_query(query, (user_id, datetime.now().date()), prepared=True)[0]
+        if success:
+            self.bump_data_version(user_id)
+            self.publish_attendance('time_in', user_id, datetime.now().date())
+        return success
 
     def record_time_out(self, user_id):
         """Record time out for today"""
@@ -142,10 +1240,152 @@ class DatabaseOperations:
             UPDATE Timesheet 
             SET time_out = NOW()
             WHERE user_id = %s 
-            AND date = CURDATE() 
+            AND date = %s
             AND time_out IS NULL
         """
-        return self.execute_query(query, (user_id,))[0]
+        success = self.execute_query(query, (user_id, datetime.now().date()), prepared=True)[0]
+        if success:
+            self.bump_data_version(user_id)
+            self.publish_attendance('time_out', user_id, datetime.now().date())
+        return success
+
+    def publish_attendance(self, kind, user_id, day):
+        """Publish a user's attendance row for day to the live dashboard feed"""
+        if not broker.has_subscribers():
+            return
+        query = """
+            SELECT t.user_id, u.username, t.date, t.time_in, t.time_out, t.total_time, t.notes
+            FROM Timesheet t
+            JOIN User u ON t.user_id = u.user_id
+            WHERE t.user_id = %s AND t.date = %s
+        """
+        success, result = self.execute_query(query, (user_id, day))
+        if not success or not result:
+            return
+        entry = result[0]
+        broker.publish(kind, {
+            'user_id': entry['user_id'],
+            'username': entry['username'],
+            'date': entry['date'].strftime('%Y-%m-%d'),
+            'time_in': entry['time_in'].strftime('%I:%M %p') if entry['time_in'] else None,
+            'time_out': entry['time_out'].strftime('%I:%M %p') if entry['time_out'] else None,
+            'total_time': str(entry['total_time']) if entry['total_time'] else None,
+            'notes': entry['notes']
+        })
+
+    def sync_punches(self, user_id, events):
+        """Apply a batch of offline punches in one transaction
+
+        Each event is a dict with a client-chosen idempotency 'key', a 'type'
+        of 'in' or 'out' and the client 'timestamp' (naive local datetime).
+        New events are applied in timestamp order with the rules of
+        record_time_in and record_time_out, on the event's own day. Every
+        outcome is stored in PunchSync under its key, so a replayed event
+        returns its stored outcome without touching Timesheet.
+
+        Returns:
+            tuple: (success, list of {'key', 'status', 'message', 'replayed'}
+            in event order, status being 'applied' or 'rejected')
+        """
+        keys = list(dict.fromkeys(event['key'] for event in events))
+
+        def sync(cursor):
+            placeholders = ', '.join(['%s'] * len(keys))
+            cursor.execute(
+                f"""
+                SELECT idempotency_key, status, message FROM PunchSync
+                WHERE user_id = %s AND idempotency_key IN ({placeholders})
+                """,
+                (user_id, *keys)
+            )
+            outcomes = {row['idempotency_key']: dict(row, replayed=True) for row in cursor.fetchall()}
+
+            new_events = {}
+            for event in events:
+                if event['key'] not in outcomes:
+                    new_events.setdefault(event['key'], event)
+            new_events = sorted(new_events.values(), key=lambda event: event['timestamp'])
+            if not new_events:
+                return outcomes, None
+
+            days = sorted({event['timestamp'].date() for event in new_events})
+            placeholders = ', '.join(['%s'] * len(days))
+            cursor.execute(
+                f"""
+                SELECT date, time_in, time_out FROM Timesheet
+                WHERE user_id = %s AND date IN ({placeholders})
+                FOR UPDATE
+                """,
+                (user_id, *days)
+            )
+            entries = {row['date']: row for row in cursor.fetchall()}
+
+            first_applied = None
+            for event in new_events:
+                punch = event['timestamp']
+                entry = entries.get(punch.date())
+                message = None
+                if event['type'] == 'in':
+                    if entry:
+                        message = 'Already timed in on this day'
+                    else:
+                        cursor.execute(
+                            "INSERT INTO Timesheet (user_id, time_in, date) VALUES (%s, %s, %s)",
+                            (user_id, punch, punch.date())
+                        )
+                        entries[punch.date()] = {'time_in': punch, 'time_out': None}
+                else:
+                    if not entry:
+                        message = 'No time in on this day'
+                    elif entry['time_out']:
+                        message = 'Already timed out on this day'
+                    elif entry['time_in'] and punch <= entry['time_in']:
+                        message = 'Time out is before time in'
+                    else:
+                        cursor.execute(
+                            """
+                            UPDATE Timesheet SET time_out = %s
+                            WHERE user_id = %s AND date = %s AND time_out IS NULL
+                            """,
+                            (punch, user_id, punch.date())
+                        )
+                        entry['time_out'] = punch
+                if message is None and (first_applied is None or punch.date() < first_applied):
+                    first_applied = punch.date()
+                outcomes[event['key']] = {
+                    'status': 'rejected' if message else 'applied',
+                    'message': message or 'Time ' + event['type'] + ' recorded',
+                    'replayed': False
+                }
+
+            cursor.executemany(
+                "INSERT INTO PunchSync (user_id, idempotency_key, status, message) VALUES (%s, %s, %s, %s)",
+                [(user_id, event['key'], outcomes[event['key']]['status'], outcomes[event['key']]['message'])
+                 for event in new_events]
+            )
+            return outcomes, first_applied
+
+        success, result = self.run_transaction(sync)
+        if not success:
+            return False, None
+        outcomes, first_applied = result
+        if first_applied is not None:
+            self.bump_data_version(user_id)
+            if first_applied < datetime.now().date():
+                self.invalidate_balance_checkpoints(user_id, first_applied)
+        for event in events:
+            outcome = outcomes[event['key']]
+            if outcome['status'] == 'applied' and not outcome['replayed']:
+                self.publish_attendance('time_' + event['type'], user_id, event['timestamp'].date())
+        return True, [
+            {
+                'key': event['key'],
+                'status': outcomes[event['key']]['status'],
+                'message': outcomes[event['key']]['message'],
+                'replayed': outcomes[event['key']]['replayed']
+            }
+            for event in events
+        ]
 
     def update_timesheet_note(self, user_id, note):
         """Update the note for today's timesheet entry"""
@@ -153,13 +1393,23 @@ class DatabaseOperations:
             UPDATE Timesheet 
             SET notes = %s
             WHERE user_id = %s 
-            AND date = CURDATE()
+            AND date = %s
         """
-        return self.execute_query(query, (note, user_id))[0]
+        today = datetime.now().date()
+
+        def update(cursor):
+            cursor.execute(query, (note, user_id, today))
+            if cursor.rowcount:
+                index_note(cursor, 'timesheet', 0, user_id, today, note)
+
+        success = self.run_transaction(update)[0]
+        if success:
+            self.bump_data_version(user_id)
+        return success
 
     def get_total_staff_count(self):
         """Get the total number of staff users"""
-        query = "SELECT COUNT(*) as count FROM User WHERE role = 'Staff'"
+        query = "SELECT COUNT(*) as count FROM User WHERE role = 'Staff' AND deleted_at IS NULL"
         success, result = self.execute_query(query)
         return result[0]['count'] if success and result else 0
 
@@ -169,10 +1419,11 @@ class DatabaseOperations:
             SELECT COUNT(DISTINCT t.user_id) as count 
             FROM Timesheet t
             JOIN User u ON t.user_id = u.user_id
-            WHERE t.date = CURDATE()
+            WHERE t.date = %s
             AND u.role = 'Staff'
+            AND u.deleted_at IS NULL
         """
-        success, result = self.execute_query(query)
+        success, result = self.execute_query(query, (datetime.now().date(),))
         return result[0]['count'] if success and result else 0
 
     def get_pending_leaves_count(self):
@@ -183,6 +1434,7 @@ class DatabaseOperations:
             JOIN User u ON l.user_id = u.user_id
             WHERE l.status = 'Pending'
             AND u.role = 'Staff'
+            AND u.deleted_at IS NULL
         """
         success, result = self.execute_query(query)
         return result[0]['count'] if success and result else 0
@@ -193,11 +1445,12 @@ class DatabaseOperations:
             SELECT t.*, u.username 
             FROM Timesheet t
             JOIN User u ON t.user_id = u.user_id
-            WHERE t.date = CURDATE()
+            WHERE t.date = %s
             AND u.role = 'Staff'
+            AND u.deleted_at IS NULL
             ORDER BY t.time_in DESC
         """
-        success, result = self.execute_query(query)
+        success, result = self.execute_query(query, (datetime.now().date(),))
         return result if success else []
 
     def get_pending_leave_requests(self):
@@ -208,16 +1461,90 @@ class DatabaseOperations:
             JOIN User u ON l.user_id = u.user_id
             WHERE l.status = 'Pending'
             AND u.role = 'Staff'
+            AND u.deleted_at IS NULL
             ORDER BY l.created_at ASC
         """
         success, result = self.execute_query(query)
         return result if success else []
 
+    def get_timesheets_for_review(self, limit=100):
+        """Rows closed automatically that an admin has not confirmed yet, oldest first"""
+        query = """
+            SELECT t.timesheet_id, t.user_id, u.username, t.date, t.time_in, t.time_out, t.total_time
+            FROM Timesheet t
+            JOIN User u ON t.user_id = u.user_id
+            WHERE t.needs_review = 1
+            AND u.deleted_at IS NULL
+            ORDER BY t.date, t.timesheet_id
+            LIMIT %s
+        """
+        success, result = self.execute_query(query, (limit,))
+        return result if success else []
+
+    def review_timesheet(self, timesheet_id, time_out=None):
+        """Confirm an automatically closed row, optionally correcting its time out
+
+        Args:
+            timesheet_id: int
+            time_out: datetime.time on the row's day, None keeps the current one
+
+        Returns:
+            bool: True if successful, False if the row is not awaiting review
+            or time_out is before its time in
+        """
+        def review(cursor):
+            cursor.execute("""
+                SELECT user_id, date, time_in FROM Timesheet
+                WHERE timesheet_id = %s AND needs_review = 1
+                FOR UPDATE
+            """, (timesheet_id,))
+            row = cursor.fetchone()
+            if not row:
+                return None
+            new_time_out = datetime.combine(row['date'], time_out) if time_out is not None else None
+            if new_time_out is not None and new_time_out < row['time_in']:
+                return None
+            cursor.execute("""
+                UPDATE Timesheet
+                SET needs_review = 0, time_out = COALESCE(%s, time_out)
+                WHERE timesheet_id = %s AND date = %s
+            """, (new_time_out, timesheet_id, row['date']))
+            return row
+
+        success, row = self.run_transaction(review)
+        if not success or row is None:
+            return False
+        self.bump_data_version(row['user_id'])
+        if time_out is not None:
+            self.invalidate_balance_checkpoints(row['user_id'], row['date'])
+        return True
+
+    def _load_reference_data(self):
+        hours_success, working_hours = self.execute_query("SELECT * FROM WorkingHours ORDER BY day_type, id")
+        roster_success, roster = self.execute_query(
+            "SELECT user_id, username, role FROM User WHERE deleted_at IS NULL ORDER BY username"
+        )
+        if not hours_success or not roster_success:
+            return None
+        return {'working_hours': working_hours or [], 'roster': roster or []}
+
+    def get_reference_data(self):
+        """Working hours and staff roster from the shared reference cache"""
+        return reference_cache.get(self._load_reference_data) or {'working_hours': [], 'roster': []}
+
+    def get_staff_roster(self):
+        """user_id, username and role of every user, ordered by username"""
+        return self.get_reference_data()['roster']
+
     def get_working_hours(self):
         """Get configured working hours"""
-        query = "SELECT * FROM WorkingHours ORDER BY day_type"
-        success, result = self.execute_query(query)
-        return result if success else []
+        return self.get_reference_data()['working_hours']
+
+    def _working_hours_for_day_type(self, day_type):
+        for row in self.get_working_hours():
+            if row['day_type'] == day_type:
+                return row
+        return None
 
     def update_working_hours(self, day_type, start_time, end_time, admin_id):
         """Update working hours configuration"""
@@ -226,7 +1553,13 @@ class DatabaseOperations:
             SET start_time = %s, end_time = %s, updated_by = %s 
             WHERE day_type = %s
         """
-        return self.execute_query(query, (start_time, end_time, admin_id, day_type))[0]
+        success = self.execute_query(query, (start_time, end_time, admin_id, day_type))[0]
+        if success:
+            # Expected minutes change for every past day, so no checkpoint survives
+            self.bump_data_version(settings=True)
+            self.invalidate_balance_checkpoints()
+            broker.publish('working_hours', {'day_type': day_type})
+        return success
 
     def get_expected_working_minutes(self, date):
         """Get expected working minutes for a given date
@@ -243,13 +1576,10 @@ class DatabaseOperations:
             
         # Get working hours configuration
         day_type = 'Saturday' if date.isoweekday() == 6 else 'Weekday'
-        query = "SELECT start_time, end_time FROM WorkingHours WHERE day_type = %s"
-        success, result = self.execute_query(query, (day_type,))
+        working_hours = self._working_hours_for_day_type(day_type)
         
-        if not success or not result:
+        if not working_hours:
             return 0
-            
-        working_hours = result[0]
         
         # Convert timedelta to time object
         start_seconds = int(working_hours['start_time'].total_seconds())
@@ -285,7 +1615,7 @@ class DatabaseOperations:
             
         # Check for timesheet entry
         query = """
-            SELECT time_in, time_out, notes 
+            SELECT worked_minutes, entry_type 
             FROM Timesheet 
             WHERE user_id = %s AND date = %s AND time_out IS NOT NULL
         """
@@ -296,29 +1626,17 @@ class DatabaseOperations:
             
         entry = result[0]
         
-        # If this is a leave entry, count it as full day
-        notes = entry.get('notes') or ''  # Handle NULL notes
-        if 'leave' in notes.lower():
+        # If this is a leave or holiday entry, count it as full day
+        if entry['entry_type'] in PAID_ENTRY_TYPES:
             return self.get_expected_working_minutes(date)
             
         # Get working hours for this day
         day_type = 'Saturday' if date.isoweekday() == 6 else 'Weekday'
-        query = "SELECT start_time, end_time FROM WorkingHours WHERE day_type = %s"
-        success, result = self.execute_query(query, (day_type,))
-        
-        if not success or not result:
+        if not self._working_hours_for_day_type(day_type):
             return 0
             
-        # Convert the actual times to datetime objects
-        actual_start = datetime.combine(date, entry['time_in'].time())
-        actual_end = datetime.combine(date, entry['time_out'].time())
-        
-        # Calculate actual minutes worked including overtime
-        if actual_end > actual_start:
-            minutes_worked = int((actual_end - actual_start).total_seconds() / 60)
-            return minutes_worked
-            
-        return 0
+        # Minutes between clock times including overtime, stored by the database
+        return entry['worked_minutes'] or 0
 
     def calculate_time_owed(self, user_id, start_date=None, end_date=None):
         """Calculate total time owed by a user
@@ -418,6 +1736,7 @@ class DatabaseOperations:
             SELECT user_id, username, employment_date 
             FROM User 
             WHERE role = 'Staff'
+            AND deleted_at IS NULL
         """
         success, staff_users = self.execute_query(query)
         
@@ -520,20 +1839,88 @@ class DatabaseOperations:
         # Sort by most time owed
         return sorted(result, key=lambda x: x['total_minutes_owed'], reverse=True)
 
+    def get_worked_minutes_by_user(self, start_date, end_date):
+        """Get total worked minutes per staff member over a date range
+
+        Hot rows are read from the (user_id, date, worked_minutes) covering
+        index. Where the range reaches archived dates, whole archived months
+        come from TimesheetMonthlySummary and partial ones from TimesheetArchive.
+
+        Returns:
+            dict: {user_id: total worked minutes}
+        """
+        query = """
+            SELECT t.user_id, SUM(t.worked_minutes) as worked_minutes
+            FROM User u
+            JOIN Timesheet t ON t.user_id = u.user_id
+            WHERE u.role = 'Staff'
+            AND u.deleted_at IS NULL
+            AND t.date BETWEEN %s AND %s
+            AND t.worked_minutes IS NOT NULL
+            GROUP BY t.user_id
+        """
+        success, result = self.execute_query(query, (start_date, end_date), read_only=True)
+        if not success:
+            return {}
+        totals = {row['user_id']: int(row['worked_minutes']) for row in result or []}
+
+        watermark = self.get_archive_watermark()
+        if watermark is None or start_date > watermark:
+            return totals
+
+        # Months are archived whole, so the watermark's month is archived too
+        next_month = (watermark.replace(day=1) + timedelta(days=32)).replace(day=1)
+        archive_end = min(end_date, next_month - timedelta(days=1))
+        first_full = start_date if start_date.day == 1 else (start_date.replace(day=1) + timedelta(days=32)).replace(day=1)
+        after_archive_end = archive_end + timedelta(days=1)
+        last_full = archive_end if after_archive_end.day == 1 else after_archive_end.replace(day=1) - timedelta(days=1)
+
+        parts = []
+        if first_full <= last_full:
+            parts.append(("""
+                SELECT s.user_id, SUM(s.worked_minutes) as worked_minutes
+                FROM TimesheetMonthlySummary s
+                JOIN User u ON s.user_id = u.user_id
+                WHERE u.role = 'Staff'
+                AND u.deleted_at IS NULL
+                AND s.month_start BETWEEN %s AND %s
+                GROUP BY s.user_id
+            """, (first_full, last_full)))
+            edges = [(start_date, first_full - timedelta(days=1)), (last_full + timedelta(days=1), archive_end)]
+        else:
+            edges = [(start_date, archive_end)]
+        for edge_start, edge_end in edges:
+            if edge_start <= edge_end:
+                parts.append(("""
+                    SELECT a.user_id, SUM(a.worked_minutes) as worked_minutes
+                    FROM User u
+                    JOIN TimesheetArchive a ON a.user_id = u.user_id
+                    WHERE u.role = 'Staff'
+                    AND u.deleted_at IS NULL
+                    AND a.date BETWEEN %s AND %s
+                    AND a.worked_minutes IS NOT NULL
+                    GROUP BY a.user_id
+                """, (edge_start, edge_end)))
+
+        for part_query, part_params in parts:
+            success, result = self.execute_query(part_query, part_params, read_only=True)
+            if not success:
+                return {}
+            for row in result or []:
+                totals[row['user_id']] = totals.get(row['user_id'], 0) + int(row['worked_minutes'] or 0)
+        return totals
+
     def get_working_hours_for_date(self, date):
         """Get working hours configuration for a specific date"""
         day_type = 'Saturday' if date.weekday() == 5 else 'Weekday'
-        
-        query = """
-            SELECT start_time, end_time
-            FROM WorkingHours
-            WHERE day_type = %s
-        """
-        success, result = self.execute_query(query, (day_type,))
-        return result[0] if success and result else None
+        return self._working_hours_for_day_type(day_type)
 
     def create_leave_timesheet_entry(self, user_id, date, reason):
-        """Create a timesheet entry for an approved leave day"""
+        """Create a timesheet entry for an approved leave day
+
+        process_approved_leave bumps the user's version and invalidates their
+        balance checkpoints once for the whole leave.
+        """
         working_hours = self.get_working_hours_for_date(date)
         if not working_hours:
             return False
@@ -555,19 +1942,33 @@ class DatabaseOperations:
         time_in = datetime.combine(date, start_time)
         time_out = datetime.combine(date, end_time)
         
-        # Delete any existing timesheet entry for this date
+        # Existing entries for this date are replaced in the same transaction,
+        # so a failure or retry never leaves the day without them
         delete_query = """
             DELETE FROM Timesheet
             WHERE user_id = %s AND date = %s
         """
-        self.execute_query(delete_query, (user_id, date))
+        watermark = self.get_archive_watermark()
         
         # Insert new timesheet entry with leave information
         query = """
-            INSERT INTO Timesheet (user_id, time_in, time_out, date, notes)
-            VALUES (%s, %s, %s, %s, %s)
+            INSERT INTO Timesheet (user_id, time_in, time_out, date, notes, entry_type)
+            VALUES (%s, %s, %s, %s, %s, 'Leave')
         """
-        return self.execute_query(query, (user_id, time_in, time_out, date, reason))[0]
+        def insert(cursor):
+            cursor.execute(delete_query, (user_id, date))
+            if watermark is not None and date <= watermark:
+                cursor.execute(
+                    "DELETE FROM TimesheetArchive WHERE user_id = %s AND date = %s",
+                    (user_id, date)
+                )
+                if cursor.rowcount:
+                    # Reports add the archived month's summary to hot rows
+                    refresh_monthly_summaries(cursor, [user_id], date)
+            cursor.execute(query, (user_id, time_in, time_out, date, reason))
+            index_note(cursor, 'timesheet', 0, user_id, date, reason)
+
+        return self.run_transaction(insert)[0]
 
     def process_approved_leave(self, leave_id, status):
         """Process leave approval by updating status and creating timesheet entries"""
@@ -601,58 +2002,49 @@ class DatabaseOperations:
                     )
                 current_date += timedelta(days=1)
 
+        # One bump for the decision and its entries. Approved leave days count
+        # as worked, so balances from the start date change
+        self.bump_data_version(leave['user_id'])
+        self.invalidate_balance_checkpoints(leave['user_id'], leave['start_date'])
+        if broker.has_subscribers():
+            broker.publish('leave_status', {
+                'leave_id': int(leave_id),
+                'user_id': leave['user_id'],
+                'status': status,
+                'start_date': leave['start_date'].strftime('%Y-%m-%d'),
+                'end_date': leave['end_date'].strftime('%Y-%m-%d')
+            })
         return True
 
     def delete_staff(self, user_id):
-        """Delete a staff member and all their related records
-        
+        """Soft delete a staff member
+
+        The user is hidden from every staff query and can no longer log in as
+        soon as this returns, and their email and username are free again. Their history is removed later in small batches
+        by app.maintenance.StaffPurger, so no long transaction holds locks on
+        Timesheet.
+
         Args:
             user_id: int
             
         Returns:
-            bool: True if successful, False otherwise
+            bool: True if a staff member was deleted, False otherwise
         """
-        conn = None
-        cursor = None
-        try:
-            conn = self.db.connect()
-            if conn is None:
-                return False
-            
-            # Create cursor with dictionary=True
-            cursor = conn.cursor(dictionary=True)
-            
-            # Start transaction
-            conn.start_transaction()
-            
-            # First verify this is not an admin
-            cursor.execute("SELECT role FROM User WHERE user_id = %s", (user_id,))
-            user = cursor.fetchone()
-            if not user or user['role'] == 'Admin':
-                conn.rollback()
-                return False
-            
-            # Delete timesheet records
-            cursor.execute("DELETE FROM Timesheet WHERE user_id = %s", (user_id,))
-            
-            # Delete leave records
-            cursor.execute("DELETE FROM LeaveRecord WHERE user_id = %s", (user_id,))
-            
-            # Finally delete the user
-            cursor.execute("DELETE FROM User WHERE user_id = %s", (user_id,))
-            
-            # Commit transaction
-            conn.commit()
-            return True
-            
-        except Exception as e:
-            print(f"Error deleting staff: {e}")
-            if conn and conn.is_connected():
-                conn.rollback()
-            return False
-            
-        finally:
-            if cursor:
-                cursor.close()
-            if conn and conn.is_connected():
-                conn.close()
\ No newline at end of file
+        def soft_delete(cursor):
+            # Admins cannot be deleted. The email and username are unique, so
+            # they are prefixed to let the same person register again at once
+            cursor.execute(f"""
+                UPDATE User SET deleted_at = NOW(),
+                    email = {DELETED_USER_RENAME.format(column='email')},
+                    username = {DELETED_USER_RENAME.format(column='username')}
+                WHERE user_id = %s AND role = 'Staff' AND deleted_at IS NULL
+            """, (user_id,))
+            return cursor.rowcount
+
+        success, deleted = self.run_transaction(soft_delete)
+        if not success:
+            print(f"Error deleting staff {user_id}")
+        elif deleted:
+            self.bump_data_version(user_id)
+            broker.publish('staff_deleted', {'user_id': int(user_id)})
+        return bool(success and deleted)
\ No newline at end of file
@@ -0,0 +1,161 @@
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Recent events kept for clients that reconnect with Last-Event-ID, and events
+# a slow client may have queued before it is disconnected
+EVENT_BACKLOG = int(os.getenv("EVENT_BACKLOG", "200"))
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "100"))
+# Open event streams per worker process. Under gunicorn's gthread worker each
+# stream holds one of the worker's GUNICORN_THREADS request threads for its
+# whole life, so the cap leaves EVENT_RESERVED_THREADS threads for ordinary
+# requests; streams over the cap get a 503 and the page retries later. With
+# the Dockerfile's 4 workers x 8 threads that is 4 streams per worker, 16 per
+# container. Raise GUNICORN_THREADS (not the cap alone) for more dashboards.
+GUNICORN_THREADS = int(os.getenv("GUNICORN_THREADS", "8"))
+EVENT_RESERVED_THREADS = int(os.getenv("EVENT_RESERVED_THREADS", "4"))
+EVENT_MAX_SUBSCRIBERS = int(os.getenv(
+    "EVENT_MAX_SUBSCRIBERS", str(max(0, GUNICORN_THREADS - EVENT_RESERVED_THREADS))
+))
+# A process with open streams announces them to the others this often; the
+# others treat the announcement as valid for three periods
+EVENT_PRESENCE_SECONDS = float(os.getenv("EVENT_PRESENCE_SECONDS", "10"))
+
+# Relayed between processes only, never shown to subscribers
+PRESENCE_EVENT = 'listeners'
+
+
+class Subscription:
+    """One listener's queue of events"""
+
+    def __init__(self, size):
+        self.queue = queue.Queue(maxsize=size)
+        self.closed = False
+
+    def get(self, timeout):
+        """Next event, or None if none arrived within timeout seconds"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventBroker:
+    """In-process publish/subscribe for live dashboard events
+
+    publish() never blocks: a subscriber whose queue is full is closed instead,
+    and its client catches up from the backlog when it reconnects. Event ids
+    carry a per-process token, so a Last-Event-ID from another process (or
+    from before a restart) is not mistaken for a local one.
+
+    Handlers registered with on() run synchronously for every event of their
+    kind, local or relayed from another process, and are meant for cheap work
+    such as dropping a cache entry. When a relay is set (see app.changes),
+    locally published events are also handed to it for the other processes,
+    which pass them back in through deliver().
+
+    has_subscribers() tells publishers of live-feed-only events whether
+    anyone could see them. Processes with open streams announce themselves
+    through the relay (announce()), so with no dashboard open anywhere those
+    events cost nothing.
+    """
+
+    def __init__(self, backlog=EVENT_BACKLOG, queue_size=EVENT_QUEUE_SIZE, max_subscribers=EVENT_MAX_SUBSCRIBERS):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._backlog = deque(maxlen=backlog)
+        self._handlers = {}
+        self._token = uuid.uuid4().hex[:8]
+        self._sequence = 0
+        self.relay = None
+        self._remote_until = 0.0
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+
+    def has_subscribers(self):
+        """True if anyone, here or in another process, may receive events"""
+        return bool(self._subscribers) or time.monotonic() < self._remote_until
+
+    def announce(self):
+        """Tell the other processes this one has open streams"""
+        if self.relay is not None and self._subscribers:
+            self.relay(PRESENCE_EVENT, {})
+
+    def on(self, kind, handler):
+        """Call handler(data) for every event of kind"""
+        with self._lock:
+            self._handlers.setdefault(kind, []).append(handler)
+
+    def publish(self, kind, data):
+        """Send an event to every subscriber and handler, and to the relay
+
+        Args:
+            kind: str event name, e.g. 'time_in'
+            data: JSON-serializable dict
+        """
+        self.deliver(kind, data)
+        if self.relay is not None:
+            self.relay(kind, data)
+
+    def deliver(self, kind, data):
+        """Send an event to this process's subscribers and handlers only"""
+        if kind == PRESENCE_EVENT:
+            self._remote_until = time.monotonic() + 3 * EVENT_PRESENCE_SECONDS
+            return
+        for handler in self._handlers.get(kind, ()):
+            try:
+                handler(data)
+            except Exception as e:
+                print(f"Event handler error: {e}")
+
+        with self._lock:
+            self._sequence += 1
+            event = {'id': f"{self._token}-{self._sequence}", 'type': kind, 'data': data}
+            self._backlog.append(event)
+            subscribers = list(self._subscribers)
+
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(event)
+            except queue.Full:
+                self.unsubscribe(subscription)
+
+    def subscribe(self, last_event_id=None):
+        """Open a subscription, None when the process already has too many
+
+        Events after last_event_id that are still in the backlog are queued first.
+        """
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            subscription = Subscription(self.queue_size)
+            if last_event_id:
+                missed = self._events_after(last_event_id)
+                for event in missed[-self.queue_size:]:
+                    subscription.queue.put_nowait(event)
+            first = not self._subscribers
+            self._subscribers.add(subscription)
+        if first:
+            # Other processes start relaying live events from now on
+            self.announce()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+            subscription.closed = True
+
+    def _events_after(self, last_event_id):
+        token, _, sequence = last_event_id.partition('-')
+        if token != self._token or not sequence.isdigit():
+            return []
+        return [event for event in self._backlog if int(event['id'].split('-')[1]) > int(sequence)]
+
+
+broker = EventBroker()
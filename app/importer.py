@@ -0,0 +1,309 @@
+import argparse
+import csv
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from dotenv import load_dotenv
+from .db import DatabaseOperations
+
+load_dotenv()
+
+# Timesheet rows per insert transaction, rows read between progress reports,
+# and rejected lines kept in the report
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "5000"))
+IMPORT_PROGRESS_EVERY = int(os.getenv("IMPORT_PROGRESS_EVERY", "100000"))
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "100"))
+# strptime format for exports whose timestamps are not ISO 8601
+IMPORT_TIMESTAMP_FORMAT = os.getenv("IMPORT_TIMESTAMP_FORMAT")
+# Where uploaded exports wait for their import job (not under static/)
+IMPORT_FOLDER = os.getenv("IMPORT_FOLDER", "imports")
+
+DIRECTIONS = {'in': 'in', 'i': 'in', 'entry': 'in', 'out': 'out', 'o': 'out', 'exit': 'out'}
+
+
+class PunchImporter:
+    """Bulk load badge reader / door access punch exports into Timesheet
+
+    The CSV needs a header with a user_id or email column and a timestamp
+    column; an optional direction column (in/out) tells entries from exits.
+    Punches are folded into one row per user and day: the first entry is the
+    time in and the last exit the time out (without directions, the first and
+    last punch). A day with exits but no entry is rejected rather than saved
+    as an open shift. Days that already have a Timesheet row, hot or
+    archived, are skipped as duplicates. New rows go in with multi-row
+    INSERTs, one transaction per batch.
+
+    Memory grows with the number of distinct user-days, not with punches.
+    """
+
+    def __init__(self, db=None, batch_size=IMPORT_BATCH_SIZE, progress=None):
+        self.db = db or DatabaseOperations()
+        self.batch_size = batch_size
+        self.progress = progress
+
+    def import_file(self, path):
+        """Import a CSV export from disk, see import_lines"""
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            return self.import_lines(f)
+
+    def import_lines(self, lines):
+        """Import an iterable of CSV lines (header first)
+
+        Returns:
+            dict: rows_read, rejected, days, duplicates, inserted, errors,
+            seconds and success
+        """
+        began = time.monotonic()
+        stats = {
+            'rows_read': 0, 'rejected': 0, 'days': 0, 'duplicates': 0, 'inserted': 0,
+            'errors': [], 'seconds': 0.0, 'success': False
+        }
+        try:
+            days = self._read_punches(csv.DictReader(lines), stats)
+        except ValueError as e:
+            stats['errors'].append(str(e))
+            return self._finish(stats, began)
+        stats['days'] = len(days)
+
+        rows = []
+        for (user_id, day), (first_in, last_out, first, last, punches) in days.items():
+            if first_in is None and last_out is not None:
+                # An exit is not a time in; saving it would leave an open shift
+                stats['rejected'] += punches
+                if len(stats['errors']) < IMPORT_MAX_ERRORS:
+                    stats['errors'].append(f"user {user_id} on {day}: exit punches but no entry, day skipped")
+                continue
+            time_in = first_in or first
+            time_out = last_out or (last if punches > 1 else None)
+            if time_out is not None and time_out <= time_in:
+                time_out = None
+            rows.append((user_id, time_in, time_out, day))
+        rows.sort(key=lambda row: (row[3], row[0]))
+
+        imported = {}
+        try:
+            for i in range(0, len(rows), self.batch_size):
+                if not self._load_batch(rows[i:i + self.batch_size], stats, imported):
+                    return self._finish(stats, began)
+                self._report(stats)
+        finally:
+            # Committed batches count even when a later one failed
+            self._publish(imported)
+        stats['success'] = True
+        return self._finish(stats, began)
+
+    def _publish(self, imported):
+        """Invalidate balances and bump the versions of the users who got rows
+
+        Args:
+            imported: {user_id: earliest date inserted}
+        """
+        if not imported:
+            return
+        self.db.bump_data_version(user_ids=imported)
+        # Imported days can be in the past, so balances from each user's first one change
+        for user_id, first_day in imported.items():
+            self.db.invalidate_balance_checkpoints(user_id, first_day)
+
+    def _finish(self, stats, began):
+        stats['seconds'] = round(time.monotonic() - began, 2)
+        self._report(stats)
+        return stats
+
+    def _report(self, stats):
+        if self.progress:
+            self.progress(stats)
+
+    def _reject(self, stats, line, message):
+        stats['rejected'] += 1
+        if len(stats['errors']) < IMPORT_MAX_ERRORS:
+            stats['errors'].append(f"line {line}: {message}")
+
+    def _read_punches(self, reader, stats):
+        """Fold punches into {(user_id, date): [first in, last out, first, last, count]}"""
+        fields = {name.strip().lower(): name for name in reader.fieldnames or []}
+        if 'timestamp' not in fields or not ({'user_id', 'email'} & set(fields)):
+            raise ValueError("CSV header needs a timestamp column and a user_id or email column")
+        user_field = fields.get('user_id')
+        email_field = fields.get('email')
+        timestamp_field = fields['timestamp']
+        direction_field = fields.get('direction')
+
+        users_by_id, users_by_email = self._load_users()
+        now = datetime.now()
+        days = {}
+        for line, record in enumerate(reader, start=2):
+            stats['rows_read'] += 1
+            if stats['rows_read'] % IMPORT_PROGRESS_EVERY == 0:
+                self._report(stats)
+
+            if user_field and (record.get(user_field) or '').strip():
+                try:
+                    user_id = int(record[user_field])
+                except ValueError:
+                    self._reject(stats, line, f"invalid user_id {record[user_field]!r}")
+                    continue
+                if user_id not in users_by_id:
+                    self._reject(stats, line, f"unknown user_id {user_id}")
+                    continue
+            else:
+                email = (record.get(email_field) or '').strip().lower() if email_field else ''
+                user_id = users_by_email.get(email)
+                if user_id is None:
+                    self._reject(stats, line, f"unknown user {email!r}")
+                    continue
+
+            try:
+                punch = self._parse_timestamp((record.get(timestamp_field) or '').strip())
+            except ValueError:
+                self._reject(stats, line, f"invalid timestamp {record.get(timestamp_field)!r}")
+                continue
+            if punch > now:
+                self._reject(stats, line, "timestamp is in the future")
+                continue
+
+            direction = None
+            if direction_field and (record.get(direction_field) or '').strip():
+                direction = DIRECTIONS.get(record[direction_field].strip().lower())
+                if direction is None:
+                    self._reject(stats, line, f"invalid direction {record[direction_field]!r}")
+                    continue
+
+            entry = days.get((user_id, punch.date()))
+            if entry is None:
+                entry = days[(user_id, punch.date())] = [None, None, punch, punch, 0]
+            if direction == 'in' and (entry[0] is None or punch < entry[0]):
+                entry[0] = punch
+            elif direction == 'out' and (entry[1] is None or punch > entry[1]):
+                entry[1] = punch
+            entry[2] = min(entry[2], punch)
+            entry[3] = max(entry[3], punch)
+            entry[4] += 1
+        return days
+
+    @staticmethod
+    def _parse_timestamp(value):
+        if IMPORT_TIMESTAMP_FORMAT:
+            return datetime.strptime(value, IMPORT_TIMESTAMP_FORMAT)
+        return datetime.fromisoformat(value).replace(tzinfo=None)
+
+    def _load_users(self):
+        query = "SELECT user_id, email FROM User WHERE deleted_at IS NULL"
+        success, result = self.db.execute_query(query)
+        if not success:
+            raise ValueError("Failed to load users")
+        return (
+            {row['user_id'] for row in result or []},
+            {row['email'].lower(): row['user_id'] for row in result or []}
+        )
+
+    def _load_batch(self, rows, stats, imported):
+        """Insert the rows of a batch whose (user_id, date) has no Timesheet row yet
+
+        Users who got rows are added to imported with their earliest new date.
+        """
+        keys = [(user_id, day) for user_id, _, _, day in rows]
+        tables = ['Timesheet']
+        watermark = self.db.get_archive_watermark()
+        if watermark is not None and rows[0][3] <= watermark:
+            tables.append('TimesheetArchive')
+
+        pairs = ', '.join(['(%s, %s)'] * len(keys))
+        params = tuple(value for key in keys for value in key)
+
+        def load(cursor):
+            existing = set()
+            for table in tables:
+                cursor.execute(f"SELECT user_id, date FROM {table} WHERE (user_id, date) IN ({pairs})", params)
+                existing.update((row['user_id'], row['date']) for row in cursor.fetchall())
+            new_rows = [row for row in rows if (row[0], row[3]) not in existing]
+            if new_rows:
+                cursor.executemany(
+                    "INSERT INTO Timesheet (user_id, time_in, time_out, date) VALUES (%s, %s, %s, %s)",
+                    new_rows
+                )
+            return new_rows
+
+        success, new_rows = self.db.run_transaction(load)
+        if not success:
+            stats['errors'].append("Database error while loading a batch")
+            return False
+        for user_id, _, _, day in new_rows:
+            if user_id not in imported or day < imported[user_id]:
+                imported[user_id] = day
+        stats['inserted'] += len(new_rows)
+        stats['duplicates'] += len(rows) - len(new_rows)
+        return True
+
+
+def create_import_job(db, filename, user_id):
+    """Record a queued import and return its job id"""
+    def create(cursor):
+        cursor.execute("INSERT INTO ImportJob (filename, created_by) VALUES (%s, %s)", (filename, user_id))
+        return cursor.lastrowid
+
+    success, job_id = db.run_transaction(create)
+    return job_id if success else None
+
+
+def update_import_job(db, job_id, stats, status):
+    query = """
+        UPDATE ImportJob
+        SET status = %s, rows_read = %s, rejected = %s, duplicates = %s, inserted = %s,
+            errors = %s, finished_at = IF(%s IN ('Done', 'Failed'), NOW(), NULL)
+        WHERE job_id = %s
+    """
+    db.execute_query(query, (
+        status, stats['rows_read'], stats['rejected'], stats['duplicates'], stats['inserted'],
+        json.dumps(stats['errors']), status, job_id
+    ))
+
+
+def get_import_job(db, job_id):
+    success, result = db.execute_query("SELECT * FROM ImportJob WHERE job_id = %s", (job_id,))
+    if not success or not result:
+        return None
+    job = result[0]
+    job['errors'] = json.loads(job['errors']) if job['errors'] else []
+    return job
+
+
+def start_import_job(db, job_id, path):
+    """Import an uploaded file in a daemon thread, recording progress on the job
+
+    The file is removed once the import finishes.
+    """
+    def run():
+        importer = PunchImporter(db, progress=lambda stats: update_import_job(db, job_id, stats, 'Running'))
+        stats = {'rows_read': 0, 'rejected': 0, 'duplicates': 0, 'inserted': 0, 'errors': []}
+        try:
+            stats = importer.import_file(path)
+        except Exception as e:
+            stats['errors'].append(str(e))
+            stats['success'] = False
+        finally:
+            update_import_job(db, job_id, stats, 'Done' if stats.get('success') else 'Failed')
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    threading.Thread(target=run, name=f'punch-import-{job_id}', daemon=True).start()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Import a CSV punch export into Timesheet")
+    parser.add_argument('path', help="CSV with user_id or email, timestamp and optional direction columns")
+    parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    def print_progress(stats):
+        print(f"{stats['rows_read']} punches read, {stats['inserted']} rows inserted, "
+              f"{stats['duplicates']} duplicates, {stats['rejected']} rejected", flush=True)
+
+    result = PunchImporter(batch_size=args.batch_size, progress=print_progress).import_file(args.path)
+    for error in result['errors']:
+        print(error)
+    print(f"{'Finished' if result['success'] else 'Failed'} in {result['seconds']}s")
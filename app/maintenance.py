@@ -0,0 +1,564 @@
+import argparse
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from .db import DatabaseOperations, PUNCH_SYNC_MAX_AGE_DAYS, TIMESHEET_COLUMNS, refresh_monthly_summaries
+from .partitioning import (
+    TIMESHEET_PARTITIONING,
+    TIMESHEET_PARTITIONS_AHEAD,
+    PARTITIONS_QUERY,
+    period_start,
+    shift_period,
+    partition_definitions,
+)
+
+load_dotenv()
+
+# Rows deleted per statement start at PURGE_BATCH_SIZE and adapt between the
+# min and max so each batch takes about PURGE_BATCH_TARGET_MS
+PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", "500"))
+PURGE_MIN_BATCH_SIZE = int(os.getenv("PURGE_MIN_BATCH_SIZE", "50"))
+PURGE_MAX_BATCH_SIZE = int(os.getenv("PURGE_MAX_BATCH_SIZE", "5000"))
+PURGE_BATCH_TARGET_MS = int(os.getenv("PURGE_BATCH_TARGET_MS", "100"))
+
+# After each batch the purge sleeps PURGE_PAUSE_RATIO times as long as the batch
+# took (and at least PURGE_MIN_PAUSE_MS), and one run stops after PURGE_MAX_SECONDS
+PURGE_PAUSE_RATIO = float(os.getenv("PURGE_PAUSE_RATIO", "1"))
+PURGE_MIN_PAUSE_MS = int(os.getenv("PURGE_MIN_PAUSE_MS", "20"))
+PURGE_MAX_SECONDS = float(os.getenv("PURGE_MAX_SECONDS", "60"))
+
+# Child tables of User in deletion order, with the column each batch is ordered by
+PURGE_TABLES = [
+    ('PunchSync', 'idempotency_key'),
+    ('NoteSearch', 'note_id'),
+    ('BalanceCheckpoint', 'period_end'),
+    ('LeaveRecord', 'leave_id'),
+    ('TimesheetMonthlySummary', 'month_start'),
+    ('TimesheetArchive', 'timesheet_id'),
+    ('Timesheet', 'timesheet_id'),
+]
+
+# PunchSync keys are kept this many days. Replays of older events are refused
+# by the sync age limit anyway, so this only needs to exceed it.
+PUNCH_SYNC_RETENTION_DAYS = int(os.getenv("PUNCH_SYNC_RETENTION_DAYS", str(PUNCH_SYNC_MAX_AGE_DAYS * 4)))
+
+# Timesheet months older than this many whole months are moved to
+# TimesheetArchive, ARCHIVE_BATCH_SIZE rows per transaction
+ARCHIVE_HORIZON_MONTHS = int(os.getenv("ARCHIVE_HORIZON_MONTHS", "24"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "1000"))
+ARCHIVE_MAX_SECONDS = float(os.getenv("ARCHIVE_MAX_SECONDS", "300"))
+
+# Work rows left open on a past day are closed by StaleTimesheetCloser with a
+# time out chosen by STALE_TIMESHEET_POLICY: 'shift_end' (the day's configured
+# end time, or the time in if that is later or there is no shift), 'hours'
+# (STALE_TIMESHEET_HOURS after the time in, within the same day) or 'time_in'
+# (zero minutes worked). Closed rows are flagged for admin review either way.
+STALE_TIMESHEET_POLICY = os.getenv("STALE_TIMESHEET_POLICY", "shift_end")
+STALE_TIMESHEET_HOURS = float(os.getenv("STALE_TIMESHEET_HOURS", "8"))
+STALE_TIMESHEET_BATCH_SIZE = int(os.getenv("STALE_TIMESHEET_BATCH_SIZE", "500"))
+STALE_TIMESHEET_MAX_SECONDS = float(os.getenv("STALE_TIMESHEET_MAX_SECONDS", "60"))
+
+STALE_TIMESHEET_CLOSE_TIMES = {
+    'shift_end': """COALESCE(GREATEST(time_in, TIMESTAMP(date,
+        CASE DAYOFWEEK(date) WHEN 1 THEN NULL WHEN 7 THEN %s ELSE %s END)), time_in)""",
+    'hours': "LEAST(time_in + INTERVAL %s MINUTE, TIMESTAMP(DATE(time_in), '23:59:59'))",
+    'time_in': "time_in",
+}
+
+# Served by idx_timesheet_open (time_out, date)
+STALE_TIMESHEET_QUERY = """
+    SELECT timesheet_id, user_id, date FROM Timesheet
+    WHERE time_out IS NULL AND date < %s
+    AND time_in IS NOT NULL AND entry_type = 'Work'
+    ORDER BY date, timesheet_id
+    LIMIT %s
+    FOR UPDATE
+"""
+
+_background_lock = threading.Lock()
+
+
+def acquire_named_lock(db, name):
+    """Take a MySQL named lock on a dedicated connection
+
+    The lock lives as long as the connection, so it is released even if the
+    process dies.
+
+    Returns:
+        connection holding the lock, None if it is held elsewhere or the
+        database is unreachable
+    """
+    conn = db.db.connect()
+    if conn is None:
+        return None
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT GET_LOCK(%s, 0)", (name,))
+        acquired = cursor.fetchone()[0] == 1
+    finally:
+        cursor.close()
+    if not acquired:
+        conn.close()
+        return None
+    return conn
+
+
+def release_named_lock(conn, name):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT RELEASE_LOCK(%s)", (name,))
+        cursor.fetchone()
+    finally:
+        cursor.close()
+        conn.close()
+
+
+class StaffPurger:
+    """Remove the history of soft-deleted staff in small, throttled batches
+
+    Every batch is its own short transaction, so row locks on Timesheet are
+    held for milliseconds rather than for a user's whole history. Progress needs
+    no bookkeeping: a user stays soft-deleted until their last row is gone, so
+    an interrupted or time-limited run simply resumes on the next one. A MySQL
+    named lock keeps a single purge running across all workers.
+    """
+
+    LOCK_NAME = 'staff_purge'
+
+    def __init__(self, db=None, batch_size=PURGE_BATCH_SIZE):
+        self.db = db or DatabaseOperations()
+        self.batch_size = batch_size
+
+    def pending_users(self):
+        """Ids of soft-deleted users, oldest deletion first"""
+        query = "SELECT user_id FROM User WHERE deleted_at IS NOT NULL ORDER BY deleted_at, user_id"
+        success, result = self.db.execute_query(query)
+        return [row['user_id'] for row in result] if success and result else []
+
+    def run(self, max_seconds=PURGE_MAX_SECONDS):
+        """Purge soft-deleted users until done or out of time
+
+        Returns:
+            dict: users_purged, rows_deleted and finished (False if time ran
+            out, the lock was held elsewhere or the database failed)
+        """
+        summary = {'users_purged': 0, 'rows_deleted': 0, 'finished': False}
+        lock_conn = acquire_named_lock(self.db, self.LOCK_NAME)
+        if lock_conn is None:
+            return summary
+
+        try:
+            deadline = time.monotonic() + max_seconds
+            for user_id in self.pending_users():
+                if not self._purge_user(user_id, deadline, summary):
+                    return summary
+                summary['users_purged'] += 1
+            summary['finished'] = True
+            return summary
+        finally:
+            release_named_lock(lock_conn, self.LOCK_NAME)
+
+    def _purge_user(self, user_id, deadline, summary):
+        """Delete one user's rows batch by batch, then the user; False if interrupted"""
+        for table, order_column in PURGE_TABLES:
+            while True:
+                if time.monotonic() >= deadline:
+                    return False
+                limit = self.batch_size
+                deleted = self._delete_batch(table, order_column, user_id, limit)
+                if deleted is None:
+                    return False
+                summary['rows_deleted'] += deleted
+                if deleted < limit:
+                    break
+
+        def delete_user(cursor):
+            # The user's own DataVersion counter is keyed by scope_id, not user_id
+            cursor.execute("DELETE FROM DataVersion WHERE scope_id = %s", (user_id,))
+            cursor.execute("DELETE FROM User WHERE user_id = %s AND deleted_at IS NOT NULL", (user_id,))
+
+        return self.db.run_transaction(delete_user)[0]
+
+    def _delete_batch(self, table, order_column, user_id, limit):
+        """Delete up to limit rows, adapt the batch size and pause; None on error"""
+        query = f"DELETE FROM {table} WHERE user_id = %s ORDER BY {order_column} LIMIT %s"
+
+        def delete(cursor):
+            cursor.execute(query, (user_id, limit))
+            return cursor.rowcount
+
+        began = time.monotonic()
+        success, deleted = self.db.run_transaction(delete)
+        elapsed = time.monotonic() - began
+        if not success:
+            return None
+
+        elapsed_ms = elapsed * 1000
+        if elapsed_ms > PURGE_BATCH_TARGET_MS:
+            self.batch_size = max(PURGE_MIN_BATCH_SIZE, self.batch_size // 2)
+        elif elapsed_ms < PURGE_BATCH_TARGET_MS / 2:
+            self.batch_size = min(PURGE_MAX_BATCH_SIZE, self.batch_size * 2)
+        time.sleep(max(PURGE_MIN_PAUSE_MS / 1000, elapsed * PURGE_PAUSE_RATIO))
+        return deleted
+
+
+
+class TimesheetArchiver:
+    """Move Timesheet months older than the horizon into TimesheetArchive
+
+    Months are archived oldest first in batches of one transaction each; every
+    batch also recomputes the TimesheetMonthlySummary rows of the users it
+    moved, so the archive and its summaries never disagree. Rows written to an
+    already archived month later (backdated entries) stay hot until the next
+    run moves them. Reads federate both tables, see
+    DatabaseOperations.get_user_timesheet and get_worked_minutes_by_user.
+    """
+
+    LOCK_NAME = 'timesheet_archive'
+
+    def __init__(self, db=None, horizon_months=ARCHIVE_HORIZON_MONTHS, batch_size=ARCHIVE_BATCH_SIZE):
+        self.db = db or DatabaseOperations()
+        self.horizon_months = horizon_months
+        self.batch_size = batch_size
+
+    def cutoff(self, today=None):
+        """First day of the oldest month that stays hot"""
+        today = today or datetime.now().date()
+        months = today.year * 12 + today.month - 1 - self.horizon_months
+        return today.replace(year=months // 12, month=months % 12 + 1, day=1)
+
+    def run(self, max_seconds=ARCHIVE_MAX_SECONDS, today=None):
+        """Archive every month before the cutoff until done or out of time
+
+        Returns:
+            dict: months_archived, rows_archived and finished
+        """
+        summary = {'months_archived': 0, 'rows_archived': 0, 'finished': False}
+        lock_conn = acquire_named_lock(self.db, self.LOCK_NAME)
+        if lock_conn is None:
+            return summary
+
+        try:
+            deadline = time.monotonic() + max_seconds
+            cutoff = self.cutoff(today)
+            month_start = self._oldest_hot_month(cutoff)
+            while month_start is not None and month_start < cutoff:
+                next_month = (month_start + timedelta(days=32)).replace(day=1)
+                if not self._ensure_partition(month_start.year):
+                    return summary
+                while True:
+                    if time.monotonic() >= deadline:
+                        return summary
+                    moved = self._move_batch(month_start, next_month)
+                    if moved is None:
+                        return summary
+                    summary['rows_archived'] += moved
+                    if moved < self.batch_size:
+                        break
+                summary['months_archived'] += 1
+                month_start = self._oldest_hot_month(cutoff)
+            summary['finished'] = True
+            return summary
+        finally:
+            release_named_lock(lock_conn, self.LOCK_NAME)
+
+    def _oldest_hot_month(self, cutoff):
+        query = "SELECT MIN(date) as oldest FROM Timesheet WHERE date < %s"
+        success, result = self.db.execute_query(query, (cutoff,))
+        if not success or not result or result[0]['oldest'] is None:
+            return None
+        return result[0]['oldest'].replace(day=1)
+
+    def _ensure_partition(self, year):
+        """Give the year its own partition by splitting the partition that holds it
+
+        Partitions are in ascending bound order, so the one holding the year is
+        the first whose bound is above it: pmax for a new year, or an existing
+        year's partition (which also holds everything before it) for a
+        backdated one. REORGANIZE keeps that partition's rows, moving the
+        year's into the new partition.
+        """
+        name = f"p{year}"
+        success, result = self.db.execute_query(PARTITIONS_QUERY, ('TimesheetArchive',))
+        if not success:
+            return False
+        for row in result or []:
+            bound = None if row['bound'] == 'MAXVALUE' else int(row['bound'])
+            if row['name'] == name or bound == year + 1:
+                return True
+            if bound is None or bound > year + 1:
+                upper = 'MAXVALUE' if bound is None else bound
+                return self.db.execute_query(f"""
+                    ALTER TABLE TimesheetArchive REORGANIZE PARTITION {row['name']} INTO (
+                        PARTITION {name} VALUES LESS THAN ({year + 1}),
+                        PARTITION {row['name']} VALUES LESS THAN ({upper})
+                    )
+                """)[0]
+        print(f"TimesheetArchive has no partition that can hold {year}")
+        return False
+
+    def _move_batch(self, month_start, next_month):
+        """Move up to batch_size rows of one month and refresh their summaries; None on error"""
+        def move(cursor):
+            cursor.execute("""
+                SELECT timesheet_id, user_id FROM Timesheet
+                WHERE date >= %s AND date < %s
+                ORDER BY date, timesheet_id
+                LIMIT %s
+                FOR UPDATE
+            """, (month_start, next_month, self.batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                return 0
+            ids = tuple(row['timesheet_id'] for row in rows)
+            user_ids = tuple(sorted({row['user_id'] for row in rows}))
+            id_list = ', '.join(['%s'] * len(ids))
+
+            # The date bounds let a partitioned Timesheet prune to one partition
+            cursor.execute(f"""
+                INSERT INTO TimesheetArchive ({TIMESHEET_COLUMNS})
+                SELECT {TIMESHEET_COLUMNS} FROM Timesheet
+                WHERE date >= %s AND date < %s AND timesheet_id IN ({id_list})
+            """, (month_start, next_month) + ids)
+            cursor.execute(f"""
+                DELETE FROM Timesheet
+                WHERE date >= %s AND date < %s AND timesheet_id IN ({id_list})
+            """, (month_start, next_month) + ids)
+            refresh_monthly_summaries(cursor, user_ids, month_start)
+            return len(ids)
+
+        success, moved = self.db.run_transaction(move)
+        return moved if success else None
+
+
+class TimesheetPartitioner:
+    """Pre-create Timesheet partitions for the coming periods
+
+    New periods are split off the empty catch-all pmax partition, which is a
+    metadata-only change. Does nothing unless Timesheet is partitioned (see
+    TIMESHEET_PARTITIONING and database_setup.migrate_timesheet_partitioning).
+    """
+
+    def __init__(self, db=None, granularity=TIMESHEET_PARTITIONING):
+        self.db = db or DatabaseOperations()
+        self.granularity = granularity
+
+    def run(self, ahead=TIMESHEET_PARTITIONS_AHEAD, today=None):
+        """Make sure partitions exist through `ahead` periods after the current one
+
+        Returns:
+            list: names of the partitions created (None on error)
+        """
+        success, partitions = self.db.execute_query(PARTITIONS_QUERY, ('Timesheet',))
+        if not success:
+            return None
+        if not self.granularity or not partitions:
+            print("Timesheet is not partitioned.")
+            return []
+
+        # Bounds look like '2025-01-01' (quoted) and pmax's is MAXVALUE
+        bounds = [row['bound'].strip("'") for row in partitions if row['name'] != 'pmax']
+        next_start = datetime.strptime(max(bounds), '%Y-%m-%d').date()
+        current = period_start(today or datetime.now().date(), self.granularity)
+        last = shift_period(current, self.granularity, ahead)
+        definitions = partition_definitions(next_start, last, self.granularity)
+        if not definitions:
+            return []
+
+        query = (
+            "ALTER TABLE Timesheet REORGANIZE PARTITION pmax INTO (\n    "
+            + ",\n    ".join(definitions + ["PARTITION pmax VALUES LESS THAN (MAXVALUE)"])
+            + "\n)"
+        )
+        if not self.db.execute_query(query)[0]:
+            return None
+        return [definition.split()[1] for definition in definitions]
+
+
+class StaleTimesheetCloser:
+    """Close Work rows that were never timed out on a past day
+
+    Such rows count as zero minutes worked, since the balance only counts
+    closed rows, so a forgotten time out makes the whole day owed. Rows are
+    closed in batches of one transaction each with the time out of the
+    policy and flagged needs_review; admins confirm or correct them from the
+    dashboard (DatabaseOperations.review_timesheet). Afterwards the balance
+    checkpoints of the affected users are invalidated from their earliest
+    closed day and their data versions bumped, so cached pages, calendars
+    and ETags pick up the change, and a time_out event is published for
+    each closed day so open dashboards see it.
+    """
+
+    LOCK_NAME = 'stale_timesheet_close'
+
+    def __init__(self, db=None, policy=STALE_TIMESHEET_POLICY, batch_size=STALE_TIMESHEET_BATCH_SIZE):
+        if policy not in STALE_TIMESHEET_CLOSE_TIMES:
+            raise ValueError(f"Unknown stale timesheet policy: {policy}")
+        self.db = db or DatabaseOperations()
+        self.policy = policy
+        self.batch_size = batch_size
+
+    def run(self, max_seconds=STALE_TIMESHEET_MAX_SECONDS, today=None):
+        """Close every open row dated before today until done or out of time
+
+        Returns:
+            dict: rows_closed, users_affected and finished
+        """
+        summary = {'rows_closed': 0, 'users_affected': 0, 'finished': False}
+        lock_conn = acquire_named_lock(self.db, self.LOCK_NAME)
+        if lock_conn is None:
+            return summary
+
+        today = today or datetime.now().date()
+        earliest = {}
+        closed_days = set()
+        try:
+            deadline = time.monotonic() + max_seconds
+            while True:
+                if time.monotonic() >= deadline:
+                    return summary
+                rows = self._close_batch(today)
+                if rows is None:
+                    return summary
+                summary['rows_closed'] += len(rows)
+                for row in rows:
+                    closed_days.add((row['user_id'], row['date']))
+                    if row['user_id'] not in earliest or row['date'] < earliest[row['user_id']]:
+                        earliest[row['user_id']] = row['date']
+                if len(rows) < self.batch_size:
+                    break
+            summary['finished'] = True
+            return summary
+        finally:
+            release_named_lock(lock_conn, self.LOCK_NAME)
+            # Whatever was committed, even by an interrupted run, must reach the caches
+            if earliest:
+                self.db.bump_data_version(user_ids=earliest)
+            for user_id, from_date in earliest.items():
+                self.db.invalidate_balance_checkpoints(user_id, from_date)
+            for user_id, day in sorted(closed_days):
+                self.db.publish_attendance('time_out', user_id, day)
+            summary['users_affected'] = len(earliest)
+
+    def _close_params(self):
+        if self.policy == 'shift_end':
+            saturday = self.db._working_hours_for_day_type('Saturday')
+            weekday = self.db._working_hours_for_day_type('Weekday')
+            return (
+                saturday['end_time'] if saturday else None,
+                weekday['end_time'] if weekday else None,
+            )
+        if self.policy == 'hours':
+            return (int(STALE_TIMESHEET_HOURS * 60),)
+        return ()
+
+    def _close_batch(self, today):
+        """Close up to batch_size open rows; the rows closed, None on error"""
+        close_time = STALE_TIMESHEET_CLOSE_TIMES[self.policy]
+        close_params = self._close_params()
+
+        def close(cursor):
+            cursor.execute(STALE_TIMESHEET_QUERY, (today, self.batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                return []
+            ids = tuple(row['timesheet_id'] for row in rows)
+            id_list = ', '.join(['%s'] * len(ids))
+            cursor.execute(f"""
+                UPDATE Timesheet
+                SET time_out = {close_time}, needs_review = 1
+                WHERE date < %s AND timesheet_id IN ({id_list}) AND time_out IS NULL
+            """, close_params + (today,) + ids)
+            return rows
+
+        success, rows = self.db.run_transaction(close)
+        return rows if success else None
+
+
+def prune_punch_sync(db=None, retention_days=PUNCH_SYNC_RETENTION_DAYS):
+    """Delete PunchSync keys older than the retention in PURGE_BATCH_SIZE batches
+
+    Returns:
+        int: rows deleted, None on a database error
+    """
+    db = db or DatabaseOperations()
+    cutoff = datetime.now() - timedelta(days=retention_days)
+    query = "DELETE FROM PunchSync WHERE created_at < %s ORDER BY created_at LIMIT %s"
+
+    def delete(cursor):
+        cursor.execute(query, (cutoff, PURGE_BATCH_SIZE))
+        return cursor.rowcount
+
+    total = 0
+    while True:
+        success, deleted = db.run_transaction(delete)
+        if not success:
+            return None
+        total += deleted
+        if deleted < PURGE_BATCH_SIZE:
+            return total
+        time.sleep(PURGE_MIN_PAUSE_MS / 1000)
+
+
+def start_staff_purge(db=None):
+    """Run a StaffPurger in a daemon thread unless one is already running here
+
+    Returns:
+        bool: True if a purge thread was started
+    """
+    if not _background_lock.acquire(blocking=False):
+        return False
+
+    def purge():
+        try:
+            StaffPurger(db).run()
+        except Exception as e:
+            print(f"Staff purge error: {e}")
+        finally:
+            _background_lock.release()
+
+    threading.Thread(target=purge, name='staff-purge', daemon=True).start()
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Database maintenance jobs")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    purge_parser = subparsers.add_parser('purge-staff', help='remove the history of soft-deleted staff')
+    purge_parser.add_argument('--max-seconds', type=float, default=PURGE_MAX_SECONDS)
+
+    archive_parser = subparsers.add_parser('archive-timesheets', help='move old timesheet months to the archive')
+    archive_parser.add_argument('--max-seconds', type=float, default=ARCHIVE_MAX_SECONDS)
+    partition_parser = subparsers.add_parser('partition-timesheets', help='pre-create future Timesheet partitions')
+    partition_parser.add_argument('--ahead', type=int, default=TIMESHEET_PARTITIONS_AHEAD,
+                                  help='periods to create after the current one')
+    prune_parser = subparsers.add_parser('prune-punch-sync', help='drop expired offline sync idempotency keys')
+    prune_parser.add_argument('--retention-days', type=int, default=PUNCH_SYNC_RETENTION_DAYS)
+    close_parser = subparsers.add_parser('close-stale-timesheets', help='time out rows left open on past days')
+    close_parser.add_argument('--policy', choices=sorted(STALE_TIMESHEET_CLOSE_TIMES), default=STALE_TIMESHEET_POLICY)
+    close_parser.add_argument('--max-seconds', type=float, default=STALE_TIMESHEET_MAX_SECONDS)
+    args = parser.parse_args()
+
+    if args.command == 'purge-staff':
+        result = StaffPurger().run(args.max_seconds)
+        print(f"Purged {result['users_purged']} users, {result['rows_deleted']} rows"
+              f"{'' if result['finished'] else ' (incomplete, run again to resume)'}")
+    elif args.command == 'archive-timesheets':
+        result = TimesheetArchiver().run(args.max_seconds)
+        print(f"Archived {result['months_archived']} months, {result['rows_archived']} rows"
+              f"{'' if result['finished'] else ' (incomplete, run again to resume)'}")
+    elif args.command == 'partition-timesheets':
+        created = TimesheetPartitioner().run(args.ahead)
+        if created is None:
+            print("Failed to create partitions.")
+        else:
+            print(f"Created {len(created)} partitions{': ' + ', '.join(created) if created else ''}")
+    elif args.command == 'prune-punch-sync':
+        deleted = prune_punch_sync(retention_days=args.retention_days)
+        print("Failed to prune sync keys." if deleted is None else f"Deleted {deleted} sync keys")
+    elif args.command == 'close-stale-timesheets':
+        result = StaleTimesheetCloser(policy=args.policy).run(args.max_seconds)
+        print(f"Closed {result['rows_closed']} timesheets of {result['users_affected']} users"
+              f"{'' if result['finished'] else ' (incomplete, run again to resume)'}")
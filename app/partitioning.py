@@ -0,0 +1,70 @@
+import os
+from datetime import date
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Range partitioning of Timesheet on RANGE COLUMNS(date): 'month', 'year' or
+# empty to keep a single table. Partitioned tables cannot have foreign keys and
+# their primary key must contain the date, so enabling it changes both.
+TIMESHEET_PARTITIONING = os.getenv("TIMESHEET_PARTITIONING", "").strip().lower()
+# Periods that get their own partition before the current one (older rows share
+# the first partition) and periods created ahead of the current one
+TIMESHEET_PARTITION_HISTORY = int(os.getenv("TIMESHEET_PARTITION_HISTORY", "24"))
+TIMESHEET_PARTITIONS_AHEAD = int(os.getenv("TIMESHEET_PARTITIONS_AHEAD", "3"))
+
+GRANULARITIES = ('month', 'year')
+
+# Named partitions of a table in ascending order
+PARTITIONS_QUERY = """
+    SELECT PARTITION_NAME as name, PARTITION_DESCRIPTION as bound
+    FROM information_schema.PARTITIONS
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    AND PARTITION_NAME IS NOT NULL
+    ORDER BY PARTITION_ORDINAL_POSITION
+"""
+
+def period_start(day, granularity):
+    """First day of the month or year containing day"""
+    if granularity == 'year':
+        return date(day.year, 1, 1)
+    return date(day.year, day.month, 1)
+
+def shift_period(start, granularity, periods=1):
+    """Start of the period that is `periods` periods after start (negative for before)"""
+    if granularity == 'year':
+        return date(start.year + periods, 1, 1)
+    months = start.year * 12 + start.month - 1 + periods
+    return date(months // 12, months % 12 + 1, 1)
+
+def partition_name(start, granularity):
+    return f"p{start:%Y}" if granularity == 'year' else f"p{start:%Y%m}"
+
+def partition_definitions(first, last, granularity):
+    """PARTITION clauses for every period from first through last"""
+    definitions = []
+    start = first
+    while start <= last:
+        end = shift_period(start, granularity)
+        definitions.append(f"PARTITION {partition_name(start, granularity)} VALUES LESS THAN ('{end.isoformat()}')")
+        start = end
+    return definitions
+
+def timesheet_partition_clause(granularity, today=None,
+                               history=TIMESHEET_PARTITION_HISTORY, ahead=TIMESHEET_PARTITIONS_AHEAD):
+    """PARTITION BY clause for Timesheet around today
+
+    Rows older than the history go to pold, rows past the pre-created periods
+    to pmax until TimesheetPartitioner splits new periods off it.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown partition granularity: {granularity}")
+    current = period_start(today or date.today(), granularity)
+    first = shift_period(current, granularity, -history)
+    last = shift_period(current, granularity, ahead)
+    definitions = (
+        [f"PARTITION pold VALUES LESS THAN ('{first.isoformat()}')"]
+        + partition_definitions(first, last, granularity)
+        + ["PARTITION pmax VALUES LESS THAN (MAXVALUE)"]
+    )
+    return "PARTITION BY RANGE COLUMNS(date) (\n    " + ",\n    ".join(definitions) + "\n)"
@@ -0,0 +1,200 @@
+import fcntl
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Shared file holding the reference data (working hours, staff roster) for all
+# worker processes on a host; 0 bytes disables it and every read hits MySQL.
+# Data older than the TTL is reloaded even without an invalidation.
+REFERENCE_CACHE_PATH = os.getenv("REFERENCE_CACHE_PATH") or os.path.join(
+    '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(),
+    f"timesheet-reference-{os.getenv('MYSQL_DATABASE', 'default')}.cache"
+)
+REFERENCE_CACHE_BYTES = int(os.getenv("REFERENCE_CACHE_BYTES", str(8 * 1024 * 1024)))
+REFERENCE_CACHE_TTL = float(os.getenv("REFERENCE_CACHE_TTL", "300"))
+
+# seq, version, loaded_at, epoch, length; the payload starts at HEADER_SIZE
+HEADER = struct.Struct('<QQdQI')
+HEADER_SIZE = 64
+LOADED_AT_OFFSET = 16
+EPOCH_OFFSET = 24
+
+
+class SharedReferenceCache:
+    """Read-mostly data shared by all worker processes through an mmap'd file
+
+    The file holds one pickled payload behind a seqlock header. A writer makes
+    the sequence odd, writes the payload, bumps the version and makes the
+    sequence even again; a reader that sees the same even sequence before and
+    after copying the payload has a consistent snapshot. Each process keeps
+    the last payload it unpickled together with its version, so a request
+    only reads the header unless the data changed.
+
+    Only the process holding the file's flock reloads from the database;
+    others keep serving the previous version meanwhile. invalidate() bumps an
+    epoch, and a load that raced with an invalidation is stored as already
+    stale so the next read reloads again.
+
+    Data too big for the file is kept per process instead, with the epoch and
+    time it was loaded at, and reused until an invalidation or the TTL.
+    """
+
+    def __init__(self, path=REFERENCE_CACHE_PATH, size=REFERENCE_CACHE_BYTES, ttl=REFERENCE_CACHE_TTL):
+        self.path = path
+        self.size = size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._pid = None
+        self._fd = None
+        self._map = None
+        self._version = None
+        self._data = None
+        # (epoch, loaded_at) of a copy too big to share, else None
+        self._local = None
+        self._warned = False
+
+    def _mapping(self):
+        """The file mapping of this process, (re)opened after a fork
+
+        Forked workers re-open the file so each holds its own flock.
+        """
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+                    if os.fstat(fd).st_size < self.size:
+                        os.ftruncate(fd, self.size)
+                    self._map = mmap.mmap(fd, self.size)
+                    self._fd = fd
+                    self._version = None
+                    self._data = None
+                    self._local = None
+                    self._pid = pid
+        return self._map
+
+    def get(self, loader):
+        """Current reference data, reloading it with loader() when stale
+
+        Args:
+            loader: callable returning the data to share, or None on failure
+
+        Returns:
+            The shared data, or None if it was never loaded and loading failed
+        """
+        if self.size <= 0:
+            return loader()
+        try:
+            mapping = self._mapping()
+        except OSError as e:
+            print(f"Reference cache unavailable: {e}")
+            return loader()
+
+        if self._local is not None:
+            return self._get_local(mapping, loader)
+
+        header = self._read(mapping)
+        if header is not None:
+            _, version, loaded_at, _, _ = header
+            if version and loaded_at and time.time() - loaded_at < self.ttl:
+                return self._data
+
+        # Stale, invalidated or empty: one process reloads, the rest keep the old copy
+        blocking = self._data is None
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            return self._data
+        try:
+            header = self._read(mapping)
+            if header is not None and header[1] and header[2] and time.time() - header[2] < self.ttl:
+                return self._data
+            epoch = HEADER.unpack_from(mapping, 0)[3]
+            data = loader()
+            if data is None:
+                return self._data
+            self._write(mapping, data, epoch)
+            return self._data if self._data is not None else data
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _get_local(self, mapping, loader):
+        """The per-process copy of oversized data, reloaded once invalidated or expired"""
+        epoch, loaded_at = self._local
+        current_epoch = HEADER.unpack_from(mapping, 0)[3]
+        if current_epoch == epoch and time.time() - loaded_at < self.ttl:
+            return self._data
+        data = loader()
+        if data is None:
+            return self._data
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            # Shared again if it shrank, else kept here under the new epoch
+            self._write(mapping, data, current_epoch)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return data
+
+    def invalidate(self):
+        """Make every process reload on its next read"""
+        if self.size <= 0:
+            return
+        try:
+            mapping = self._mapping()
+        except OSError:
+            return
+        epoch = HEADER.unpack_from(mapping, 0)[3]
+        struct.pack_into('<Q', mapping, EPOCH_OFFSET, epoch + 1)
+        struct.pack_into('<d', mapping, LOADED_AT_OFFSET, 0.0)
+
+    def _read(self, mapping):
+        """Refresh the local copy from the mapping if its version changed
+
+        Returns:
+            The header tuple, or None if no consistent snapshot could be read
+        """
+        for _ in range(100):
+            header = HEADER.unpack_from(mapping, 0)
+            seq, version, _, _, length = header
+            if seq % 2:
+                time.sleep(0)
+                continue
+            if version == self._version or version == 0:
+                return header
+            payload = mapping[HEADER_SIZE:HEADER_SIZE + length]
+            if HEADER.unpack_from(mapping, 0)[0] != seq:
+                continue
+            self._data = pickle.loads(payload)
+            self._version = version
+            return header
+        return None
+
+    def _write(self, mapping, data, epoch):
+        payload = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(payload) > self.size - HEADER_SIZE:
+            if not self._warned:
+                print(f"Reference data ({len(payload)} bytes) exceeds REFERENCE_CACHE_BYTES, "
+                      f"caching it per process instead")
+                self._warned = True
+            self._data = data
+            self._version = None
+            self._local = (epoch, time.time())
+            return
+        seq, version, _, _, _ = HEADER.unpack_from(mapping, 0)
+        struct.pack_into('<Q', mapping, 0, seq + 1)
+        mapping[HEADER_SIZE:HEADER_SIZE + len(payload)] = payload
+        current_epoch = HEADER.unpack_from(mapping, 0)[3]
+        # An invalidation during the load leaves the new copy stale
+        loaded_at = time.time() if current_epoch == epoch else 0.0
+        HEADER.pack_into(mapping, 0, seq + 1, version + 1, loaded_at, current_epoch, len(payload))
+        struct.pack_into('<Q', mapping, 0, seq + 2)
+        self._data = data
+        self._version = version + 1
+        self._local = None
@@ -0,0 +1,360 @@
+import argparse
+import json
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from .db import DatabaseOperations
+from .balance import BalanceCalculator
+from .maintenance import (
+    StaffPurger,
+    StaleTimesheetCloser,
+    TimesheetArchiver,
+    TimesheetPartitioner,
+    acquire_named_lock,
+    release_named_lock,
+    prune_punch_sync,
+)
+
+load_dotenv()
+
+# Run the scheduler inside every app worker; the MySQL lock and the JobRun slot
+# key make each run happen once across workers and replicas. Set to false to
+# run `python -m app.scheduler` as a separate process instead.
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() == "true"
+# Seconds between checks for due jobs, and how long JobRun rows are kept
+SCHEDULER_TICK_SECONDS = float(os.getenv("SCHEDULER_TICK_SECONDS", "30"))
+SCHEDULER_HISTORY_DAYS = int(os.getenv("SCHEDULER_HISTORY_DAYS", "90"))
+
+# Cron expressions (minute hour day-of-month month day-of-week, local time)
+SCHEDULE_CLOSE_STALE_TIMESHEETS = os.getenv("SCHEDULE_CLOSE_STALE_TIMESHEETS", "15 0 * * *")
+SCHEDULE_REFRESH_BALANCES = os.getenv("SCHEDULE_REFRESH_BALANCES", "0 1 * * *")
+SCHEDULE_ARCHIVE_TIMESHEETS = os.getenv("SCHEDULE_ARCHIVE_TIMESHEETS", "30 2 * * *")
+SCHEDULE_PARTITION_TIMESHEETS = os.getenv("SCHEDULE_PARTITION_TIMESHEETS", "0 3 * * *")
+SCHEDULE_PRUNE_PUNCH_SYNC = os.getenv("SCHEDULE_PRUNE_PUNCH_SYNC", "45 3 * * *")
+SCHEDULE_PURGE_STAFF = os.getenv("SCHEDULE_PURGE_STAFF", "*/30 * * * *")
+SCHEDULE_PRUNE_JOB_HISTORY = os.getenv("SCHEDULE_PRUNE_JOB_HISTORY", "0 4 * * *")
+
+JOB_HISTORY_QUERY = """
+    SELECT run_id, job_name, scheduled_for, runner, status, started_at, finished_at, duration_ms, result
+    FROM JobRun
+    ORDER BY started_at DESC
+    LIMIT %s
+"""
+
+CRON_FIELDS = [
+    ('minute', 0, 59),
+    ('hour', 0, 23),
+    ('day', 1, 31),
+    ('month', 1, 12),
+    ('weekday', 0, 6),
+]
+
+
+class CronSchedule:
+    """A five-field cron expression: numbers, '*', ranges, lists and /steps
+
+    Day of week runs from 0 (Sunday) to 6; 7 is accepted for Sunday too. As in
+    cron, when both day of month and day of week are restricted a day matching
+    either one matches.
+    """
+
+    def __init__(self, expression):
+        parts = expression.split()
+        if len(parts) != len(CRON_FIELDS):
+            raise ValueError(f"Cron expression needs {len(CRON_FIELDS)} fields: {expression!r}")
+        self.expression = expression
+        self.fields = {}
+        for text, (name, low, high) in zip(parts, CRON_FIELDS):
+            self.fields[name] = self._parse(text, low, 7 if name == 'weekday' else high)
+        if 7 in self.fields['weekday']:
+            self.fields['weekday'] = (self.fields['weekday'] - {7}) | {0}
+        self.any_day = parts[2] == '*'
+        self.any_weekday = parts[4] == '*'
+
+    @staticmethod
+    def _parse(text, low, high):
+        values = set()
+        for item in text.split(','):
+            spec, _, step = item.partition('/')
+            step = int(step) if step else 1
+            if spec == '*':
+                first, last = low, high
+            elif '-' in spec:
+                first, last = (int(bound) for bound in spec.split('-', 1))
+            else:
+                first = int(spec)
+                last = high if step > 1 else first
+            if step < 1 or first < low or last > high or first > last:
+                raise ValueError(f"Invalid cron field {text!r}")
+            values.update(range(first, last + 1, step))
+        return values
+
+    def _day_matches(self, moment):
+        in_month = moment.day in self.fields['day']
+        # datetime.weekday() is 0 for Monday, cron's is 0 for Sunday
+        in_week = (moment.weekday() + 1) % 7 in self.fields['weekday']
+        if self.any_day or self.any_weekday:
+            return in_month and in_week
+        return in_month or in_week
+
+    def next_after(self, moment):
+        """First matching minute strictly after moment"""
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        # Four years covers every combination, including February 29
+        limit = candidate + timedelta(days=4 * 366)
+        while candidate <= limit:
+            if candidate.month not in self.fields['month']:
+                candidate = (candidate.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+            elif candidate.hour not in self.fields['hour']:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+            elif candidate.minute not in self.fields['minute']:
+                candidate += timedelta(minutes=1)
+            else:
+                return candidate
+        raise ValueError(f"Cron expression never matches: {self.expression!r}")
+
+
+class Job:
+    """A named task and its schedule; run(db) returns a JSON-serializable summary"""
+
+    def __init__(self, name, schedule, run):
+        self.name = name
+        self.schedule = CronSchedule(schedule)
+        self.run = run
+
+
+class Scheduler:
+    """Run maintenance jobs on cron schedules off the request path
+
+    Every process running a scheduler checks for due jobs each tick. A due
+    run is claimed by inserting its (job, scheduled time) slot into JobRun,
+    which only one process can do, and executed while holding a MySQL named
+    lock for the job, so a slow run is never overlapped by the next one.
+    Missed slots (the app was down) are not caught up; the next slot runs.
+    Jobs run one after another in the scheduler thread and are expected to
+    bound their own running time.
+
+    JobRun keeps each run's status, duration and result; metrics() has
+    per-process counters of the runs executed here.
+    """
+
+    def __init__(self, db=None, jobs=None, tick=SCHEDULER_TICK_SECONDS):
+        self.db = db or DatabaseOperations()
+        self.jobs = {job.name: job for job in (jobs if jobs is not None else default_jobs())}
+        self.tick = tick
+        self.runner = f"{socket.gethostname()}:{os.getpid()}"
+        self._next_runs = {}
+        self._metrics = {}
+        self._metrics_lock = threading.Lock()
+        self._pid = None
+
+    def start(self):
+        """Start the scheduler thread in this process; safe to call again after a fork"""
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self.runner = f"{socket.gethostname()}:{self._pid}"
+        self._next_runs = {}
+        threading.Thread(target=self._loop, name='scheduler', daemon=True).start()
+
+    def run_pending(self, now=None):
+        """Run every job whose next slot is due, then plan its following slot"""
+        now = now or datetime.now()
+        for job in self.jobs.values():
+            slot = self._next_runs.get(job.name)
+            if slot is None:
+                # Start from the next slot rather than one in the past
+                self._next_runs[job.name] = job.schedule.next_after(now)
+                continue
+            if slot <= now:
+                self._next_runs[job.name] = job.schedule.next_after(now)
+                self.run_job(job.name, slot)
+
+    def run_job(self, name, slot=None):
+        """Claim and run one slot of a job
+
+        Args:
+            name: job name
+            slot: datetime of the scheduled run, None for an ad hoc run now
+
+        Returns:
+            dict: the job's summary, None if it was not run here or failed
+        """
+        job = self.jobs[name]
+        slot = (slot or datetime.now()).replace(second=0, microsecond=0)
+        lock_name = f"scheduler:{name}"
+        lock_conn = acquire_named_lock(self.db, lock_name)
+        if lock_conn is None:
+            return None
+        try:
+            run_id = self._claim(name, slot)
+            if run_id is None:
+                return None
+            began = time.monotonic()
+            try:
+                result, status = job.run(self.db), 'Succeeded'
+            except Exception as e:
+                print(f"Scheduled job {name} failed: {e}")
+                result, status = {'error': str(e)}, 'Failed'
+            duration_ms = int((time.monotonic() - began) * 1000)
+            self._finish(run_id, status, duration_ms, result)
+            self._record(name, status, duration_ms)
+            return result if status == 'Succeeded' else None
+        finally:
+            release_named_lock(lock_conn, lock_name)
+
+    def _claim(self, name, slot):
+        """Insert the run's JobRun row; its id, None if another process has the slot"""
+        query = """
+            INSERT IGNORE INTO JobRun (job_name, scheduled_for, runner, status, started_at)
+            VALUES (%s, %s, %s, 'Running', NOW(3))
+        """
+
+        def claim(cursor):
+            cursor.execute(query, (name, slot, self.runner))
+            return cursor.lastrowid if cursor.rowcount else None
+
+        success, run_id = self.db.run_transaction(claim)
+        return run_id if success else None
+
+    def _finish(self, run_id, status, duration_ms, result):
+        query = """
+            UPDATE JobRun
+            SET status = %s, finished_at = NOW(3), duration_ms = %s, result = %s
+            WHERE run_id = %s
+        """
+        payload = json.dumps(result, default=str)
+        if not self.db.execute_query(query, (status, duration_ms, payload, run_id))[0]:
+            print(f"Failed to record run {run_id}")
+
+    def _record(self, name, status, duration_ms):
+        with self._metrics_lock:
+            stats = self._metrics.setdefault(name, {
+                'runs': 0, 'failures': 0, 'total_ms': 0, 'max_ms': 0, 'last_ms': None, 'last_status': None
+            })
+            stats['runs'] += 1
+            stats['failures'] += status == 'Failed'
+            stats['total_ms'] += duration_ms
+            stats['max_ms'] = max(stats['max_ms'], duration_ms)
+            stats['last_ms'] = duration_ms
+            stats['last_status'] = status
+
+    def metrics(self):
+        """Per-job run counts and timings in this process, with each job's next slot"""
+        with self._metrics_lock:
+            stats = {name: dict(values) for name, values in self._metrics.items()}
+        result = {}
+        for name, job in self.jobs.items():
+            entry = stats.get(name, {'runs': 0, 'failures': 0, 'total_ms': 0, 'max_ms': 0,
+                                     'last_ms': None, 'last_status': None})
+            entry['avg_ms'] = entry['total_ms'] // entry['runs'] if entry['runs'] else None
+            entry['schedule'] = job.schedule.expression
+            next_run = self._next_runs.get(name)
+            entry['next_run'] = next_run.strftime('%Y-%m-%d %H:%M') if next_run else None
+            result[name] = entry
+        return result
+
+    def _loop(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            try:
+                self.run_pending()
+            except Exception as e:
+                print(f"Scheduler error: {e}")
+            time.sleep(self.tick)
+
+
+def get_job_history(db, limit=50):
+    """Latest JobRun rows across all processes, newest first"""
+    success, result = db.execute_query(JOB_HISTORY_QUERY, (limit,), read_only=True)
+    return result if success else []
+
+
+def prune_job_history(db, retention_days=SCHEDULER_HISTORY_DAYS):
+    """Delete JobRun rows older than the retention
+
+    Returns:
+        int: rows deleted, None on a database error
+    """
+    cutoff = datetime.now() - timedelta(days=retention_days)
+
+    def delete(cursor):
+        cursor.execute("DELETE FROM JobRun WHERE started_at < %s", (cutoff,))
+        return cursor.rowcount
+
+    success, deleted = db.run_transaction(delete)
+    return deleted if success else None
+
+
+def refresh_balances(db):
+    """Extend the balance checkpoints of all staff through the last closed month"""
+    return {'staff': len(BalanceCalculator(db).get_all_staff_time_owed())}
+
+
+def partition_timesheets(db):
+    created = TimesheetPartitioner(db).run()
+    if created is None:
+        raise RuntimeError("failed to create partitions")
+    return {'created': created}
+
+
+def default_jobs():
+    """The maintenance jobs every deployment runs"""
+    return [
+        Job('close-stale-timesheets', SCHEDULE_CLOSE_STALE_TIMESHEETS, lambda db: StaleTimesheetCloser(db).run()),
+        Job('refresh-balances', SCHEDULE_REFRESH_BALANCES, refresh_balances),
+        Job('archive-timesheets', SCHEDULE_ARCHIVE_TIMESHEETS, lambda db: TimesheetArchiver(db).run()),
+        Job('partition-timesheets', SCHEDULE_PARTITION_TIMESHEETS, partition_timesheets),
+        Job('prune-punch-sync', SCHEDULE_PRUNE_PUNCH_SYNC, lambda db: {'deleted': prune_punch_sync(db)}),
+        Job('purge-staff', SCHEDULE_PURGE_STAFF, lambda db: StaffPurger(db).run()),
+        Job('prune-job-history', SCHEDULE_PRUNE_JOB_HISTORY, lambda db: {'deleted': prune_job_history(db)}),
+    ]
+
+
+def start_scheduler(db):
+    """Start a scheduler thread in this process unless SCHEDULER_ENABLED is off
+
+    Returns:
+        Scheduler, or None when disabled
+    """
+    if not SCHEDULER_ENABLED:
+        return None
+    scheduler = Scheduler(db)
+    scheduler.start()
+    return scheduler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run scheduled maintenance jobs")
+    parser.add_argument('--run', metavar='JOB', help='run one job now and exit')
+    parser.add_argument('--list', action='store_true', help='list the jobs and their next run')
+    parser.add_argument('--history', type=int, metavar='N', help='show the last N runs and exit')
+    args = parser.parse_args()
+
+    scheduler = Scheduler()
+    if args.list:
+        now = datetime.now()
+        for job in scheduler.jobs.values():
+            print(f"{job.name:24} {job.schedule.expression:16} next {job.schedule.next_after(now):%Y-%m-%d %H:%M}")
+    elif args.history:
+        for row in get_job_history(scheduler.db, args.history):
+            print(f"{row['started_at']:%Y-%m-%d %H:%M:%S} {row['job_name']:24} {row['status']:10} "
+                  f"{row['duration_ms'] if row['duration_ms'] is not None else '-':>8} ms  {row['runner']}")
+    elif args.run:
+        if args.run not in scheduler.jobs:
+            parser.error(f"unknown job {args.run}, expected one of {', '.join(scheduler.jobs)}")
+        result = scheduler.run_job(args.run)
+        print("Job not run (already running or failed)." if result is None else json.dumps(result, default=str))
+    else:
+        # Foreground companion process, for deployments with SCHEDULER_ENABLED=false
+        while True:
+            try:
+                scheduler.run_pending()
+            except Exception as e:
+                print(f"Scheduler error: {e}")
+            time.sleep(scheduler.tick)
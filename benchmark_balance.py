@@ -0,0 +1,108 @@
+"""Benchmark the vectorized balance kernel against the day-by-day loop
+
+Generates synthetic staff, timesheets and approved leaves in memory (no database
+needed) and times app.balance.compute_balances against a pure Python walk that
+follows the same rules as DatabaseOperations.get_all_staff_time_owed.
+
+Usage: python benchmark_balance.py [--max-reference-days N]
+"""
+import argparse
+import time
+from datetime import date
+import numpy as np
+from app.balance import compute_balances
+
+STAFF_COUNTS = [10, 100, 1000, 10000]
+YEARS = [1, 5, 10]
+DAY_MINUTES = {'Weekday': 510, 'Saturday': 240}
+
+
+def generate_data(staff_count, years, rng):
+    """Generate staff ranges, approved leaves and closed timesheet rows as arrays"""
+    end = date(2025, 5, 31).toordinal()
+    first = end - 365 * years
+    starts = first + rng.integers(0, 31, staff_count)
+    ends = np.full(staff_count, end)
+
+    leave_users = np.repeat(np.arange(staff_count), years * 3)
+    leave_starts = starts[leave_users] + rng.integers(0, 365 * years - 10, len(leave_users))
+    leave_ends = leave_starts + rng.integers(0, 5, len(leave_users))
+
+    # One row per staff-day on Mon-Sat with 5% absences
+    days = np.arange(first, end + 1)
+    ts_users = np.repeat(np.arange(staff_count), len(days))
+    ts_days = np.tile(days, staff_count)
+    keep = (ts_days >= starts[ts_users]) & ((ts_days - 1) % 7 < 6) & (rng.random(len(ts_days)) < 0.95)
+    ts_users, ts_days = ts_users[keep], ts_days[keep]
+    shift = np.where((ts_days - 1) % 7 == 5, 240, 480)
+    ts_minutes = shift + rng.integers(-20, 60, len(ts_days))
+    ts_paid = np.zeros(len(ts_days), dtype=bool)
+
+    return starts, ends, (leave_users, leave_starts, leave_ends), (ts_users, ts_days, ts_minutes, ts_paid)
+
+
+def reference_balances(starts, ends, leaves, rows):
+    """Day-by-day balance walk equivalent to the original implementation"""
+    leave_days = {}
+    for user, leave_start, leave_end in zip(*(column.tolist() for column in leaves)):
+        for day in range(leave_start, leave_end + 1):
+            if date.fromordinal(day).isoweekday() <= 6:
+                leave_days.setdefault(user, set()).add(day)
+
+    entries = {}
+    for user, day, minutes, paid in zip(*(column.tolist() for column in rows)):
+        entries.setdefault((user, day), (minutes, paid))
+
+    result = []
+    for user, (start, end) in enumerate(zip(starts.tolist(), ends.tolist())):
+        total = 0
+        for day in range(start, end + 1):
+            weekday = date.fromordinal(day).isoweekday()
+            if weekday == 7:
+                continue
+            expected = DAY_MINUTES['Saturday' if weekday == 6 else 'Weekday']
+            if day in leave_days.get(user, ()):
+                actual = expected
+            elif (user, day) in entries:
+                minutes, paid = entries[(user, day)]
+                actual = expected if paid else minutes
+            else:
+                actual = 0
+            total += expected - actual
+        result.append(total)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--max-reference-days', type=int, default=2_000_000,
+                        help='skip the pure Python loop above this many staff-days')
+    args = parser.parse_args()
+    rng = np.random.default_rng(2025)
+
+    print(f"{'staff':>6} {'years':>5} {'rows':>10} {'loop (s)':>10} {'vectorized (s)':>15} {'speedup':>8}", flush=True)
+    for staff_count in STAFF_COUNTS:
+        for years in YEARS:
+            starts, ends, leaves, rows = generate_data(staff_count, years, rng)
+
+            began = time.perf_counter()
+            vectorized = compute_balances(starts, ends, DAY_MINUTES, *leaves, *rows)
+            vectorized_seconds = time.perf_counter() - began
+
+            staff_days = int((ends - starts + 1).sum())
+            if staff_days <= args.max_reference_days:
+                began = time.perf_counter()
+                reference = reference_balances(starts, ends, leaves, rows)
+                loop_seconds = time.perf_counter() - began
+                assert vectorized.tolist() == reference, "vectorized balances differ from the day-by-day loop"
+                loop_text = f"{loop_seconds:10.3f}"
+                speedup = f"{loop_seconds / vectorized_seconds:7.1f}x"
+            else:
+                loop_text = f"{'skipped':>10}"
+                speedup = f"{'-':>8}"
+
+            print(f"{staff_count:>6} {years:>5} {len(rows[0]):>10} {loop_text} {vectorized_seconds:15.3f} {speedup}", flush=True)
+
+
+if __name__ == '__main__':
+    main()
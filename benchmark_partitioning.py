@@ -0,0 +1,166 @@
+"""Benchmark the today-attendance and report queries on a flat vs a partitioned Timesheet
+
+Builds two scratch copies of the Timesheet layout in the configured database,
+one single table and one range partitioned by date (as with
+TIMESHEET_PARTITIONING), fills both with the same synthetic rows, and times
+the queries the dashboard and report run against each. The EXPLAIN partitions
+column shows which partitions every query touches. The scratch tables are
+dropped afterwards unless --keep is given.
+
+Usage: python benchmark_partitioning.py [--staff N] [--years N] [--granularity month|year]
+"""
+import argparse
+import random
+import statistics
+import time
+from datetime import date, datetime, timedelta
+from app.db import DatabaseConnection
+from app.partitioning import timesheet_partition_clause
+
+FLAT_TABLE = 'BenchTimesheetFlat'
+PARTITIONED_TABLE = 'BenchTimesheetPartitioned'
+INSERT_BATCH_SIZE = 5000
+
+TABLE_DEFINITION = """
+CREATE TABLE {table} (
+    timesheet_id INT AUTO_INCREMENT,
+    user_id INT NOT NULL,
+    time_in TIMESTAMP NULL,
+    time_out TIMESTAMP NULL,
+    worked_minutes INT NULL,
+    date DATE NOT NULL,
+    entry_type ENUM('Work', 'Leave', 'Holiday', 'Adjustment') NOT NULL DEFAULT 'Work',
+    INDEX idx_user_date (user_id, date),
+    INDEX idx_date (date),
+    PRIMARY KEY (timesheet_id, date)
+) {partitions}
+"""
+
+
+def previous_month(today):
+    """(first day, last day) of the month before today's"""
+    last = today.replace(day=1) - timedelta(days=1)
+    return last.replace(day=1), last
+
+
+QUERIES = {
+    'today attendance': (
+        "SELECT * FROM {table} WHERE date = %s ORDER BY time_in DESC",
+        lambda today: (today,)
+    ),
+    'present today count': (
+        "SELECT COUNT(DISTINCT user_id) as count FROM {table} WHERE date = %s",
+        lambda today: (today,)
+    ),
+    'monthly report': (
+        """
+        SELECT user_id, SUM(worked_minutes) as worked_minutes
+        FROM {table}
+        WHERE date BETWEEN %s AND %s AND worked_minutes IS NOT NULL
+        GROUP BY user_id
+        """,
+        previous_month
+    ),
+}
+
+
+def generate_rows(staff, years, today, rng):
+    """One closed row per staff member per Monday to Saturday"""
+    day = today - timedelta(days=365 * years)
+    while day <= today:
+        if day.isoweekday() != 7:
+            for user_id in range(1, staff + 1):
+                if rng.random() < 0.95:
+                    time_in = datetime.combine(day, datetime.min.time()) + timedelta(hours=9, minutes=rng.randint(-20, 40))
+                    minutes = (240 if day.isoweekday() == 6 else 480) + rng.randint(-30, 60)
+                    yield (user_id, time_in, time_in + timedelta(minutes=minutes), minutes, day)
+        day += timedelta(days=1)
+
+
+def create_tables(cursor, granularity, today):
+    for table, partitions in ((FLAT_TABLE, ''), (PARTITIONED_TABLE, timesheet_partition_clause(granularity, today))):
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+        cursor.execute(TABLE_DEFINITION.format(table=table, partitions=partitions))
+
+
+def fill_tables(conn, cursor, rows):
+    batch = []
+    total = 0
+    for row in rows:
+        batch.append(row)
+        if len(batch) == INSERT_BATCH_SIZE:
+            total += insert_batch(conn, cursor, batch)
+            batch = []
+    total += insert_batch(conn, cursor, batch)
+    for table in (FLAT_TABLE, PARTITIONED_TABLE):
+        cursor.execute(f"ANALYZE TABLE {table}")
+        cursor.fetchall()
+    return total
+
+
+def insert_batch(conn, cursor, batch):
+    if not batch:
+        return 0
+    for table in (FLAT_TABLE, PARTITIONED_TABLE):
+        cursor.executemany(
+            f"INSERT INTO {table} (user_id, time_in, time_out, worked_minutes, date) VALUES (%s, %s, %s, %s, %s)",
+            batch
+        )
+    conn.commit()
+    return len(batch)
+
+
+def time_query(cursor, query, params, iterations):
+    """Median latency in milliseconds"""
+    latencies = []
+    for _ in range(iterations):
+        began = time.perf_counter()
+        cursor.execute(query, params)
+        cursor.fetchall()
+        latencies.append((time.perf_counter() - began) * 1000)
+    return statistics.median(latencies)
+
+
+def explain_partitions(cursor, query, params):
+    cursor.execute("EXPLAIN " + query, params)
+    plan = cursor.fetchall()
+    return ','.join(sorted({row['partitions'] for row in plan if row.get('partitions')})) or '-'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--staff', type=int, default=500)
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--granularity', choices=['month', 'year'], default='month')
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--keep', action='store_true', help='keep the scratch tables')
+    args = parser.parse_args()
+
+    conn = DatabaseConnection().connect()
+    if conn is None:
+        return
+    cursor = conn.cursor(dictionary=True)
+    today = date.today()
+    try:
+        create_tables(cursor, args.granularity, today)
+        began = time.perf_counter()
+        total = fill_tables(conn, cursor, generate_rows(args.staff, args.years, today, random.Random(2025)))
+        print(f"Loaded {total} rows into each table in {time.perf_counter() - began:.1f}s", flush=True)
+
+        print(f"{'query':22} {'flat (ms)':>10} {'partitioned (ms)':>17} {'speedup':>8}  partitions read", flush=True)
+        for name, (query, make_params) in QUERIES.items():
+            params = make_params(today)
+            flat = time_query(cursor, query.format(table=FLAT_TABLE), params, args.iterations)
+            partitioned = time_query(cursor, query.format(table=PARTITIONED_TABLE), params, args.iterations)
+            partitions = explain_partitions(cursor, query.format(table=PARTITIONED_TABLE), params)
+            print(f"{name:22} {flat:10.2f} {partitioned:17.2f} {flat / partitioned:7.2f}x  {partitions}", flush=True)
+    finally:
+        if not args.keep:
+            for table in (FLAT_TABLE, PARTITIONED_TABLE):
+                cursor.execute(f"DROP TABLE IF EXISTS {table}")
+        cursor.close()
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
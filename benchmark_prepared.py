@@ -0,0 +1,85 @@
+"""Benchmark the hot queries with and without the prepared statement cache
+
+Calls the DatabaseOperations methods that run through the per-connection
+cache of server-side prepared statements against the configured database,
+once with the cache bypassed (plain text queries) and once with it, and
+prints per-call latency. record_time_out is timed through its own SQL for a
+user id that does not exist, so no rows or data versions change.
+
+Usage: python benchmark_prepared.py [--iterations N]
+"""
+import argparse
+import statistics
+import time
+from datetime import date
+from app.db import DatabaseOperations, MYSQL_STATEMENT_CACHE_SIZE
+
+MISSING_USER_ID = -1
+
+# Same text as DatabaseOperations.record_time_out, which also bumps versions
+RECORD_TIME_OUT = """
+            UPDATE Timesheet 
+            SET time_out = NOW()
+            WHERE user_id = %s 
+            AND date = %s
+            AND time_out IS NULL
+        """
+
+HOT_CALLS = {
+    'get_data_versions': lambda db, user_id: db.get_data_versions(user_id),
+    'get_user_by_id': lambda db, user_id: db.get_user_by_id(user_id),
+    'get_today_timesheet': lambda db, user_id: db.get_today_timesheet(user_id),
+    'record_time_out': lambda db, user_id: db.execute_query(
+        RECORD_TIME_OUT, (MISSING_USER_ID, date.today()), prepared=True),
+}
+
+
+def plain_queries(db):
+    """db with prepared=True ignored, so its methods run plain text queries"""
+    execute = db.execute_query
+    db.execute_query = lambda query, params=None, prepared=False, read_only=False: execute(
+        query, params, read_only=read_only)
+    return db
+
+
+def time_call(db, call, user_id, iterations):
+    """Return per-call latencies in microseconds"""
+    # Warm up the pool (and the statement cache) before timing
+    call(db, user_id)
+    latencies = []
+    for _ in range(iterations):
+        began = time.perf_counter()
+        call(db, user_id)
+        latencies.append((time.perf_counter() - began) * 1_000_000)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    if MYSQL_STATEMENT_CACHE_SIZE <= 0:
+        print("MYSQL_STATEMENT_CACHE_SIZE is 0, the prepared run would use plain queries.")
+        return
+
+    db = DatabaseOperations()
+    text_db = plain_queries(DatabaseOperations())
+    success, result = db.execute_query("SELECT user_id FROM User WHERE deleted_at IS NULL ORDER BY user_id LIMIT 1")
+    if not success or not result:
+        print("Need at least one user in the database.")
+        return
+    user_id = result[0]['user_id']
+
+    print(f"{'query':22} {'text p50 (us)':>14} {'prepared p50 (us)':>18} {'text p95':>10} {'prepared p95':>13} {'speedup':>8}", flush=True)
+    for name, call in HOT_CALLS.items():
+        text = time_call(text_db, call, user_id, args.iterations)
+        prepared = time_call(db, call, user_id, args.iterations)
+        text_p50, prepared_p50 = statistics.median(text), statistics.median(prepared)
+        text_p95 = statistics.quantiles(text, n=20)[-1]
+        prepared_p95 = statistics.quantiles(prepared, n=20)[-1]
+        print(f"{name:22} {text_p50:14.0f} {prepared_p50:18.0f} {text_p95:10.0f} {prepared_p95:13.0f} {text_p50 / prepared_p50:7.2f}x", flush=True)
+
+
+if __name__ == '__main__':
+    main()
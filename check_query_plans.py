@@ -0,0 +1,152 @@
+"""Check that every shape of the optional-filter queries uses its intended index
+
+Runs EXPLAIN for each combination of filters of the QueryBuilder instances in
+app.db and app.balance against the configured database and reports the index
+MySQL picks. Then runs the reads whose SQL does not start with SELECT
+(UNIONs in parentheses, WITH queries) through DatabaseOperations and checks
+they return the rows they should. Exits with status 1 if any shape misses its
+intended index or any of those reads fails.
+
+Usage: python check_query_plans.py
+"""
+import sys
+from datetime import datetime
+from itertools import combinations
+from app.db import (
+    DatabaseOperations,
+    TIMESHEET_HISTORY_QUERY,
+    TIMESHEET_PAGE_QUERY,
+    ARCHIVE_HISTORY_QUERY,
+    ARCHIVE_PAGE_QUERY,
+    LEAVE_HISTORY_QUERY,
+    LEAVE_PAGE_QUERY,
+    USER_SEARCH_BY_NAME_QUERY,
+    USER_SEARCH_BY_EMAIL_QUERY,
+    NOTE_SEARCH_QUERY,
+)
+from app.balance import STAFF_BALANCE_RANGE_QUERY
+from app.attendance import AttendanceCalendar
+
+def sample_parameters(user_id):
+    """Sample (required params, suffix params, filter values) for each builder"""
+    day = '2025-01-15'
+    return {
+        'TIMESHEET_HISTORY_QUERY': ((user_id,), (), {
+            'start_date': day, 'employment_date_of': user_id, 'end_date': day,
+        }),
+        'TIMESHEET_PAGE_QUERY': ((user_id,), (51,), {
+            'start_date': day, 'employment_date_of': user_id, 'end_date': day, 'after': (day, 1000),
+        }),
+        'ARCHIVE_HISTORY_QUERY': ((user_id,), (), {
+            'start_date': day, 'employment_date_of': user_id, 'end_date': day,
+        }),
+        'ARCHIVE_PAGE_QUERY': ((user_id,), (51,), {
+            'start_date': day, 'employment_date_of': user_id, 'end_date': day, 'after': (day, 1000),
+        }),
+        'LEAVE_HISTORY_QUERY': ((user_id,), (), {
+            'status': 'Approved',
+        }),
+        'LEAVE_PAGE_QUERY': ((user_id,), (51,), {
+            'status': 'Approved', 'after': (f'{day} 00:00:00', 1000),
+        }),
+        'STAFF_BALANCE_RANGE_QUERY': ((), (), {
+            'user_id': user_id,
+        }),
+        'USER_SEARCH_BY_NAME_QUERY': (('jo%',), (11,), {
+            'role': 'Staff', 'after': 'john',
+        }),
+        'USER_SEARCH_BY_EMAIL_QUERY': (('jo%',), (11,), {
+            'role': 'Staff', 'after': 'john',
+        }),
+        'NOTE_SEARCH_QUERY': (('client meeting', 'client meeting'), (51, 0), {
+            'user_id': user_id, 'source': 'timesheet', 'start_date': day, 'end_date': day,
+        }),
+    }
+
+BUILDERS = {
+    'TIMESHEET_HISTORY_QUERY': TIMESHEET_HISTORY_QUERY,
+    'TIMESHEET_PAGE_QUERY': TIMESHEET_PAGE_QUERY,
+    'ARCHIVE_HISTORY_QUERY': ARCHIVE_HISTORY_QUERY,
+    'ARCHIVE_PAGE_QUERY': ARCHIVE_PAGE_QUERY,
+    'LEAVE_HISTORY_QUERY': LEAVE_HISTORY_QUERY,
+    'LEAVE_PAGE_QUERY': LEAVE_PAGE_QUERY,
+    'STAFF_BALANCE_RANGE_QUERY': STAFF_BALANCE_RANGE_QUERY,
+    'USER_SEARCH_BY_NAME_QUERY': USER_SEARCH_BY_NAME_QUERY,
+    'USER_SEARCH_BY_EMAIL_QUERY': USER_SEARCH_BY_EMAIL_QUERY,
+    'NOTE_SEARCH_QUERY': NOTE_SEARCH_QUERY,
+}
+
+def main():
+    db = DatabaseOperations()
+    success, result = db.execute_query("SELECT user_id, username FROM User WHERE role = 'Staff' AND deleted_at IS NULL LIMIT 1")
+    if not success or not result:
+        print("Need at least one staff user in the database.")
+        return 1
+
+    failures = 0
+    for name, (required, suffix, values) in sample_parameters(result[0]['user_id']).items():
+        builder = BUILDERS[name]
+        if builder.index is None:
+            continue
+        filters = list(builder.filters)
+        for size in range(len(filters) + 1):
+            for supplied in combinations(filters, size):
+                query, params = builder.build(required, suffix, **{key: values[key] for key in supplied})
+                success, plan = explain(db, query, params)
+                keys = [row.get('key') for row in plan] if success and plan else []
+                ok = builder.index in keys
+                failures += 0 if ok else 1
+                shape = ', '.join(supplied) or '(no filters)'
+                print(f"{'ok  ' if ok else 'FAIL'} {name:32} {shape:55} keys={keys}")
+
+    failures += check_result_sets(db, result[0])
+    return 1 if failures else 0
+
+def archived_history_check(db):
+    """True if a user's full history includes their archived rows (or nothing is archived)"""
+    watermark = db.get_archive_watermark()
+    if watermark is None:
+        return True
+    success, result = db.execute_query("SELECT user_id FROM TimesheetArchive WHERE date = %s LIMIT 1", (watermark,))
+    if not success or not result:
+        return False
+    history = db.get_user_timesheet(result[0]['user_id'])
+    return any(row['date'] <= watermark for row in history)
+
+def result_set_checks(db, staff):
+    """(name, callable returning True when the read came back as expected)"""
+    return [
+        ('search_users', lambda: any(
+            row['user_id'] == staff['user_id'] for row in db.search_users(staff['username'], limit=50)[0]
+        )),
+        ('federated timesheet history', lambda: archived_history_check(db)),
+        ('attendance calendar', lambda: any(
+            entry['user_id'] == staff['user_id'] and entry['days']
+            for entry in AttendanceCalendar(db).month(datetime.now().date(), user_id=staff['user_id']) or []
+        )),
+    ]
+
+def check_result_sets(db, staff):
+    """Run each read in result_set_checks and return the number that failed"""
+    failures = 0
+    for name, check in result_set_checks(db, staff):
+        ok = check()
+        failures += 0 if ok else 1
+        print(f"{'ok  ' if ok else 'FAIL'} {name}")
+    return failures
+
+def explain(db, query, params):
+    """Run EXPLAIN for a statement and return (success, plan rows)"""
+    conn = db.db.connect()
+    if conn is None:
+        return False, None
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("EXPLAIN " + query, params)
+        return True, cursor.fetchall()
+    finally:
+        cursor.close()
+        conn.close()
+
+if __name__ == '__main__':
+    sys.exit(main())
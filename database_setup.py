@@ -2,7 +2,10 @@ import mysql.connector
 from dotenv import load_dotenv
 import os
 import bcrypt
+import sys
 from datetime import date
+from app.partitioning import TIMESHEET_PARTITIONING, PARTITIONS_QUERY, timesheet_partition_clause
+from app.db import DELETED_USER_RENAME
 load_dotenv()
 
 MYSQL_USERNAME = os.getenv("MYSQL_USERNAME")
@@ -101,6 +104,136 @@ def create_database():
         if conn:
             conn.close()
 
+# Timesheet rows older than the archive horizon, moved by
+# app.maintenance.TimesheetArchiver. Same columns as Timesheet with the
+# generated values stored; partitioned by year, so it has no foreign key and
+# the primary key includes the date.
+CREATE_TIMESHEET_ARCHIVE_TABLE = """
+CREATE TABLE IF NOT EXISTS TimesheetArchive (
+    timesheet_id INT NOT NULL,
+    user_id INT NOT NULL,
+    time_in TIMESTAMP NULL,
+    time_out TIMESTAMP NULL,
+    total_time TIME NULL,
+    worked_minutes INT NULL,
+    date DATE NOT NULL,
+    entry_type ENUM('Work', 'Leave', 'Holiday', 'Adjustment') NOT NULL DEFAULT 'Work',
+    notes TEXT,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (timesheet_id, date),
+    INDEX idx_archive_user_date (user_id, date),
+    INDEX idx_archive_date (date)
+) ROW_FORMAT=COMPRESSED
+PARTITION BY RANGE (YEAR(date)) (
+    PARTITION pmax VALUES LESS THAN MAXVALUE
+)
+"""
+
+# Per user and month totals of archived rows, kept in step with TimesheetArchive
+CREATE_TIMESHEET_MONTHLY_SUMMARY_TABLE = """
+CREATE TABLE IF NOT EXISTS TimesheetMonthlySummary (
+    user_id INT NOT NULL,
+    month_start DATE NOT NULL,
+    worked_minutes INT NOT NULL,
+    work_entries INT NOT NULL,
+    paid_entries INT NOT NULL,
+    total_entries INT NOT NULL,
+    PRIMARY KEY (user_id, month_start),
+    FOREIGN KEY (user_id) REFERENCES User(user_id)
+)
+"""
+
+# Bulk punch imports started from the admin upload, polled for progress by any worker
+CREATE_IMPORT_JOB_TABLE = """
+CREATE TABLE IF NOT EXISTS ImportJob (
+    job_id INT AUTO_INCREMENT PRIMARY KEY,
+    filename VARCHAR(255) NOT NULL,
+    status ENUM('Queued', 'Running', 'Done', 'Failed') NOT NULL DEFAULT 'Queued',
+    rows_read INT NOT NULL DEFAULT 0,
+    rejected INT NOT NULL DEFAULT 0,
+    duplicates INT NOT NULL DEFAULT 0,
+    inserted INT NOT NULL DEFAULT 0,
+    errors TEXT,
+    created_by INT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP NULL,
+    FOREIGN KEY (created_by) REFERENCES User(user_id)
+)
+"""
+
+# Outcome of every offline punch by its client idempotency key, so replayed
+# sync batches are answered without re-reading Timesheet
+CREATE_PUNCH_SYNC_TABLE = """
+CREATE TABLE IF NOT EXISTS PunchSync (
+    user_id INT NOT NULL,
+    idempotency_key VARCHAR(64) NOT NULL,
+    status ENUM('applied', 'rejected') NOT NULL,
+    message VARCHAR(100) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, idempotency_key),
+    INDEX idx_punch_sync_created (created_at),
+    FOREIGN KEY (user_id) REFERENCES User(user_id)
+)
+"""
+
+# Short-lived log of broker events, polled by every worker (see app.changes)
+CREATE_CHANGE_LOG_TABLE = """
+CREATE TABLE IF NOT EXISTS ChangeLog (
+    change_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    origin CHAR(16) NOT NULL,
+    kind VARCHAR(32) NOT NULL,
+    payload TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_change_log_created (created_at)
+)
+"""
+
+# Change counters behind the ETags: one row per user, scope -1 bumped by
+# settings changes and scopes -100 and below, whose sum is the global version
+# (see DatabaseOperations.bump_data_version)
+CREATE_DATA_VERSION_TABLE = """
+CREATE TABLE IF NOT EXISTS DataVersion (
+    scope_id INT PRIMARY KEY,
+    version BIGINT UNSIGNED NOT NULL
+)
+"""
+
+# Searchable copy of Timesheet.notes and LeaveRecord.reason, kept in step by
+# DatabaseOperations; a separate table because partitioned Timesheet and
+# TimesheetArchive cannot have FULLTEXT indexes
+CREATE_NOTE_SEARCH_TABLE = """
+CREATE TABLE IF NOT EXISTS NoteSearch (
+    note_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    source ENUM('timesheet', 'leave') NOT NULL,
+    source_id INT NOT NULL,
+    user_id INT NOT NULL,
+    date DATE NOT NULL,
+    body TEXT NOT NULL,
+    UNIQUE KEY uq_note_source (source, source_id, user_id, date),
+    INDEX idx_note_user_date (user_id, date),
+    FULLTEXT INDEX ft_note_body (body),
+    FOREIGN KEY (user_id) REFERENCES User(user_id)
+)
+"""
+
+# One row per scheduled job run; the unique slot key lets only one replica
+# claim each run (see app.scheduler)
+CREATE_JOB_RUN_TABLE = """
+CREATE TABLE IF NOT EXISTS JobRun (
+    run_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    job_name VARCHAR(64) NOT NULL,
+    scheduled_for DATETIME NOT NULL,
+    runner VARCHAR(100) NOT NULL,
+    status ENUM('Running', 'Succeeded', 'Failed') NOT NULL DEFAULT 'Running',
+    started_at DATETIME(3) NOT NULL,
+    finished_at DATETIME(3) NULL,
+    duration_ms INT NULL,
+    result TEXT,
+    UNIQUE KEY uq_job_run_slot (job_name, scheduled_for),
+    INDEX idx_job_run_started (started_at)
+)
+"""
+
 def create_tables():
     conn = None
     cursor = None
@@ -122,13 +255,24 @@ def create_tables():
             profile_picture_url VARCHAR(2048),
             employment_date DATE NOT NULL,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            role ENUM('Admin', 'Staff')
+            role ENUM('Admin', 'Staff'),
+            deleted_at DATETIME NULL,
+            INDEX idx_user_deleted (deleted_at)
         )
         """
 
-        create_timesheet_table_query = """
+        # A partitioned Timesheet needs the date in its primary key and cannot
+        # keep the foreign key to User
+        if TIMESHEET_PARTITIONING:
+            timesheet_keys = "PRIMARY KEY (timesheet_id, date)"
+            timesheet_partitions = timesheet_partition_clause(TIMESHEET_PARTITIONING)
+        else:
+            timesheet_keys = "PRIMARY KEY (timesheet_id),\n            FOREIGN KEY (user_id) REFERENCES User(user_id)"
+            timesheet_partitions = ""
+
+        create_timesheet_table_query = f"""
         CREATE TABLE IF NOT EXISTS Timesheet (
-            timesheet_id INT AUTO_INCREMENT PRIMARY KEY,
+            timesheet_id INT AUTO_INCREMENT,
             user_id INT,
             time_in TIMESTAMP NULL,
             time_out TIMESTAMP NULL,
@@ -138,10 +282,26 @@ def create_tables():
                     ELSE NULL
                 END
             ) VIRTUAL,
+            worked_minutes INT GENERATED ALWAYS AS (
+                CASE
+                    WHEN time_in IS NOT NULL AND time_out IS NOT NULL
+                    THEN GREATEST(TIME_TO_SEC(TIME(time_out)) - TIME_TO_SEC(TIME(time_in)), 0) DIV 60
+                    ELSE NULL
+                END
+            ) STORED,
             date DATE,
+            entry_type ENUM('Work', 'Leave', 'Holiday', 'Adjustment') NOT NULL DEFAULT 'Work',
             notes TEXT,
-            FOREIGN KEY (user_id) REFERENCES User(user_id)
-        );
+            needs_review TINYINT(1) NOT NULL DEFAULT 0,
+            INDEX idx_timesheet_user_type_date (user_id, entry_type, date),
+            INDEX idx_timesheet_user_date (user_id, date),
+            INDEX idx_timesheet_user_date_minutes (user_id, date, worked_minutes, entry_type),
+            INDEX idx_timesheet_date (date),
+            INDEX idx_timesheet_open (time_out, date),
+            INDEX idx_timesheet_review (needs_review, date),
+            {timesheet_keys}
+        )
+        {timesheet_partitions};
         """
 
         create_leave_table_query = """
@@ -155,6 +315,7 @@ def create_tables():
             reason TEXT,
             document_url VARCHAR(2048),
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_leave_user_created (user_id, created_at),
             FOREIGN KEY (user_id) REFERENCES User(user_id)
         );
         """
@@ -171,10 +332,30 @@ def create_tables():
         );
         """
 
+        create_balance_checkpoint_table_query = """
+        CREATE TABLE IF NOT EXISTS BalanceCheckpoint (
+            user_id INT NOT NULL,
+            period_end DATE NOT NULL,
+            minutes_owed INT NOT NULL,
+            computed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, period_end),
+            FOREIGN KEY (user_id) REFERENCES User(user_id)
+        );
+        """
+
         cursor.execute(create_users_table_query)
         cursor.execute(create_timesheet_table_query)
         cursor.execute(create_leave_table_query)
         cursor.execute(create_working_hours_table_query)
+        cursor.execute(create_balance_checkpoint_table_query)
+        cursor.execute(CREATE_TIMESHEET_ARCHIVE_TABLE)
+        cursor.execute(CREATE_TIMESHEET_MONTHLY_SUMMARY_TABLE)
+        cursor.execute(CREATE_IMPORT_JOB_TABLE)
+        cursor.execute(CREATE_PUNCH_SYNC_TABLE)
+        cursor.execute(CREATE_CHANGE_LOG_TABLE)
+        cursor.execute(CREATE_DATA_VERSION_TABLE)
+        cursor.execute(CREATE_NOTE_SEARCH_TABLE)
+        cursor.execute(CREATE_JOB_RUN_TABLE)
         
         # Insert default working hours if table is empty
         cursor.execute("SELECT COUNT(*) FROM WorkingHours")
@@ -200,6 +381,224 @@ def create_tables():
         if conn:
             conn.close()
 
+def column_exists(cursor, table, column):
+    cursor.execute(
+        """
+        SELECT COUNT(*) FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s AND COLUMN_NAME = %s
+        """,
+        (MYSQL_DATABASE, table, column)
+    )
+    return cursor.fetchone()[0] > 0
+
+def index_exists(cursor, table, index):
+    cursor.execute(
+        """
+        SELECT COUNT(*) FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s AND INDEX_NAME = %s
+        """,
+        (MYSQL_DATABASE, table, index)
+    )
+    return cursor.fetchone()[0] > 0
+
+def migrate_timesheet_entry_type(cursor):
+    """Add Timesheet.entry_type and backfill it from approved leave entries"""
+    if not column_exists(cursor, 'Timesheet', 'entry_type'):
+        cursor.execute("""
+            ALTER TABLE Timesheet
+            ADD COLUMN entry_type ENUM('Work', 'Leave', 'Holiday', 'Adjustment') NOT NULL DEFAULT 'Work' AFTER date
+        """)
+        # Rows written by DatabaseOperations.create_leave_timesheet_entry carry "On <reason> leave"
+        cursor.execute("""
+            UPDATE Timesheet t
+            JOIN LeaveRecord l ON l.user_id = t.user_id
+                AND l.status = 'Approved'
+                AND t.date BETWEEN l.start_date AND l.end_date
+            SET t.entry_type = 'Leave'
+            WHERE t.notes = CONCAT('On ', l.reason, ' leave')
+        """)
+        print(f"Backfilled {cursor.rowcount} leave timesheet entries.")
+        # Notes that merely mention "leave" no longer count as paid days
+        cursor.execute("DELETE FROM BalanceCheckpoint")
+
+    if not index_exists(cursor, 'Timesheet', 'idx_timesheet_user_type_date'):
+        cursor.execute("ALTER TABLE Timesheet ADD INDEX idx_timesheet_user_type_date (user_id, entry_type, date)")
+
+def migrate_timesheet_worked_minutes(cursor):
+    """Add the stored Timesheet.worked_minutes column and its covering index"""
+    if not column_exists(cursor, 'Timesheet', 'worked_minutes'):
+        cursor.execute("""
+            ALTER TABLE Timesheet
+            ADD COLUMN worked_minutes INT GENERATED ALWAYS AS (
+                CASE
+                    WHEN time_in IS NOT NULL AND time_out IS NOT NULL
+                    THEN GREATEST(TIME_TO_SEC(TIME(time_out)) - TIME_TO_SEC(TIME(time_in)), 0) DIV 60
+                    ELSE NULL
+                END
+            ) STORED AFTER total_time
+        """)
+
+    if not index_exists(cursor, 'Timesheet', 'idx_timesheet_user_date_minutes'):
+        cursor.execute("""
+            ALTER TABLE Timesheet
+            ADD INDEX idx_timesheet_user_date_minutes (user_id, date, worked_minutes, entry_type)
+        """)
+
+def migrate_history_pagination_indexes(cursor):
+    """Add the indexes that keyset pagination of timesheet and leave history walks"""
+    # InnoDB appends the primary key, so these order rows by (date, timesheet_id)
+    # and (created_at, leave_id) within a user
+    if not index_exists(cursor, 'Timesheet', 'idx_timesheet_user_date'):
+        cursor.execute("ALTER TABLE Timesheet ADD INDEX idx_timesheet_user_date (user_id, date)")
+    if not index_exists(cursor, 'LeaveRecord', 'idx_leave_user_created'):
+        cursor.execute("ALTER TABLE LeaveRecord ADD INDEX idx_leave_user_created (user_id, created_at)")
+
+def migrate_user_soft_delete(cursor):
+    """Add User.deleted_at, set by a soft delete until the purge removes the user"""
+    if not column_exists(cursor, 'User', 'deleted_at'):
+        cursor.execute("ALTER TABLE User ADD COLUMN deleted_at DATETIME NULL")
+    if not index_exists(cursor, 'User', 'idx_user_deleted'):
+        cursor.execute("ALTER TABLE User ADD INDEX idx_user_deleted (deleted_at)")
+    # Free the unique email and username of users soft deleted before renaming
+    cursor.execute(f"""
+        UPDATE User SET
+            email = {DELETED_USER_RENAME.format(column='email')},
+            username = {DELETED_USER_RENAME.format(column='username')}
+        WHERE deleted_at IS NOT NULL AND email NOT LIKE 'deleted-%'
+    """)
+
+def migrate_timesheet_archive(cursor):
+    """Create the archive and monthly summary tables and the date index the archiver scans"""
+    cursor.execute(CREATE_TIMESHEET_ARCHIVE_TABLE)
+    cursor.execute(CREATE_TIMESHEET_MONTHLY_SUMMARY_TABLE)
+    if not index_exists(cursor, 'Timesheet', 'idx_timesheet_date'):
+        cursor.execute("ALTER TABLE Timesheet ADD INDEX idx_timesheet_date (date)")
+
+def timesheet_is_partitioned(cursor):
+    cursor.execute(PARTITIONS_QUERY, ('Timesheet',))
+    return len(cursor.fetchall()) > 0
+
+def migrate_timesheet_partitioning(cursor):
+    """Partition Timesheet by TIMESHEET_PARTITIONING when it is set
+
+    Drops the foreign key to User and widens the primary key to
+    (timesheet_id, date), both required by MySQL for partitioned tables. This
+    rebuilds the table, so run it in a maintenance window.
+    """
+    if not TIMESHEET_PARTITIONING or timesheet_is_partitioned(cursor):
+        return
+    cursor.execute(
+        """
+        SELECT CONSTRAINT_NAME FROM information_schema.REFERENTIAL_CONSTRAINTS
+        WHERE CONSTRAINT_SCHEMA = %s AND TABLE_NAME = 'Timesheet'
+        """,
+        (MYSQL_DATABASE,)
+    )
+    for (constraint,) in cursor.fetchall():
+        cursor.execute(f"ALTER TABLE Timesheet DROP FOREIGN KEY `{constraint}`")
+    cursor.execute("ALTER TABLE Timesheet DROP PRIMARY KEY, ADD PRIMARY KEY (timesheet_id, date)")
+    cursor.execute("ALTER TABLE Timesheet " + timesheet_partition_clause(TIMESHEET_PARTITIONING))
+
+def migrate_import_jobs(cursor):
+    """Create the ImportJob table behind the punch import endpoint"""
+    cursor.execute(CREATE_IMPORT_JOB_TABLE)
+
+def migrate_punch_sync(cursor):
+    """Create the PunchSync idempotency table behind the offline sync endpoint"""
+    cursor.execute(CREATE_PUNCH_SYNC_TABLE)
+
+def migrate_change_log(cursor):
+    """Create the ChangeLog table behind the cross-worker event bus"""
+    cursor.execute(CREATE_CHANGE_LOG_TABLE)
+
+def migrate_data_versions(cursor):
+    """Create the DataVersion counters behind conditional GETs"""
+    cursor.execute(CREATE_DATA_VERSION_TABLE)
+
+def migrate_note_search(cursor):
+    """Create NoteSearch and fill it from existing notes and leave reasons
+
+    The backfill runs whenever the table is empty: create_tables() may already
+    have created it, and writes keep it filled from then on.
+    """
+    cursor.execute(CREATE_NOTE_SEARCH_TABLE)
+    cursor.execute("SELECT 1 FROM NoteSearch LIMIT 1")
+    if cursor.fetchone() is not None:
+        return
+    for table in ('Timesheet', 'TimesheetArchive'):
+        cursor.execute(f"""
+            INSERT IGNORE INTO NoteSearch (source, source_id, user_id, date, body)
+            SELECT 'timesheet', 0, user_id, date, notes FROM {table}
+            WHERE notes IS NOT NULL AND TRIM(notes) <> ''
+        """)
+    cursor.execute("""
+        INSERT IGNORE INTO NoteSearch (source, source_id, user_id, date, body)
+        SELECT 'leave', leave_id, user_id, start_date, reason FROM LeaveRecord
+        WHERE reason IS NOT NULL AND TRIM(reason) <> ''
+    """)
+
+def migrate_timesheet_review(cursor):
+    """Add Timesheet.needs_review and the indexes of the stale timesheet closer"""
+    if not column_exists(cursor, 'Timesheet', 'needs_review'):
+        cursor.execute("ALTER TABLE Timesheet ADD COLUMN needs_review TINYINT(1) NOT NULL DEFAULT 0")
+    if not index_exists(cursor, 'Timesheet', 'idx_timesheet_open'):
+        cursor.execute("ALTER TABLE Timesheet ADD INDEX idx_timesheet_open (time_out, date)")
+    if not index_exists(cursor, 'Timesheet', 'idx_timesheet_review'):
+        cursor.execute("ALTER TABLE Timesheet ADD INDEX idx_timesheet_review (needs_review, date)")
+
+def migrate_job_runs(cursor):
+    """Create the JobRun history table behind the scheduler"""
+    cursor.execute(CREATE_JOB_RUN_TABLE)
+
+MIGRATIONS = [
+    migrate_timesheet_entry_type,
+    migrate_timesheet_worked_minutes,
+    migrate_history_pagination_indexes,
+    migrate_user_soft_delete,
+    migrate_timesheet_archive,
+    migrate_timesheet_partitioning,
+    migrate_import_jobs,
+    migrate_punch_sync,
+    migrate_change_log,
+    migrate_data_versions,
+    migrate_note_search,
+    migrate_timesheet_review,
+    migrate_job_runs,
+]
+
+def migrate_database():
+    """Bring an existing database up to the current schema without dropping data"""
+    conn = None
+    cursor = None
+
+    try:
+        conn = connect_to_database()
+
+        if conn is None:
+            print("Failed to connect to MySQL server.")
+            return False
+
+        cursor = conn.cursor()
+
+        for migration in MIGRATIONS:
+            migration(cursor)
+            conn.commit()
+            print(f"Applied {migration.__name__}.")
+
+        return True
+
+    except Exception as e:
+        print(f"An error occurred while migrating: {e}")
+        if conn:
+            conn.rollback()
+        return False
+
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
 def insert_user(username, email, password, role, employment_date, profile_picture_url=None):
     conn = None
     cursor = None
@@ -234,7 +633,7 @@ def insert_user(username, email, password, role, employment_date, profile_pictur
         if conn:
             conn.close()
 
-def insert_timesheet(user_id, time_in, time_out, date, notes):
+def insert_timesheet(user_id, time_in, time_out, date, notes, entry_type='Work'):
     conn = None
     cursor = None
 
@@ -248,10 +647,10 @@ def insert_timesheet(user_id, time_in, time_out, date, notes):
         cursor = conn.cursor()
 
         insert_timesheet_query = """
-            INSERT INTO Timesheet (user_id, time_in, time_out, date, notes)
-            VALUES (%s, %s, %s, %s, %s)
+            INSERT INTO Timesheet (user_id, time_in, time_out, date, notes, entry_type)
+            VALUES (%s, %s, %s, %s, %s, %s)
         """
-        cursor.execute(insert_timesheet_query, (user_id, time_in, time_out, date, notes))
+        cursor.execute(insert_timesheet_query, (user_id, time_in, time_out, date, notes, entry_type))
 
         conn.commit()
         print("Timesheet entry inserted successfully.")
@@ -301,7 +700,12 @@ def insert_leave(user_id, leave_type, start_date, end_date, reason, document_url
             conn.close()
 
 if __name__ == "__main__":
-    drop_database()
-    create_database()
-    create_tables()
-    insert_user("admin", "realblank21@gmail.com", "admin123", "Admin", date(2024, 1, 1))
\ No newline at end of file
+    if len(sys.argv) > 1 and sys.argv[1] == "migrate":
+        # Non-destructive upgrade: create missing tables, then alter existing ones
+        create_tables()
+        migrate_database()
+    else:
+        drop_database()
+        create_database()
+        create_tables()
+        insert_user("admin", "realblank21@gmail.com", "admin123", "Admin", date(2024, 1, 1))
\ No newline at end of file
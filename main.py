@@ -1,10 +1,20 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_file
+from flask import Flask, Response, make_response, render_template, request, redirect, url_for, session, flash, jsonify, send_file
 from app.authentication import AuthenticationManager
-from app.db import DatabaseOperations
+from app.db import DatabaseOperations, PUNCH_SYNC_MAX_EVENTS, PUNCH_SYNC_MAX_AGE_DAYS, PUNCH_SYNC_MAX_SKEW_SECONDS
+from app.balance import BalanceCalculator
+from app.maintenance import start_staff_purge
+from app.events import broker
+from app.changes import start_change_bus
+from app.importer import IMPORT_FOLDER, create_import_job, get_import_job, start_import_job
+from app.attendance import AttendanceCalendar
+from app.scheduler import get_job_history, start_scheduler
 from functools import wraps
 from dotenv import load_dotenv
 from werkzeug.utils import secure_filename
 import os
+import hashlib
+import json
+import time
 from datetime import datetime, timedelta
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import letter
@@ -14,6 +24,13 @@ from io import BytesIO
 
 load_dotenv()
 
+# Live attendance feed: idle streams send a comment every heartbeat and are
+# closed after EVENT_STREAM_SECONDS so the browser reconnects and frees the thread
+EVENT_HEARTBEAT_SECONDS = float(os.getenv('EVENT_HEARTBEAT_SECONDS', '15'))
+EVENT_STREAM_SECONDS = float(os.getenv('EVENT_STREAM_SECONDS', '300'))
+# Seconds a dashboard turned away by the stream cap waits before trying again
+EVENT_RETRY_SECONDS = int(os.getenv('EVENT_RETRY_SECONDS', '60'))
+
 # Configure upload folder
 UPLOAD_FOLDER = 'static/uploads'
 ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg', 'doc', 'docx'}
@@ -25,9 +42,48 @@ app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=90)
 auth_manager = AuthenticationManager()
 db = DatabaseOperations()
+balances = BalanceCalculator(db)
+calendar = AttendanceCalendar(db)
+# Relay events between gunicorn workers so live feeds and caches see every write
+start_change_bus(db)
+# Maintenance jobs run in a background thread; MySQL locks keep each run to one worker
+scheduler = start_scheduler(db)
 
 # Create uploads directory if it doesn't exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+os.makedirs(IMPORT_FOLDER, exist_ok=True)
+
+@app.before_request
+def reset_read_routing():
+    # Reads may use the replica again until this request writes
+    db.begin_request()
+
+def data_etag(versions, *parts):
+    """ETag for a response built from data covered by the given counters
+
+    Returns None when the counters could not be read, so nothing is cached.
+    Otherwise the rest of the request reads from the primary, where the
+    counters come from, so the body is never older than its tag.
+    """
+    if versions is None:
+        return None
+    db.pin_to_primary()
+    raw = '|'.join(str(part) for part in (*versions, datetime.now().date(), request.full_path, *parts))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:24]
+
+def not_modified(etag):
+    """A 304 response when the client already has etag, else None"""
+    if etag is None or not request.if_none_match.contains_weak(etag):
+        return None
+    return with_etag(Response(status=304), etag)
+
+def with_etag(response, etag):
+    """Attach etag and make the browser revalidate instead of reusing blindly"""
+    response = make_response(response)
+    if etag is not None:
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -87,6 +143,13 @@ def login():
 def dashboard():
     # Get the authenticated user
     user, _ = auth_manager.require_auth(session['token'])
+
+    # Nothing this page shows changed since the browser's copy
+    versions = db.get_data_versions(user['user_id'])
+    etag = data_etag(versions and (versions['user'], versions['settings']), user['user_id'])
+    cached = not_modified(etag)
+    if cached:
+        return cached
     
     # Get date range from query parameters or use default (last 7 days)
     end_date = datetime.now().date()
@@ -104,14 +167,21 @@ def dashboard():
         except ValueError:
             pass
     
-    # Get timesheet entries for the user
-    timesheet = db.get_user_timesheet(user['user_id'], start_date, end_date)
-    
-    # Get leave records for the user
-    leave_records = db.get_user_leaves(user['user_id'])
+    # Get one page of timesheet entries and leave records for the user
+    limit = request.args.get('limit')
+    try:
+        timesheet, next_cursor = db.get_user_timesheet_page(
+            user['user_id'], start_date, end_date, limit=limit, cursor=request.args.get('cursor'))
+    except ValueError:
+        timesheet, next_cursor = db.get_user_timesheet_page(user['user_id'], start_date, end_date, limit=limit)
+    try:
+        leave_records, next_leave_cursor = db.get_user_leaves_page(
+            user['user_id'], limit=limit, cursor=request.args.get('leave_cursor'))
+    except ValueError:
+        leave_records, next_leave_cursor = db.get_user_leaves_page(user['user_id'], limit=limit)
     
     # Get time owed using the same method as admin dashboard
-    staff_time = db.get_all_staff_time_owed()
+    staff_time = balances.get_all_staff_time_owed(user_id=user['user_id'])
     time_owed = 0
     
     # Find current user's time owed from the result
@@ -120,13 +190,17 @@ def dashboard():
             time_owed = staff['total_minutes_owed']
             break
     
-    return render_template('dashboard.html',
+    return with_etag(render_template('dashboard.html',
                          user=user,
                          timesheet=timesheet,
                          leave_records=leave_records,
                          start_date=start_date.strftime('%Y-%m-%d'),
                          end_date=end_date.strftime('%Y-%m-%d'),
-                         time_owed=time_owed)
+                         cursor=request.args.get('cursor'),
+                         next_cursor=next_cursor,
+                         leave_cursor=request.args.get('leave_cursor'),
+                         next_leave_cursor=next_leave_cursor,
+                         time_owed=time_owed), etag)
 
 @app.route('/admin_dashboard')
 @login_required
@@ -136,6 +210,14 @@ def admin_dashboard():
     # Verify that the user is an admin
     if user['role'] != 'Admin':
         return redirect(url_for('dashboard'))
+
+    # Any write anywhere can change this page, and so can the start or end of today's shift
+    versions = db.get_data_versions()
+    today_phase = calendar.day_phase(datetime.now().date())
+    etag = data_etag(versions and (versions['global'],), user['user_id'], today_phase)
+    cached = not_modified(etag)
+    if cached:
+        return cached
     
     # Get admin dashboard data
     total_staff = db.get_total_staff_count()
@@ -144,15 +226,14 @@ def admin_dashboard():
     today_attendance = db.get_today_attendance_all_staff()
     pending_leave_requests = db.get_pending_leave_requests()
     working_hours = db.get_working_hours()
-    staff_time_owed = db.get_all_staff_time_owed()
+    staff_time_owed = balances.get_all_staff_time_owed()
+    timesheets_for_review = db.get_timesheets_for_review()
+    exceptions = calendar.exceptions(datetime.now().date(), versions=versions) or {
+        'absent': [], 'late': [], 'missing_time_out': []
+    }
     
-    # Get list of all staff for deletion dropdown
-    query = "SELECT user_id, username, role FROM User ORDER BY username"
-    success, staff_list = db.execute_query(query)
-    if not success:
-        staff_list = []
     
-    return render_template('admin_dashboard.html',
+    return with_etag(render_template('admin_dashboard.html',
                          user=user,
                          total_staff=total_staff,
                          staff_present=staff_present,
@@ -161,8 +242,262 @@ def admin_dashboard():
                          pending_leave_requests=pending_leave_requests,
                          working_hours=working_hours,
                          staff_time_owed=staff_time_owed,
-                         staff_list=staff_list,
-                         today=datetime.now())
+                         exceptions=exceptions,
+                         timesheets_for_review=timesheets_for_review,
+                         today=datetime.now()), etag)
+
+@app.route('/search_staff')
+@login_required
+def search_staff():
+    # Verify that the user is an admin
+    user, _ = auth_manager.require_auth(session['token'])
+    if user['role'] != 'Admin':
+        return jsonify({
+            'success': False,
+            'message': 'Unauthorized access'
+        })
+
+    query = request.args.get('q', '').strip()
+    role = request.args.get('role')
+    if not query:
+        return jsonify({
+            'success': False,
+            'message': 'Search text is required'
+        })
+    if role not in (None, 'Admin', 'Staff'):
+        return jsonify({
+            'success': False,
+            'message': 'Invalid role'
+        })
+
+    try:
+        users, next_cursor = db.search_users(
+            query, role=role, limit=request.args.get('limit'), cursor=request.args.get('cursor'))
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'message': 'Invalid cursor'
+        })
+
+    return jsonify({
+        'success': True,
+        'users': [
+            {'user_id': row['user_id'], 'username': row['username'], 'email': row['email']}
+            for row in users
+        ],
+        'next_cursor': next_cursor
+    })
+
+@app.route('/search_notes')
+@login_required
+def search_notes():
+    user, _ = auth_manager.require_auth(session['token'])
+    text = request.args.get('q', '').strip()
+    source = request.args.get('source')
+
+    if not text:
+        return jsonify({
+            'success': False,
+            'message': 'Search text is required'
+        })
+    if source not in (None, 'timesheet', 'leave'):
+        return jsonify({
+            'success': False,
+            'message': 'Invalid source'
+        })
+
+    # Staff can only search their own notes
+    user_id = request.args.get('user_id') if user['role'] == 'Admin' else user['user_id']
+
+    try:
+        start_date = request.args.get('start_date')
+        end_date = request.args.get('end_date')
+        start_date = datetime.strptime(start_date, '%Y-%m-%d').date() if start_date else None
+        end_date = datetime.strptime(end_date, '%Y-%m-%d').date() if end_date else None
+        notes, next_cursor = db.search_notes(
+            text, user_id=int(user_id) if user_id else None, source=source,
+            start_date=start_date, end_date=end_date,
+            limit=request.args.get('limit'), cursor=request.args.get('cursor')
+        )
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'message': 'Invalid parameters'
+        })
+
+    return jsonify({
+        'success': True,
+        'results': [
+            {
+                'source': row['source'],
+                'leave_id': row['source_id'] if row['source'] == 'leave' else None,
+                'user_id': row['user_id'],
+                'username': row['username'],
+                'date': row['date'].strftime('%Y-%m-%d'),
+                'text': row['body'],
+                'score': round(float(row['score']), 4)
+            }
+            for row in notes
+        ],
+        'next_cursor': next_cursor
+    })
+
+@app.route('/calendar')
+@login_required
+def attendance_calendar():
+    user, _ = auth_manager.require_auth(session['token'])
+
+    try:
+        month = request.args.get('month')
+        month = datetime.strptime(month, '%Y-%m').date() if month else datetime.now().date()
+        if user['role'] != 'Admin':
+            # Staff only see their own month
+            user_id, user_ids = user['user_id'], None
+        elif request.args.get('user_id'):
+            user_id, user_ids = int(request.args['user_id']), None
+        elif request.args.get('user_ids'):
+            user_id, user_ids = None, [int(uid) for uid in request.args['user_ids'].split(',')]
+        else:
+            # The whole team
+            user_id, user_ids = None, None
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'message': 'Invalid parameters'
+        })
+
+    single = user_id is not None or (user_ids is not None and len(set(user_ids)) == 1)
+    versions = db.get_data_versions(user_id if user_id is not None else (user_ids[0] if single else None))
+    etag = None
+    if versions is not None:
+        scope = (versions['user'], versions['settings']) if single else (versions['global'],)
+        etag = data_etag(scope, user['user_id'])
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+
+    days = calendar.month(month, user_id=user_id, user_ids=user_ids, versions=versions)
+    if days is None:
+        return jsonify({
+            'success': False,
+            'message': 'Failed to load calendar'
+        })
+
+    return with_etag(jsonify({
+        'success': True,
+        'month': month.strftime('%Y-%m'),
+        'users': days
+    }), etag)
+
+@app.route('/attendance_exceptions')
+@login_required
+def attendance_exceptions():
+    # Verify that the user is an admin
+    user, _ = auth_manager.require_auth(session['token'])
+    if user['role'] != 'Admin':
+        return jsonify({
+            'success': False,
+            'message': 'Unauthorized access'
+        })
+
+    try:
+        day = request.args.get('date')
+        day = datetime.strptime(day, '%Y-%m-%d').date() if day else datetime.now().date()
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'message': 'Invalid date'
+        })
+
+    versions = db.get_data_versions()
+    etag = data_etag(versions and (versions['global'],), calendar.day_phase(day))
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    exceptions = calendar.exceptions(day, versions=versions)
+    if exceptions is None:
+        return jsonify({
+            'success': False,
+            'message': 'Failed to load attendance'
+        })
+
+    return with_etag(jsonify({
+        'success': True,
+        'date': day.strftime('%Y-%m-%d'),
+        **exceptions
+    }), etag)
+
+@app.route('/scheduler_status')
+@login_required
+def scheduler_status():
+    # Verify that the user is an admin
+    user, _ = auth_manager.require_auth(session['token'])
+    if user['role'] != 'Admin':
+        return jsonify({
+            'success': False,
+            'message': 'Unauthorized access'
+        })
+
+    history = get_job_history(db, limit=min(request.args.get('limit', 50, type=int), 500))
+    return jsonify({
+        'success': True,
+        # Timings of the runs this worker executed; other workers keep their own
+        'metrics': scheduler.metrics() if scheduler else None,
+        'history': [
+            {
+                'run_id': row['run_id'],
+                'job': row['job_name'],
+                'scheduled_for': row['scheduled_for'].strftime('%Y-%m-%d %H:%M'),
+                'runner': row['runner'],
+                'status': row['status'],
+                'started_at': row['started_at'].strftime('%Y-%m-%d %H:%M:%S'),
+                'duration_ms': row['duration_ms'],
+                'result': json.loads(row['result']) if row['result'] else None
+            }
+            for row in history
+        ]
+    })
+
+@app.route('/attendance_feed')
+@login_required
+def attendance_feed():
+    # Verify that the user is an admin
+    user, _ = auth_manager.require_auth(session['token'])
+    if user['role'] != 'Admin':
+        return jsonify({
+            'success': False,
+            'message': 'Unauthorized access'
+        }), 403
+
+    subscription = broker.subscribe(request.headers.get('Last-Event-ID'))
+    if subscription is None:
+        # Every stream holds a request thread; the page retries after Retry-After
+        response = jsonify({
+            'success': False,
+            'message': 'Too many live connections, try again later'
+        })
+        response.status_code = 503
+        response.headers['Retry-After'] = str(EVENT_RETRY_SECONDS)
+        return response
+
+    def stream():
+        try:
+            yield "retry: 5000\n\n"
+            deadline = time.monotonic() + EVENT_STREAM_SECONDS
+            while not subscription.closed and time.monotonic() < deadline:
+                event = subscription.get(EVENT_HEARTBEAT_SECONDS)
+                if event is None:
+                    yield ": keepalive\n\n"
+                else:
+                    yield f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+        finally:
+            broker.unsubscribe(subscription)
+
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
 
 @app.route('/update_working_hours', methods=['POST'])
 @login_required
@@ -223,21 +558,60 @@ def update_leave_status():
         'message': f'Leave request {status.lower()} successfully' if success else 'Failed to update leave status'
     })
 
+@app.route('/review_timesheet', methods=['POST'])
+@login_required
+def review_timesheet():
+    user, _ = auth_manager.require_auth(session['token'])
+
+    # Verify that the user is an admin
+    if user['role'] != 'Admin':
+        return jsonify({
+            'success': False,
+            'message': 'Unauthorized access'
+        })
+
+    data = request.get_json()
+    timesheet_id = data.get('timesheet_id')
+    time_out = data.get('time_out')
+
+    try:
+        time_out = datetime.strptime(time_out, '%H:%M').time() if time_out else None
+    except ValueError:
+        time_out = False
+    if not timesheet_id or time_out is False:
+        return jsonify({
+            'success': False,
+            'message': 'Invalid request parameters'
+        })
+
+    success = db.review_timesheet(timesheet_id, time_out)
+
+    return jsonify({
+        'success': success,
+        'message': 'Timesheet confirmed successfully' if success else 'Failed to confirm timesheet'
+    })
+
 @app.route('/check_time_status')
 @login_required
 def check_time_status():
     user, _ = auth_manager.require_auth(session['token'])
+    versions = db.get_data_versions(user['user_id'])
+    etag = data_etag(versions and (versions['user'],), user['user_id'])
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
     today_entry = db.get_today_timesheet(user['user_id'])
     
     can_time_in = today_entry is None
     can_time_out = today_entry is not None and today_entry['time_out'] is None
     current_note = today_entry['notes'] if today_entry else None
     
-    return jsonify({
+    return with_etag(jsonify({
         'can_time_in': can_time_in,
         'can_time_out': can_time_out,
         'current_note': current_note
-    })
+    }), etag)
 
 @app.route('/save_note', methods=['POST'])
 @login_required
@@ -297,6 +671,76 @@ def time_out():
         'message': 'Time out recorded successfully' if success else 'Failed to record time out'
     })
 
+def parse_punch_event(event, now):
+    """Validate one offline punch event, returning (event, error)"""
+    if not isinstance(event, dict):
+        return None, 'Invalid event'
+    key = str(event.get('key') or '').strip()
+    if not key or len(key) > 64:
+        return None, 'Missing or too long idempotency key'
+    if event.get('type') not in ('in', 'out'):
+        return {'key': key}, "Type must be 'in' or 'out'"
+    try:
+        timestamp = datetime.fromisoformat(str(event.get('timestamp')))
+    except ValueError:
+        return {'key': key}, 'Invalid timestamp'
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone().replace(tzinfo=None)
+    if timestamp > now + timedelta(seconds=PUNCH_SYNC_MAX_SKEW_SECONDS):
+        return {'key': key}, 'Timestamp is in the future'
+    if timestamp.date() < now.date() - timedelta(days=PUNCH_SYNC_MAX_AGE_DAYS):
+        return {'key': key}, 'Timestamp is too old to sync'
+    return {'key': key, 'type': event['type'], 'timestamp': min(timestamp, now)}, None
+
+@app.route('/sync_punches', methods=['POST'])
+@login_required
+def sync_punches():
+    user, _ = auth_manager.require_auth(session['token'])
+    data = request.get_json(silent=True) or {}
+    events = data.get('events')
+
+    if not isinstance(events, list) or not events:
+        return jsonify({
+            'success': False,
+            'message': 'A list of events is required'
+        })
+    if len(events) > PUNCH_SYNC_MAX_EVENTS:
+        return jsonify({
+            'success': False,
+            'message': f'At most {PUNCH_SYNC_MAX_EVENTS} events per sync'
+        })
+
+    # Invalid events are answered here and never stored, so a fixed client can resend them
+    now = datetime.now()
+    parsed = [parse_punch_event(event, now) for event in events]
+    valid = [event for event, error in parsed if error is None]
+    applied = iter([])
+    if valid:
+        success, results = db.sync_punches(user['user_id'], valid)
+        if not success:
+            return jsonify({
+                'success': False,
+                'message': 'Failed to sync punches'
+            })
+        applied = iter(results)
+
+    results = []
+    for event, error in parsed:
+        if error is None:
+            results.append(next(applied))
+        else:
+            results.append({
+                'key': event['key'] if event else None,
+                'status': 'invalid',
+                'message': error,
+                'replayed': False
+            })
+
+    return jsonify({
+        'success': True,
+        'results': results
+    })
+
 @app.route('/submit_leave', methods=['POST'])
 @login_required
 def submit_leave():
@@ -419,12 +863,86 @@ def delete_staff():
         })
 
     success = db.delete_staff(user_id)
+    if success:
+        # History is removed in the background in small batches
+        start_staff_purge(db)
 
     return jsonify({
         'success': success,
         'message': 'Staff member deleted successfully' if success else 'Failed to delete staff member'
     })
 
+@app.route('/import_punches', methods=['POST'])
+@login_required
+def import_punches():
+    # Verify that the user is an admin
+    user, _ = auth_manager.require_auth(session['token'])
+    if user['role'] != 'Admin':
+        return jsonify({
+            'success': False,
+            'message': 'Unauthorized access'
+        })
+
+    file = request.files.get('file')
+    if not file or not file.filename.lower().endswith('.csv'):
+        return jsonify({
+            'success': False,
+            'message': 'A CSV file is required'
+        })
+
+    filename = secure_filename(file.filename)
+    job_id = create_import_job(db, filename, user['user_id'])
+    if job_id is None:
+        return jsonify({
+            'success': False,
+            'message': 'Failed to start import'
+        })
+
+    # The import runs in the background; poll /import_punches/<job_id> for progress
+    filepath = os.path.join(IMPORT_FOLDER, f"{job_id}_{filename}")
+    file.save(filepath)
+    start_import_job(db, job_id, filepath)
+
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'message': 'Import started'
+    })
+
+@app.route('/import_punches/<int:job_id>')
+@login_required
+def import_punches_status(job_id):
+    # Verify that the user is an admin
+    user, _ = auth_manager.require_auth(session['token'])
+    if user['role'] != 'Admin':
+        return jsonify({
+            'success': False,
+            'message': 'Unauthorized access'
+        })
+
+    job = get_import_job(db, job_id)
+    if job is None:
+        return jsonify({
+            'success': False,
+            'message': 'Import not found'
+        })
+
+    return jsonify({
+        'success': True,
+        'job': {
+            'job_id': job['job_id'],
+            'filename': job['filename'],
+            'status': job['status'],
+            'rows_read': job['rows_read'],
+            'rejected': job['rejected'],
+            'duplicates': job['duplicates'],
+            'inserted': job['inserted'],
+            'errors': job['errors'],
+            'created_at': job['created_at'].strftime('%Y-%m-%d %H:%M:%S'),
+            'finished_at': job['finished_at'].strftime('%Y-%m-%d %H:%M:%S') if job['finished_at'] else None
+        }
+    })
+
 @app.route('/get_staff_timesheet')
 @login_required
 def get_staff_timesheet():
@@ -450,16 +968,35 @@ def get_staff_timesheet():
         # Convert string dates to datetime objects
         start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
         end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
+
+        # The page only changes when this staff member's data does
+        versions = db.get_data_versions(int(staff_id))
+        etag = data_etag(versions and (versions['user'],))
+        cached = not_modified(etag)
+        if cached:
+            return cached
         
-        # Use our existing database method to get timesheet entries
-        timesheet_entries = db.get_user_timesheet(staff_id, start_date, end_date)
+        # Get one page of timesheet entries
+        try:
+            timesheet_entries, next_cursor = db.get_user_timesheet_page(
+                staff_id, start_date, end_date,
+                limit=request.args.get('limit'),
+                cursor=request.args.get('cursor')
+            )
+        except ValueError:
+            return jsonify({
+                'success': False,
+                'message': 'Invalid cursor'
+            })
         
         # Format the timesheet data
         timesheet_data = []
         for entry in timesheet_entries:
             status = 'Present'
-            if entry['notes'] and 'leave' in entry['notes'].lower():
+            if entry['entry_type'] == 'Leave':
                 status = 'On Leave'
+            elif entry['entry_type'] == 'Holiday':
+                status = 'Holiday'
             
             timesheet_data.append({
                 'date': entry['date'].strftime('%Y-%m-%d'),
@@ -470,10 +1007,11 @@ def get_staff_timesheet():
                 'notes': entry['notes'] or '-'
             })
         
-        return jsonify({
+        return with_etag(jsonify({
             'success': True,
-            'timesheet': timesheet_data
-        })
+            'timesheet': timesheet_data,
+            'next_cursor': next_cursor
+        }), etag)
         
     except Exception as e:
         return jsonify({
@@ -481,6 +1019,16 @@ def get_staff_timesheet():
             'message': str(e)
         })
 
+@app.route('/health')
+def health():
+    # Anyone may poll the breaker state; only admins see the underlying errors
+    is_admin = False
+    if 'token' in session:
+        user, error = auth_manager.require_auth(session['token'])
+        is_admin = not error and user['role'] == 'Admin'
+    status = db.health(include_errors=is_admin)
+    return jsonify(status), 200 if status['healthy'] else 503
+
 @app.route('/logout')
 def logout():
     session.pop('token', None)
@@ -524,8 +1072,8 @@ def generate_report():
     elements.append(Spacer(1, 20))
     
     # Get all staff users
-    query = "SELECT user_id, username FROM User WHERE role = 'Staff'"
-    success, staff_users = db.execute_query(query)
+    query = "SELECT user_id, username FROM User WHERE role = 'Staff' AND deleted_at IS NULL"
+    success, staff_users = db.execute_query(query, read_only=True)
     print(f"Staff users found: {len(staff_users) if success and staff_users else 0}")  # Debug print
     
     if not success or not staff_users:
@@ -535,26 +1083,18 @@ def generate_report():
         }), 500
     
     # Calculate time owed and total hours worked for each staff member in the specified date range
+    staff_time_owed = balances.calculate_staff_time_owed(start_date, end_date)
+    staff_worked_minutes = db.get_worked_minutes_by_user(start_date, end_date)
     time_owed_data = [['Staff Name', 'Time Owed', 'Total Hours']]
     for staff in staff_users:
-        # Calculate time owed for the specified date range
-        time_owed = db.calculate_time_owed(staff['user_id'], start_date, end_date)
+        # Time owed for the specified date range
+        time_owed = staff_time_owed.get(staff['user_id'], 0)
         hours = abs(time_owed) // 60
         minutes = abs(time_owed) % 60
         time_str = f"{'+ ' if time_owed < 0 else '- '}{hours} hours {minutes} minutes"
         
-        # Calculate total hours worked
-        query = """
-            SELECT 
-                SUM(TIME_TO_SEC(TIMEDIFF(time_out, time_in))) / 3600 as total_hours
-            FROM Timesheet 
-            WHERE user_id = %s 
-            AND date BETWEEN %s AND %s
-            AND time_in IS NOT NULL 
-            AND time_out IS NOT NULL
-        """
-        success, result = db.execute_query(query, (staff['user_id'], start_date, end_date))
-        total_hours = result[0]['total_hours'] if success and result and result[0]['total_hours'] is not None else 0
+        # Total hours worked
+        total_hours = staff_worked_minutes.get(staff['user_id'], 0) / 60
         total_hours_str = f"{total_hours:.2f} hours"
         
         time_owed_data.append([staff['username'], time_str, total_hours_str])
@@ -584,13 +1124,14 @@ def generate_report():
         SELECT u.username, l.start_date, l.end_date, l.leave_type, l.status
         FROM LeaveRecord l
         JOIN User u ON l.user_id = u.user_id
-        WHERE l.start_date BETWEEN %s AND %s
+        WHERE u.deleted_at IS NULL
+        AND (l.start_date BETWEEN %s AND %s
         OR l.end_date BETWEEN %s AND %s
-        OR (l.start_date <= %s AND l.end_date >= %s)
+        OR (l.start_date <= %s AND l.end_date >= %s))
         ORDER BY l.start_date
     """
     print("Executing leave records query with params:", (start_date, end_date, start_date, end_date, start_date, end_date))  # Debug print
-    success, leave_records = db.execute_query(query, (start_date, end_date, start_date, end_date, start_date, end_date))
+    success, leave_records = db.execute_query(query, (start_date, end_date, start_date, end_date, start_date, end_date), read_only=True)
     print(f"Leave records query success: {success}")  # Debug print
     print(f"Number of leave records found: {len(leave_records) if success and leave_records else 0}")  # Debug print
     